@@ -1,12 +1,14 @@
 import datetime
-from google.cloud import storage
-import google.auth
-import google.auth.transport.requests
-import google.oauth2.id_token
 import functions_framework
-from firebase_admin import auth, credentials, initialize_app
+from firebase_admin import credentials, initialize_app
+from function_auth import authenticate
+from storage_pool import get_credentials, get_storage_client
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 service_account_key_path = os.environ.get("FIREBASE_SERVICE_ACCOUNT_KEY")
 print(f"service_account_key_path: {service_account_key_path}")
@@ -16,6 +18,108 @@ if service_account_key_path:
 else:
     initialize_app()
 
+# 署名付きURLの有効期限 (秒)。リクエストの expirationTime で上書きできる
+SIGNED_URL_TTL_SECONDS = int(os.environ.get("SIGNED_URL_TTL_SECONDS", "600"))
+# キャッシュ済みURLを返すために必要な残り有効期間 (秒)
+SIGNED_URL_MIN_REMAINING_SECONDS = int(os.environ.get("SIGNED_URL_MIN_REMAINING_SECONDS", "300"))
+SIGNED_URL_CACHE_MAX_ENTRIES = int(os.environ.get("SIGNED_URL_CACHE_MAX_ENTRIES", "2048"))
+# V4 署名で指定できる最大の有効期限 (7日)
+SIGNED_URL_MAX_TTL_SECONDS = 7 * 24 * 60 * 60
+# 一括署名で受け付ける最大件数と並列数
+SIGNED_URL_BATCH_MAX_ITEMS = int(os.environ.get("SIGNED_URL_BATCH_MAX_ITEMS", "100"))
+SIGNING_MAX_WORKERS = int(os.environ.get("SIGNING_MAX_WORKERS", "8"))
+
+# (bucket, object, download, 有効期限の秒数) -> (有効期限のUNIX時刻, URL)
+_signed_url_cache = OrderedDict()
+_signed_url_cache_lock = threading.Lock()
+
+_signing_executor = ThreadPoolExecutor(max_workers=SIGNING_MAX_WORKERS)
+
+
+def _parse_expiration(value):
+    """リクエストの expirationTime (秒) を検証します。未指定の場合は SIGNED_URL_TTL_SECONDS を返し、不正な場合は None を返します。"""
+    if value is None:
+        return SIGNED_URL_TTL_SECONDS
+    if isinstance(value, bool) or not isinstance(value, int):
+        return None
+    if not 0 < value <= SIGNED_URL_MAX_TTL_SECONDS:
+        return None
+    return value
+
+
+def _get_signed_url(bucket_name, file_name, is_download, ttl_seconds=SIGNED_URL_TTL_SECONDS):
+    """署名付きURLを返します。十分な残り有効期間があるキャッシュは再利用します。"""
+    key = (bucket_name, file_name, bool(is_download), ttl_seconds)
+    now = time.time()
+    with _signed_url_cache_lock:
+        cached = _signed_url_cache.get(key)
+        if cached and cached[0] - now >= SIGNED_URL_MIN_REMAINING_SECONDS:
+            _signed_url_cache.move_to_end(key)
+            return cached[1]
+
+    signing_credentials = get_credentials()
+    storage_client = get_storage_client()
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(file_name)
+
+    # is_downloadがTrueの場合、Content-Dispositionヘッダーを設定
+    response_disposition = None
+    if is_download:
+        # ファイル名をエンコードして、日本語などにも対応
+        encoded_filename = os.path.basename(file_name)
+        response_disposition = f"attachment; filename*=UTF-8''{encoded_filename}"
+    url = blob.generate_signed_url(
+        version="v4",
+        expiration=datetime.timedelta(seconds=ttl_seconds),
+        method="GET",
+        service_account_email=signing_credentials.service_account_email,
+        access_token=signing_credentials.token,
+        response_disposition=response_disposition,  # download=trueの場合に設定される
+    )
+
+    with _signed_url_cache_lock:
+        _signed_url_cache[key] = (now + ttl_seconds, url)
+        _signed_url_cache.move_to_end(key)
+        while len(_signed_url_cache) > SIGNED_URL_CACHE_MAX_ENTRIES:
+            _signed_url_cache.popitem(last=False)
+    return url
+
+
+def _sign_batch(bucket_name, items, default_download, ttl_seconds=SIGNED_URL_TTL_SECONDS):
+    """
+    複数オブジェクトを並列で署名します。
+
+    Args:
+        items: fileName の文字列、または {"fileName": ..., "download": ...} のリスト
+
+    Returns:
+        リクエストと同じ順序の {"fileName", "download", "signedUrl" または "error"} のリスト
+        (同じ fileName が download の値違いで複数回指定されても、それぞれの結果を返す)
+    """
+    results = []
+    futures = []
+    for item in items:
+        if isinstance(item, str) and item:
+            file_name, is_download = item, default_download
+        elif isinstance(item, dict) and isinstance(item.get('fileName'), str) and item['fileName']:
+            file_name, is_download = item['fileName'], item.get('download', default_download)
+        else:
+            results.append({"fileName": None, "error": "Missing or invalid fileName."})
+            futures.append(None)
+            continue
+        results.append({"fileName": file_name, "download": bool(is_download)})
+        futures.append(_signing_executor.submit(_get_signed_url, bucket_name, file_name, is_download, ttl_seconds))
+
+    for result, future in zip(results, futures):
+        if future is None:
+            continue
+        try:
+            result["signedUrl"] = future.result()
+        except Exception as e:
+            print(f"Error generating signed URL for {result['fileName']}: {e}")
+            result["error"] = str(e)
+    return results
+
 
 @functions_framework.http
 def create_signed_url(request):
@@ -35,53 +139,10 @@ def create_signed_url(request):
         'Access-Control-Allow-Origin': '*'
     }
 
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return ('Unauthorized: Missing token', 401, headers)
+    identity, error_response = authenticate(request, headers)
+    if error_response:
+        return error_response
 
-    token = auth_header.split('Bearer ')[1]
-    is_authenticated = False
-
-    # 1. Firebase セッションクッキーとして検証を試みる
-    try:
-        # check_revokedをTrueにすることで、失効したセッションを拒否できます
-        decoded_token = auth.verify_session_cookie(token, check_revoked=True)
-        uid = decoded_token['uid']
-        print(f"Authenticated as Firebase user: {uid}")
-        is_authenticated = True
-    except auth.InvalidSessionCookieError:
-        print("Invalid Firebase session cookie. Trying Google Cloud authentication.")
-        # 2. Firebaseの検証が失敗した場合、Google CloudのIDトークンとして検証を試みる
-        try:
-            # トークンを検証するURLを指定 (トークンの 'aud' クレームと一致させる)
-            # このCloud FunctionのURLを指定します。
-            cloud_run_url = os.environ.get('CLOUD_RUN_AUD')
-            if not cloud_run_url:
-                 print("CLOUD_RUN_AUD environment variable is not set.")
-                 return ('Unauthorized: Server configuration error', 500, headers)
-
-            # IDトークンのペイロードを取得
-            token_info = google.oauth2.id_token.verify_oauth2_token(
-                token,
-                google.auth.transport.requests.Request(),
-                audience=cloud_run_url
-            )
-            print(f"Authenticated as Google Cloud identity: {token_info.get('email', 'Unknown')}")
-            is_authenticated = True
-        except Exception as e:
-            print(f"Google Cloud ID token verification failed: {e}")
-            # この時点でどちらの認証も失敗
-            return ('Unauthorized: Invalid token', 401, headers)
-    except Exception as e:
-        # セッションクッキー検証で予期せぬエラーが発生した場合
-        print(f"Firebase session cookie verification failed with an unexpected error: {e}")
-        return ('Unauthorized: Token verification failed', 401, headers)
-
-    if not is_authenticated:
-        return ('Unauthorized: Invalid token', 401, headers)
-
-    credentials, _ = google.auth.default()
-    credentials.refresh(google.auth.transport.requests.Request())
     # POSTリクエストのみを許可
     if request.method == 'POST':
         request_json = request.get_json(silent=True)
@@ -91,31 +152,25 @@ def create_signed_url(request):
         file_name = request_json.get('fileName')
         # リクエストボディから 'download' フラグを取得 (デフォルトは False)
         is_download = request_json.get('download', False)
+        # URLの有効期限 (秒)。省略時は SIGNED_URL_TTL_SECONDS
+        ttl_seconds = _parse_expiration(request_json.get('expirationTime'))
     else:
         return ('Method not allowed', 405, headers)
 
     if not bucket_name or not file_name:
         return ('Bad Request: Missing bucketName or fileName.', 400, headers)
+    if ttl_seconds is None:
+        return (f'Bad Request: expirationTime must be an integer between 1 and {SIGNED_URL_MAX_TTL_SECONDS}.', 400, headers)
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
+    # fileName がリストの場合は一括で署名し、項目ごとの結果を返す
+    if isinstance(file_name, list):
+        if len(file_name) > SIGNED_URL_BATCH_MAX_ITEMS:
+            return (f'Bad Request: Too many files (max {SIGNED_URL_BATCH_MAX_ITEMS}).', 400, headers)
+        results = _sign_batch(bucket_name, file_name, is_download, ttl_seconds)
+        return (json.dumps({"results": results}), 200, headers)
 
-    # is_downloadがTrueの場合、Content-Dispositionヘッダーを設定
-    response_disposition = None
-    if is_download:
-        # ファイル名をエンコードして、日本語などにも対応
-        encoded_filename = os.path.basename(file_name)
-        response_disposition = f"attachment; filename*=UTF-8''{encoded_filename}"
     try:
-        url = blob.generate_signed_url(
-            version="v4",
-            expiration=datetime.timedelta(minutes=10),
-            method="GET",
-            service_account_email=credentials.service_account_email,
-            access_token=credentials.token,
-            response_disposition=response_disposition,  # download=trueの場合に設定される
-        )
+        url = _get_signed_url(bucket_name, file_name, is_download, ttl_seconds)
         # 常に署名付きURLをJSONで返す
         return (json.dumps({"signedUrl": url}), 200, headers)
 
@@ -0,0 +1,70 @@
+"""
+プロセス全体で共有する GCS クライアントと認証情報。
+
+クライアントは初回利用時に1度だけ作成し、コネクションプール付きの HTTP セッションを使い回す。
+Cloud Functions のウォームインスタンスとエージェントの両方で使用する。
+
+エージェントは shared.storage_pool として、各関数はディレクトリ内のコピーからインポートする。
+"""
+import datetime
+import os
+import threading
+
+import google.auth
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.cloud import storage
+
+
+# GCS への HTTP コネクションプールのサイズ
+GCS_POOL_MAXSIZE = int(os.environ.get("GCS_POOL_MAXSIZE", "32"))
+# アクセストークンの有効期限がこの秒数を切ったら更新する
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+_lock = threading.RLock()
+_credentials = None
+_project = None
+_storage_client = None
+
+
+def _load_credentials():
+    global _credentials, _project
+    with _lock:
+        if _credentials is None:
+            _credentials, _project = google.auth.default(scopes=_SCOPES)
+        return _credentials
+
+
+def get_credentials():
+    """
+    リフレッシュ済みの認証情報を返します。
+    アクセストークンは有効期限の少し前まで使い回します。
+    """
+    with _lock:
+        credentials = _load_credentials()
+        expiry = credentials.expiry
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if (
+            not credentials.token
+            or expiry is None
+            or (expiry - now).total_seconds() < TOKEN_REFRESH_MARGIN_SECONDS
+        ):
+            credentials.refresh(Request())
+        return credentials
+
+
+def get_storage_client():
+    """コネクションプール付きの storage.Client を返します。初回呼び出し時に作成します。"""
+    global _storage_client
+    if _storage_client is not None:
+        return _storage_client
+    with _lock:
+        if _storage_client is None:
+            credentials = _load_credentials()
+            session = AuthorizedSession(credentials)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=GCS_POOL_MAXSIZE, pool_maxsize=GCS_POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            _storage_client = storage.Client(project=_project, credentials=credentials, _http=session)
+        return _storage_client
@@ -1,9 +1,8 @@
-from google.cloud import storage
-import google.auth
-import google.auth.transport.requests
-import google.oauth2.id_token
 import functions_framework
-from firebase_admin import auth, credentials, initialize_app
+from firebase_admin import credentials, initialize_app
+from function_auth import authenticate
+import user_manifest
+from storage_pool import get_storage_client
 import os
 
 # from dotenv import load_dotenv
@@ -17,6 +16,54 @@ if service_account_key_path:
 else:
     initialize_app()
 
+# 1ページあたりの最大件数
+LIST_FILES_MAX_PAGE_SIZE = int(os.environ.get("LIST_FILES_MAX_PAGE_SIZE", "1000"))
+
+# list_blobs で取得するフィールド (必要なメタデータのみ取得する)
+_BASE_ITEM_FIELDS = "name"
+_METADATA_ITEM_FIELDS = "name,size,contentType,updated"
+
+
+def _list_fields(include_metadata):
+    item_fields = _METADATA_ITEM_FIELDS if include_metadata else _BASE_ITEM_FIELDS
+    return f"items({item_fields}),prefixes,nextPageToken"
+
+
+def _file_entry(bucket_name, blob, include_metadata):
+    entry = {
+        'name': os.path.basename(blob.name),
+        'path': blob.name,
+        'gs_url': f"gs://{bucket_name}/{blob.name}"
+    }
+    if include_metadata:
+        entry['size'] = blob.size
+        entry['content_type'] = blob.content_type
+        entry['updated'] = blob.updated.isoformat() if blob.updated else None
+    return entry
+
+
+def _list_from_manifest(storage_client, bucket_name, base_folder_name, user_id, search_prefix, include_metadata):
+    """マニフェストからファイル一覧を返します。マニフェストがなければリストして再構築します。"""
+    bucket = storage_client.bucket(bucket_name)
+    manifest = user_manifest.load(bucket, base_folder_name, user_id)
+    if manifest is None:
+        print(f"Rebuilding manifest for {user_id} under {base_folder_name}.")
+        manifest = user_manifest.rebuild(bucket, base_folder_name, user_id)
+
+    files = []
+    for path, meta in sorted(manifest['files'].items()):
+        if not path.startswith(search_prefix) or path == search_prefix:
+            continue
+        entry = {
+            'name': os.path.basename(path),
+            'path': path,
+            'gs_url': f"gs://{bucket_name}/{path}"
+        }
+        if include_metadata:
+            entry.update(meta)
+        files.append(entry)
+    return files
+
 
 @functions_framework.http
 def list_files(request):
@@ -36,50 +83,10 @@ def list_files(request):
         'Access-Control-Allow-Origin': '*'
     }
 
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return ('Unauthorized: Missing token', 401, headers)
-
-    token = auth_header.split('Bearer ')[1]
-    is_authenticated = False
-
-    # 1. Firebase セッションクッキーとして検証を試みる
-    try:
-        # check_revokedをTrueにすることで、失効したセッションを拒否できます
-        decoded_token = auth.verify_session_cookie(token, check_revoked=True)
-        uid = decoded_token['uid']
-        print(f"Authenticated as Firebase user: {uid}")
-        is_authenticated = True
-    except auth.InvalidSessionCookieError:
-        print("Invalid Firebase session cookie. Trying Google Cloud authentication.")
-        # 2. Firebaseの検証が失敗した場合、Google CloudのIDトークンとして検証を試みる
-        try:
-            # トークンを検証するURLを指定 (トークンの 'aud' クレームと一致させる)
-            # このCloud FunctionのURLを指定します。
-            cloud_run_url = os.environ.get('CLOUD_RUN_AUD')
-            if not cloud_run_url:
-                 print("CLOUD_RUN_AUD environment variable is not set.")
-                 return ('Unauthorized: Server configuration error', 500, headers)
-
-            # IDトークンのペイロードを取得
-            token_info = google.oauth2.id_token.verify_oauth2_token(
-                token,
-                google.auth.transport.requests.Request(),
-                audience=cloud_run_url
-            )
-            print(f"Authenticated as Google Cloud identity: {token_info.get('email', 'Unknown')}")
-            is_authenticated = True
-        except Exception as e:
-            print(f"Google Cloud ID token verification failed: {e}")
-            # この時点でどちらの認証も失敗
-            return ('Unauthorized: Invalid token', 401, headers)
-    except Exception as e:
-        # セッションクッキー検証で予期せぬエラーが発生した場合
-        print(f"Firebase session cookie verification failed with an unexpected error: {e}")
-        return ('Unauthorized: Token verification failed', 401, headers)
-
-    if not is_authenticated:
-        return ('Unauthorized: Invalid token', 401, headers)
+    identity, error_response = authenticate(request, headers)
+    if error_response:
+        return error_response
+    uid = identity['uid']
     
 
     request_json = request.get_json(silent=True)
@@ -102,25 +109,72 @@ def list_files(request):
 
     search_prefix = f"{base_folder_name.rstrip('/')}/{user_folder_name}/"
 
+    # ページング・フォルダ表示・メタデータ取得のオプション
+    page_token = request_json.get('page_token')
+    max_results = request_json.get('max_results')
+    delimiter = request_json.get('delimiter')
+    include_metadata = bool(request_json.get('include_metadata', False))
+
+    if max_results is not None:
+        try:
+            max_results = int(max_results)
+        except (TypeError, ValueError):
+            return {'error': 'max_results は整数で指定してください。'}, 400, headers
+        if max_results <= 0:
+            return {'error': 'max_results は1以上で指定してください。'}, 400, headers
+        max_results = min(max_results, LIST_FILES_MAX_PAGE_SIZE)
+
+    list_args = {
+        'prefix': search_prefix,
+        'fields': _list_fields(include_metadata),
+    }
+    if delimiter:
+        list_args['delimiter'] = delimiter
+    if max_results:
+        list_args['page_size'] = max_results
+    if page_token:
+        list_args['page_token'] = page_token
+
     try:
-        storage_client = storage.Client()
-        blobs = storage_client.list_blobs(bucket_name, prefix=search_prefix)
-
-        files = []
-        for blob in blobs:
-            if blob.name == search_prefix:
-                continue
-            
-            file_name = os.path.basename(blob.name)
-            gs_url = f"gs://{bucket_name}/{blob.name}"
-
-            files.append({
-                'name': file_name,
-                'path': blob.name,
-                'gs_url': gs_url
-            })
-        
-        return {'files': files}, 200, headers
+        storage_client = get_storage_client()
+
+        # ページングやフォルダ表示を使わない通常の一覧はマニフェストから返す
+        if not (max_results or page_token or delimiter):
+            files = _list_from_manifest(
+                storage_client, bucket_name, base_folder_name.rstrip('/'),
+                user_id_from_path, search_prefix, include_metadata
+            )
+            return {'files': files}, 200, headers
+
+        blobs = storage_client.list_blobs(bucket_name, **list_args)
+
+        if max_results:
+            # 1ページ分のみ取得し、続きは next_page_token で要求してもらう
+            page = next(blobs.pages, None)
+            blob_items = list(page) if page is not None else []
+        else:
+            blob_items = list(blobs)
+
+        files = [
+            _file_entry(bucket_name, blob, include_metadata)
+            for blob in blob_items
+            if blob.name != search_prefix
+        ]
+        response = {'files': files}
+
+        if delimiter:
+            response['folders'] = [
+                {
+                    'name': os.path.basename(prefix.rstrip(delimiter)),
+                    'path': prefix,
+                    'gs_url': f"gs://{bucket_name}/{prefix}"
+                }
+                for prefix in sorted(blobs.prefixes)
+            ]
+        if blobs.next_page_token:
+            response['next_page_token'] = blobs.next_page_token
+
+        return response, 200, headers
 
     except Exception as e:
         return {'error': str(e)}, 500, headers
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Cloud Functions 共通の認証モジュール。
+
+Firebase セッションクッキー → Google Cloud ID トークンの順で検証する。
+ウォームインスタンスではデコード結果と Google の公開証明書をキャッシュし、
+証明書の取得には使い回しの HTTP セッションを使う。
+
+各関数のディレクトリにはこのファイルのコピーを置いている (デプロイされるのは関数のディレクトリだけのため)。
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import google.auth.transport
+import google.auth.transport.requests
+import google.oauth2.id_token
+import requests
+from firebase_admin import auth
+
+
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", "512"))
+# Firebase の失効チェックを省略してキャッシュを信頼する最大秒数
+AUTH_REVOCATION_WINDOW_SECONDS = int(os.environ.get("AUTH_REVOCATION_WINDOW_SECONDS", "300"))
+# トークンの exp より何秒前にキャッシュを失効させるか
+AUTH_EXPIRY_MARGIN_SECONDS = int(os.environ.get("AUTH_EXPIRY_MARGIN_SECONDS", "30"))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class _CertCachingRequest(google.auth.transport.Request):
+    """
+    GET レスポンスを Cache-Control の max-age が切れるまで保持するトランスポート。
+    verify_oauth2_token が毎回取得する公開証明書の再取得を防ぐ。
+    """
+
+    def __init__(self, inner: google.auth.transport.Request):
+        self._inner = inner
+        self._cache: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        if method != "GET" or body is not None:
+            return self._inner(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(url)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        response = self._inner(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+        if response.status == 200:
+            match = _MAX_AGE_RE.search(response.headers.get("cache-control", ""))
+            if match:
+                with self._lock:
+                    self._cache[url] = (now + int(match.group(1)), response)
+        return response
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_MAXSIZE, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# インスタンス内で共有するトランスポート
+auth_request = _CertCachingRequest(google.auth.transport.requests.Request(session=_build_session()))
+
+_token_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    now = time.time()
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        if cached is None:
+            return None
+        if cached[0] <= now:
+            del _token_cache[key]
+            return None
+        _token_cache.move_to_end(key)
+        return cached[1]
+
+
+def _cache_put(key: str, identity: Dict[str, Any], exp: Optional[float], window: Optional[int]) -> None:
+    now = time.time()
+    expires_at = float("inf")
+    if exp is not None:
+        expires_at = float(exp) - AUTH_EXPIRY_MARGIN_SECONDS
+    if window is not None:
+        expires_at = min(expires_at, now + window)
+    if expires_at <= now or expires_at == float("inf"):
+        return
+    with _token_cache_lock:
+        _token_cache[key] = (expires_at, identity)
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > AUTH_CACHE_MAX_ENTRIES:
+            _token_cache.popitem(last=False)
+
+
+def authenticate(request, headers: Dict[str, str]):
+    """
+    リクエストの Bearer トークンを検証します。
+
+    Returns:
+        (identity, None) または (None, エラーレスポンスのタプル)。
+        identity は 'uid' (Firebase ユーザーの場合のみ) と 'email' を持つ辞書。
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None, ('Unauthorized: Missing token', 401, headers)
+
+    token = auth_header.split('Bearer ')[1]
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    identity = _cache_get(key)
+    if identity is not None:
+        return identity, None
+
+    # 1. Firebase セッションクッキーとして検証を試みる
+    try:
+        # check_revokedをTrueにすることで、失効したセッションを拒否できます
+        decoded_token = auth.verify_session_cookie(token, check_revoked=True)
+        identity = {'uid': decoded_token['uid'], 'email': decoded_token.get('email')}
+        print(f"Authenticated as Firebase user: {identity['uid']}")
+        _cache_put(key, identity, decoded_token.get('exp'), AUTH_REVOCATION_WINDOW_SECONDS)
+        return identity, None
+    except auth.InvalidSessionCookieError:
+        print("Invalid Firebase session cookie. Trying Google Cloud authentication.")
+    except Exception as e:
+        # セッションクッキー検証で予期せぬエラーが発生した場合
+        print(f"Firebase session cookie verification failed with an unexpected error: {e}")
+        return None, ('Unauthorized: Token verification failed', 401, headers)
+
+    # 2. Firebaseの検証が失敗した場合、Google CloudのIDトークンとして検証を試みる
+    # トークンの 'aud' クレームと一致させるURL
+    cloud_run_url = os.environ.get('CLOUD_RUN_AUD')
+    if not cloud_run_url:
+        print("CLOUD_RUN_AUD environment variable is not set.")
+        return None, ('Unauthorized: Server configuration error', 500, headers)
+    try:
+        token_info = google.oauth2.id_token.verify_oauth2_token(
+            token,
+            auth_request,
+            audience=cloud_run_url
+        )
+    except Exception as e:
+        print(f"Google Cloud ID token verification failed: {e}")
+        # この時点でどちらの認証も失敗
+        return None, ('Unauthorized: Invalid token', 401, headers)
+
+    identity = {'uid': None, 'email': token_info.get('email')}
+    print(f"Authenticated as Google Cloud identity: {identity['email'] or 'Unknown'}")
+    _cache_put(key, identity, token_info.get('exp'), None)
+    return identity, None
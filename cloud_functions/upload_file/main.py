@@ -1,11 +1,14 @@
 import base64
-from google.cloud import storage
-import google.auth
-import google.auth.transport.requests
-import google.oauth2.id_token
+import io
 import functions_framework
-from firebase_admin import auth, credentials, initialize_app
+from firebase_admin import credentials, initialize_app
+from function_auth import authenticate
+import user_manifest
+from storage_pool import get_storage_client
 import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
 
 # from dotenv import load_dotenv
 # load_dotenv()
@@ -19,6 +22,241 @@ else:
     initialize_app()
 
 
+# GCS の再開可能アップロードで1回に送るサイズ (256KB の倍数)
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# リクエストボディから1回に読み込むサイズ
+REQUEST_READ_SIZE = 256 * 1024
+# 直接アップロード用セッションを一度に発行できる最大件数と並列数
+UPLOAD_SESSION_MAX_ITEMS = int(os.environ.get("UPLOAD_SESSION_MAX_ITEMS", "50"))
+UPLOAD_SESSION_MAX_WORKERS = int(os.environ.get("UPLOAD_SESSION_MAX_WORKERS", "8"))
+
+_session_executor = ThreadPoolExecutor(max_workers=UPLOAD_SESSION_MAX_WORKERS)
+
+
+class _ChunkStream:
+    """
+    バイト列のイテレータを read()/tell()/seek() を持つファイルライクオブジェクトにするラッパー。
+    保持するのは直前に read() で返したチャンクと先読み分のみ。
+    GCS の再開可能アップロードは送信に失敗したチャンクを recover() で seek() して送り直すため、
+    直前のチャンクの範囲内であれば seek() で戻ることができる。それより前には戻れない。
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        # _window は位置 _window_start からのバイト列 (直前に返したチャンク + 先読み分)
+        self._window = bytearray()
+        self._window_start = 0
+        self._position = 0
+        self._exhausted = False
+
+    def read(self, size=-1):
+        # 次のチャンクを読む時点で、それより前のデータは送信済みなので破棄する
+        del self._window[:self._position - self._window_start]
+        self._window_start = self._position
+        while not self._exhausted and (size is None or size < 0 or len(self._window) < size):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+            else:
+                self._window += chunk
+        if size is None or size < 0:
+            size = len(self._window)
+        data = bytes(self._window[:size])
+        self._position += len(data)
+        return data
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('ストリームの末尾からの seek はできません。')
+        if not self._window_start <= offset <= self._window_start + len(self._window):
+            raise io.UnsupportedOperation(
+                f'保持しているチャンク ({self._window_start}-{self._window_start + len(self._window)}) '
+                f'の範囲外には seek できません: {offset}'
+            )
+        self._position = offset
+        return self._position
+
+
+def _raw_body_chunks(request):
+    return iter(lambda: request.stream.read(REQUEST_READ_SIZE), b'')
+
+
+def _open_multipart(request):
+    """
+    multipart/form-data のボディを先頭から順に読み、最初のファイルパートまでのフィールドを返します。
+    ファイル本体はストリームとして返し、メモリに全体を読み込みません。
+    (file_name フィールドはファイルパートより前に置く必要があります)
+
+    Returns:
+        (フィールドの辞書, ファイルの Content-Type, ファイル本体のストリーム)。ファイルがない場合は ValueError。
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if not boundary:
+        raise ValueError('multipart の boundary が指定されていません。')
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+
+    def events():
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                chunk = request.stream.read(REQUEST_READ_SIZE)
+                decoder.receive_data(chunk or None)
+                continue
+            yield event
+            if isinstance(event, Epilogue):
+                return
+
+    event_iter = events()
+    fields = {}
+    field_name = None
+    field_value = bytearray()
+    for event in event_iter:
+        if isinstance(event, Field):
+            field_name = event.name
+            field_value = bytearray()
+        elif isinstance(event, Data) and field_name is not None:
+            field_value += event.data
+            if not event.more_data:
+                fields[field_name] = field_value.decode('utf-8')
+                field_name = None
+        elif isinstance(event, File):
+            def file_chunks():
+                for data_event in event_iter:
+                    if isinstance(data_event, Data):
+                        if data_event.data:
+                            yield data_event.data
+                        if not data_event.more_data:
+                            return
+            content_type = event.headers.get('Content-Type', 'application/octet-stream')
+            return fields, content_type, _ChunkStream(file_chunks())
+    raise ValueError('ファイルが含まれていません。')
+
+
+def _check_file_name(file_name, uid):
+    """
+    file_name (user_id/filename.ext) を検証し、ユーザーIDを返します。
+
+    Returns:
+        (user_id, None) または (None, (エラーの辞書, ステータスコード))
+    """
+    # ファイル名からユーザーIDを抽出
+    try:
+        parts = file_name.split('/')
+        if len(parts) < 2:
+            return None, ({'error': 'ファイル名の形式が正しくありません。 (user_id/filename.ext)'}, 400)
+        user_id = parts[0]
+    except Exception as e:
+        return None, ({'error': f'ファイル名の解析に失敗しました: {str(e)}'}, 400)
+
+    # ユーザーIDの検証
+    # ユーザーIDが認証されたUIDと一致するか、または 'tmp' であるかを確認
+    if not (user_id == uid or user_id == 'tmp'):
+        return None, ({'error': '認証情報とアップロード先のユーザーIDが一致しません。'}, 403)
+    return user_id, None
+
+
+def _create_upload_session(bucket, destination_blob_name, content_type, size, origin):
+    blob = bucket.blob(destination_blob_name)
+    return blob.create_resumable_upload_session(content_type=content_type, size=size, origin=origin)
+
+
+def _handle_direct_upload(request, request_json, uid, headers):
+    """
+    ブラウザから GCS に直接アップロードするためのリクエストを処理します。
+
+    mode="session": 再開可能アップロードのセッションURLを発行する
+    mode="complete": アップロード完了を受け取り、ユーザーのファイル一覧に登録する
+
+    対象は "files" のリスト ({"file_name", "content_type", "size"}) か、単一の file_name で指定します。
+    """
+    items = request_json.get('files')
+    if items is None:
+        items = [request_json]
+    if not isinstance(items, list) or not items:
+        return {'error': '必要な情報が提供されていません。'}, 400, headers
+    if len(items) > UPLOAD_SESSION_MAX_ITEMS:
+        return {'error': f'一度に指定できるファイルは{UPLOAD_SESSION_MAX_ITEMS}件までです。'}, 400, headers
+
+    # すべてのファイルについて、アップロード先のユーザーIDを先に検証する
+    targets = []
+    for item in items:
+        file_name = item.get('file_name') if isinstance(item, dict) else None
+        if not file_name:
+            return {'error': '必要な情報が提供されていません。'}, 400, headers
+        user_id, error = _check_file_name(file_name, uid)
+        if error:
+            return error[0], error[1], headers
+        targets.append((item, file_name, user_id))
+
+    # 環境変数からバケット名とフォルダ名を取得
+    bucket_name = os.environ.get('BUCKET_NAME')
+    folder_name = os.environ.get('FOLDER_NAME')
+    if not bucket_name or not folder_name:
+        return {'error': '環境変数が設定されていません。'}, 500, headers
+
+    bucket = get_storage_client().bucket(bucket_name)
+
+    if request_json['mode'] == 'session':
+        origin = request.headers.get('Origin')
+        futures = [
+            (file_name, f"{folder_name}/{file_name}", _session_executor.submit(
+                _create_upload_session, bucket, f"{folder_name}/{file_name}",
+                item.get('content_type'), item.get('size'), origin
+            ))
+            for item, file_name, _ in targets
+        ]
+        sessions = []
+        for file_name, destination_blob_name, future in futures:
+            try:
+                sessions.append({
+                    'file_name': file_name,
+                    'upload_url': future.result(),
+                    'gs_url': f"gs://{bucket_name}/{destination_blob_name}"
+                })
+            except Exception as e:
+                print(f"Failed to create upload session for {file_name}: {e}")
+                sessions.append({'file_name': file_name, 'error': str(e)})
+        return {'sessions': sessions}, 200, headers
+
+    # mode == 'complete': 実際にアップロードされたオブジェクトのみ一覧に登録する
+    files = []
+    entries_by_user = defaultdict(dict)
+    for _, file_name, user_id in targets:
+        destination_blob_name = f"{folder_name}/{file_name}"
+        try:
+            blob = bucket.get_blob(destination_blob_name)
+        except Exception as e:
+            files.append({'file_name': file_name, 'error': str(e)})
+            continue
+        if blob is None:
+            files.append({'file_name': file_name, 'error': 'ファイルがアップロードされていません。'})
+            continue
+        entries_by_user[user_id][blob.name] = user_manifest.entry_from_blob(blob)
+        files.append({'file_name': file_name, 'gs_url': f"gs://{bucket_name}/{destination_blob_name}"})
+
+    for user_id, entries in entries_by_user.items():
+        try:
+            user_manifest.record_objects(bucket, folder_name, user_id, entries)
+        except Exception as e:
+            print(f"Failed to record uploads for {user_id} in manifest: {e}")
+    return {'files': files}, 200, headers
+
+
+def _record_upload(bucket, folder_name, user_id, blob):
+    """アップロードしたファイルをユーザーのマニフェストに追加します。失敗してもアップロードは成功扱い。"""
+    try:
+        user_manifest.record_objects(
+            bucket, folder_name, user_id, {blob.name: user_manifest.entry_from_blob(blob)}
+        )
+    except Exception as e:
+        print(f"Failed to record {blob.name} in manifest: {e}")
+
+
 @functions_framework.http
 def upload_file(request):
     """
@@ -28,7 +266,7 @@ def upload_file(request):
         headers = {
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-File-Name',
             'Access-Control-Max-Age': '3600'
         }
         return ('', 204, headers)
@@ -37,75 +275,47 @@ def upload_file(request):
         'Access-Control-Allow-Origin': '*'
     }
 
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return ('Unauthorized: Missing token', 401, headers)
-
-    token = auth_header.split('Bearer ')[1]
-    is_authenticated = False
+    identity, error_response = authenticate(request, headers)
+    if error_response:
+        return error_response
+    uid = identity['uid']
+    
 
-    # 1. Firebase セッションクッキーとして検証を試みる
-    try:
-        # check_revokedをTrueにすることで、失効したセッションを拒否できます
-        decoded_token = auth.verify_session_cookie(token, check_revoked=True)
-        uid = decoded_token['uid']
-        print(f"Authenticated as Firebase user: {uid}")
-        is_authenticated = True
-    except auth.InvalidSessionCookieError:
-        print("Invalid Firebase session cookie. Trying Google Cloud authentication.")
-        # 2. Firebaseの検証が失敗した場合、Google CloudのIDトークンとして検証を試みる
+    # アップロード方式を判定
+    # - application/json: base64 エンコードしたデータを JSON で受け取る (従来方式)
+    # - multipart/form-data: file_name フィールドとファイルをストリーミングで受け取る
+    # - その他: ボディをファイル本体とし、file_name はクエリまたは X-File-Name ヘッダーで受け取る
+    data = None
+    stream = None
+    content_type = None
+    size = None
+    if request.mimetype == 'multipart/form-data':
         try:
-            # トークンを検証するURLを指定 (トークンの 'aud' クレームと一致させる)
-            # このCloud FunctionのURLを指定します。
-            cloud_run_url = os.environ.get('CLOUD_RUN_AUD')
-            if not cloud_run_url:
-                 print("CLOUD_RUN_AUD environment variable is not set.")
-                 return ('Unauthorized: Server configuration error', 500, headers)
-
-            # IDトークンのペイロードを取得
-            token_info = google.oauth2.id_token.verify_oauth2_token(
-                token,
-                google.auth.transport.requests.Request(),
-                audience=cloud_run_url
-            )
-            print(f"Authenticated as Google Cloud identity: {token_info.get('email', 'Unknown')}")
-            is_authenticated = True
-        except Exception as e:
-            print(f"Google Cloud ID token verification failed: {e}")
-            # この時点でどちらの認証も失敗
-            return ('Unauthorized: Invalid token', 401, headers)
-    except Exception as e:
-        # セッションクッキー検証で予期せぬエラーが発生した場合
-        print(f"Firebase session cookie verification failed with an unexpected error: {e}")
-        return ('Unauthorized: Token verification failed', 401, headers)
+            fields, content_type, stream = _open_multipart(request)
+        except ValueError as e:
+            return {'error': str(e)}, 400, headers
+        file_name = fields.get('file_name')
+    elif request.mimetype and request.mimetype != 'application/json':
+        file_name = request.args.get('file_name') or request.headers.get('X-File-Name')
+        content_type = request.mimetype
+        size = request.content_length
+        stream = _ChunkStream(_raw_body_chunks(request))
+    else:
+        request_json = request.get_json(silent=True)
+        # ブラウザから GCS に直接アップロードするためのセッション発行・完了通知
+        if request_json and request_json.get('mode') in ('session', 'complete'):
+            return _handle_direct_upload(request, request_json, uid, headers)
+        if not request_json or 'data' not in request_json or 'file_name' not in request_json:
+            return {'error': '必要な情報が提供されていません。'}, 400, headers
+        data = request_json['data']
+        file_name = request_json['file_name']
 
-    if not is_authenticated:
-        return ('Unauthorized: Invalid token', 401, headers)
-    
-
-    request_json = request.get_json(silent=True)
-    if not request_json or 'data' not in request_json or 'file_name' not in request_json:
+    if not file_name:
         return {'error': '必要な情報が提供されていません。'}, 400, headers
 
-    data = request_json['data']
-    file_name = request_json['file_name']
-
-    # ファイル名からユーザーIDを抽出
-    try:
-        parts = file_name.split('/')
-        if len(parts) < 2:
-            return {'error': 'ファイル名の形式が正しくありません。 (user_id/filename.ext)'}, 400, headers
-        
-        user_id = parts[0]
-        file_name_without_user = '/'.join(parts[1:])
-    except Exception as e:
-        return {'error': f'ファイル名の解析に失敗しました: {str(e)}'}, 400, headers
-    
-    # ユーザーIDの検証
-    # ユーザーIDが認証されたUIDと一致するか、または 'tmp' であるかを確認
-    if not (user_id == uid or user_id == 'tmp'):
-        return {'error': '認証情報とアップロード先のユーザーIDが一致しません。'}, 403, headers
-
+    user_id, error = _check_file_name(file_name, uid)
+    if error:
+        return error[0], error[1], headers
 
     # 環境変数からバケット名とフォルダ名を取得
     # Cloud Functionsのデプロイ時に設定してください
@@ -117,7 +327,7 @@ def upload_file(request):
 
     try:
         
-        storage_client = storage.Client()
+        storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
         print(storage_client, bucket)
         # フォルダパスとファイル名を結合
@@ -126,9 +336,15 @@ def upload_file(request):
 
         print(destination_blob_name,blob)
 
-        # base64エンコードされたデータをデコードしてアップロード
-        file_data = base64.b64decode(data)
-        blob.upload_from_string(file_data)
+        if stream is not None:
+            # リクエストボディをチャンク単位で GCS の再開可能アップロードに流し込む
+            blob.chunk_size = UPLOAD_CHUNK_SIZE
+            blob.upload_from_file(stream, size=size, content_type=content_type)
+        else:
+            # base64エンコードされたデータをデコードしてアップロード
+            file_data = base64.b64decode(data)
+            blob.upload_from_string(file_data)
+        _record_upload(bucket, folder_name, user_id, blob)
 
         gs_url = f"gs://{bucket_name}/{destination_blob_name}"
 
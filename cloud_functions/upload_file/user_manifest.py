@@ -0,0 +1,126 @@
+"""
+ユーザーごとのファイル一覧 (マニフェスト) を GCS 上で管理するモジュール。
+
+list_files はプレフィックスのリスト操作の代わりにマニフェストを1回の GET で読み込む。
+オブジェクトを書き込む側 (upload_file, エージェントの動画生成) は
+世代番号の前提条件付きでマニフェストを更新する。
+マニフェストが存在しない場合は更新せず、次の list_files で実際のリストから再構築する。
+
+エージェントは shared.user_manifest として、各関数はディレクトリ内のコピーからインポートする。
+"""
+import json
+import os
+import time
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+
+MANIFEST_FOLDER = os.environ.get("MANIFEST_FOLDER", "_manifests")
+# この秒数より古いマニフェストは再構築する (書き込みの取りこぼし対策)
+MANIFEST_MAX_AGE_SECONDS = int(os.environ.get("MANIFEST_MAX_AGE_SECONDS", "3600"))
+MANIFEST_UPDATE_RETRIES = 5
+MANIFEST_VERSION = 1
+
+
+def manifest_blob_name(base_folder, user_id):
+    return f"{MANIFEST_FOLDER}/{base_folder.strip('/')}/{user_id}.json"
+
+
+def user_prefix(base_folder, user_id):
+    return f"{base_folder.strip('/')}/{user_id}/"
+
+
+def entry_from_blob(blob):
+    """Blob のメタデータからマニフェストのエントリを作成します。"""
+    return {
+        'size': blob.size,
+        'content_type': blob.content_type,
+        'updated': blob.updated.isoformat() if blob.updated else None,
+    }
+
+
+def _read(blob):
+    """(マニフェスト, 世代番号) を返します。存在しない場合は (None, 0)。"""
+    try:
+        data = blob.download_as_bytes()
+    except NotFound:
+        return None, 0
+    return json.loads(data), blob.generation
+
+
+def _write(blob, manifest, generation):
+    blob.cache_control = "no-store"
+    blob.upload_from_string(
+        json.dumps(manifest, ensure_ascii=False),
+        content_type="application/json",
+        if_generation_match=generation,
+    )
+
+
+def load(bucket, base_folder, user_id):
+    """
+    マニフェストを読み込みます。存在しない、または古い場合は None を返します。
+    """
+    manifest, _ = _read(bucket.blob(manifest_blob_name(base_folder, user_id)))
+    if manifest is None or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    if time.time() - manifest.get('rebuilt_at', 0) > MANIFEST_MAX_AGE_SECONDS:
+        return None
+    return manifest
+
+
+def rebuild(bucket, base_folder, user_id):
+    """実際のリストからマニフェストを再構築して保存し、その内容を返します。"""
+    blob = bucket.blob(manifest_blob_name(base_folder, user_id))
+    _, generation = _read(blob)
+
+    prefix = user_prefix(base_folder, user_id)
+    files = {}
+    for item in bucket.list_blobs(prefix=prefix, fields="items(name,size,contentType,updated),nextPageToken"):
+        if item.name == prefix:
+            continue
+        files[item.name] = entry_from_blob(item)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'prefix': prefix,
+        'rebuilt_at': time.time(),
+        'files': files,
+    }
+    try:
+        _write(blob, manifest, generation)
+    except PreconditionFailed:
+        # 他のリクエストが先に更新した場合は、その内容を優先する
+        print(f"Manifest {blob.name} was updated concurrently; keeping the newer version.")
+    return manifest
+
+
+def record_objects(bucket, base_folder, user_id, entries):
+    """
+    書き込んだオブジェクトをマニフェストに追加します。
+
+    Args:
+        entries: オブジェクト名 -> entry_from_blob() の辞書
+
+    Returns:
+        マニフェストを更新した場合は True。マニフェストが存在しない場合は False。
+    """
+    blob = bucket.blob(manifest_blob_name(base_folder, user_id))
+    for _ in range(MANIFEST_UPDATE_RETRIES):
+        manifest, generation = _read(blob)
+        if manifest is None:
+            return False
+        manifest.setdefault('files', {}).update(entries)
+        try:
+            _write(blob, manifest, generation)
+            return True
+        except PreconditionFailed:
+            # 同時更新と競合した場合は読み直して再試行する
+            continue
+    # 更新できなかった場合はマニフェストを削除し、次の list_files で再構築させる
+    print(f"Giving up updating manifest {blob.name} after {MANIFEST_UPDATE_RETRIES} attempts; dropping it.")
+    try:
+        blob.delete()
+    except NotFound:
+        pass
+    return False
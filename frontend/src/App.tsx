@@ -20,6 +20,7 @@ import {
 } from "./atoms";
 import HistorySidebar from "./components/HistorySidebar";
 import { APP_URL, AGENT_NAME } from "./config";
+import { resolveStateArtifacts } from "./sessionState";
 import { useSetAtom, useAtomValue } from "jotai";
 const mode = import.meta.env.MODE;
 
@@ -136,7 +137,12 @@ const App = () => {
             const data = await response.json();
             // console.log("Existing session data:", data);
             if (data.state) {
-              const sanitizedState = sanitizeSceneConfig(data.state);
+              const resolvedState = await resolveStateArtifacts(
+                data.state,
+                API_ENDPOINT,
+                sessionToken
+              );
+              const sanitizedState = sanitizeSceneConfig(resolvedState);
               setSessionState(sanitizedState);
             }
           } else {
@@ -2,6 +2,8 @@
 import React, { useState, useEffect, useRef, type HTMLAttributes } from "react";
 import { useSearchParams } from "react-router-dom";
 import { AGENT_NAME, APP_URL } from "../config";
+import { resolveStateArtifacts } from "../sessionState";
+import { subscribeRenderEvents, type RenderEvent } from "../renderEvents";
 import robotIcon from "../assets/robot.svg"; // useSetAtom をインポート
 import { useAtom, useAtomValue, useSetAtom } from "jotai";
 import {
@@ -194,6 +196,25 @@ const ChatBox = ({ isAuthReady, initialPrompt }: ChatBoxProps) => {
 
     // AIの応答をリアルタイムに表示するためのプレースホルダーを追加
     setMessages((prev) => [...prev, { sender: "ai", text: "..." }]);
+
+    // 動画生成中は、完了したシーンの動画から順にプレビューへ反映する
+    const renderEventsController = new AbortController();
+    subscribeRenderEvents(
+      `${APP_BASE_URL}/apps/${AGENT_NAME}/users/${userId}/sessions/${sessionId}`,
+      sessionToken,
+      (event: RenderEvent) => {
+        const { scene_name: sceneName, gcs_url: gcsUrl } = event;
+        if (event.type !== "scene_completed" || !sceneName || !gcsUrl) return;
+        setSessionState((prev) => {
+          const movieUrls = { ...(prev?.movie_urls ?? {}) };
+          const sceneUrls = movieUrls[sceneName] ?? [];
+          if (sceneUrls.includes(gcsUrl)) return prev;
+          movieUrls[sceneName] = [...sceneUrls, gcsUrl];
+          return { ...prev, movie_urls: movieUrls };
+        });
+      },
+      renderEventsController.signal
+    );
     try {
       // 動的に生成されたセッションIDを使用
       const API_ENDPOINT = `${APP_BASE_URL}/run_sse`;
@@ -306,6 +327,7 @@ const ChatBox = ({ isAuthReady, initialPrompt }: ChatBoxProps) => {
       };
       setMessages((prev) => [...prev, errorMessage]);
     } finally {
+      renderEventsController.abort();
       // AIの応答が完了したら、セッション情報を再取得して sessionState を更新する
       if (sessionId && userId && sessionToken) {
         try {
@@ -345,7 +367,12 @@ const ChatBox = ({ isAuthReady, initialPrompt }: ChatBoxProps) => {
           if (response.ok) {
             const data = await response.json();
             if (data.state) {
-              const sanitizedState = sanitizeSceneConfig(data.state);
+              const resolvedState = await resolveStateArtifacts(
+                data.state,
+                API_ENDPOINT,
+                sessionToken
+              );
+              const sanitizedState = sanitizeSceneConfig(resolvedState);
               setSessionState(sanitizedState);
             }
           } else {
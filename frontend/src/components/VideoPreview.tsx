@@ -43,36 +43,67 @@ const VideoPreview = ({ isOpen, onClose }: VideoPreviewProps) => {
       }
 
       try {
-        const signedUrlPromises = urlsToFetch.map(async (gcsUri) => {
+        // バケットごとにまとめて1回のリクエストで署名付きURLを取得
+        const fileNamesByBucket: Record<string, string[]> = {};
+        const parsedUris = urlsToFetch.map((gcsUri) => {
           const uriParts = gcsUri.replace("gs://", "").split("/");
           const bucketName = uriParts.shift();
           const fileName = uriParts.join("/");
-
-          if (!bucketName || !fileName) return null;
-
-          const response = await fetch(
-            "https://asia-northeast1-aiagenthackathon-469114.cloudfunctions.net/create_signed_url",
-            {
-              method: "POST",
-              headers: {
-                "Content-Type": "application/json",
-                Authorization: `Bearer ${sessionToken}`,
-              },
-              body: JSON.stringify({ bucketName, fileName }),
-            }
-          );
-
-          if (!response.ok) {
-            console.error(`Failed to get signed URL for ${gcsUri}`);
-            return null;
+          if (bucketName && fileName) {
+            (fileNamesByBucket[bucketName] ??= []).push(fileName);
           }
-          const data = await response.json();
-          return data.signedUrl;
+          return { gcsUri, bucketName, fileName };
         });
 
-        const resolvedUrls = (await Promise.all(signedUrlPromises)).filter(
-          (url): url is string => url !== null
+        // 結果はリクエストした fileName と同じ順序のリストで返される
+        const resultsByBucket: Record<
+          string,
+          Record<string, { signedUrl?: string; error?: string }>
+        > = {};
+        await Promise.all(
+          Object.entries(fileNamesByBucket).map(
+            async ([bucketName, fileNames]) => {
+              const response = await fetch(
+                "https://asia-northeast1-aiagenthackathon-469114.cloudfunctions.net/create_signed_url",
+                {
+                  method: "POST",
+                  headers: {
+                    "Content-Type": "application/json",
+                    Authorization: `Bearer ${sessionToken}`,
+                  },
+                  body: JSON.stringify({ bucketName, fileName: fileNames }),
+                }
+              );
+
+              if (!response.ok) {
+                console.error(`Failed to get signed URLs for ${bucketName}`);
+                return;
+              }
+              const data = await response.json();
+              const results: {
+                fileName: string | null;
+                signedUrl?: string;
+                error?: string;
+              }[] = data.results ?? [];
+              resultsByBucket[bucketName] = {};
+              results.forEach((result, index) => {
+                resultsByBucket[bucketName][fileNames[index]] = result;
+              });
+            }
+          )
         );
+
+        const resolvedUrls = parsedUris
+          .map(({ gcsUri, bucketName, fileName }) => {
+            const result =
+              bucketName && resultsByBucket[bucketName]?.[fileName];
+            if (!result || !result.signedUrl) {
+              console.error(`Failed to get signed URL for ${gcsUri}`);
+              return null;
+            }
+            return result.signedUrl;
+          })
+          .filter((url): url is string => url !== null);
         setSignedUrls(resolvedUrls);
       } catch (error) {
         console.error("Error fetching signed URLs:", error);
@@ -0,0 +1,64 @@
+// 動画生成の進捗イベント (/render_events) を購読する
+// EventSource は Authorization ヘッダーを送れないため、fetch のストリーミングで SSE を読む
+// イベントはエージェントを実行しているインスタンス内でのみ配信されるため、途中経過の表示にのみ使い、
+// 最終的な movie_urls は応答完了後のセッション state から取得する
+
+export interface RenderEvent {
+  type: "scene_completed" | "job_completed";
+  job_id: string;
+  scene_name?: string | null;
+  gcs_url?: string | null;
+  error?: string | null;
+  completed?: number;
+  succeeded?: number;
+  total: number;
+  movie_urls?: Record<string, string[]>;
+}
+
+export const subscribeRenderEvents = async (
+  sessionEndpoint: string,
+  sessionToken: string | null,
+  onEvent: (event: RenderEvent) => void,
+  signal: AbortSignal
+): Promise<void> => {
+  try {
+    const response = await fetch(`${sessionEndpoint}/render_events`, {
+      method: "GET",
+      headers: {
+        Accept: "text/event-stream",
+        Authorization: `Bearer ${sessionToken}`,
+      },
+      signal,
+    });
+    if (!response.ok || !response.body) {
+      console.warn(`Render events are not available: ${response.status}`);
+      return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    // eslint-disable-next-line no-constant-condition
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let newlineIndex;
+      while ((newlineIndex = buffer.indexOf("\n")) !== -1) {
+        const line = buffer.substring(0, newlineIndex);
+        buffer = buffer.substring(newlineIndex + 1);
+        // ": keep-alive" などのコメント行と空行は無視する
+        if (!line.startsWith("data: ")) continue;
+        try {
+          onEvent(JSON.parse(line.substring(6)));
+        } catch (e) {
+          console.warn("Could not parse render event:", line);
+        }
+      }
+    }
+  } catch (error) {
+    if (!signal.aborted) {
+      console.error("Render event stream failed:", error);
+    }
+  }
+};
@@ -0,0 +1,72 @@
+// セッション state の参照 (<key>_ref) をアーティファクトの内容に展開する
+// scene_config / theme_list / movie_urls はアーティファクトに保存され、state には参照だけが入っている
+
+const ARTIFACT_STATE_KEYS = ["scene_config", "theme_list", "movie_urls"];
+
+interface ArtifactRef {
+  artifact: string;
+  version?: number;
+  sha256: string;
+}
+
+// sha256 -> 展開済みの値 (同じ内容を何度も取得しない)
+const artifactCache = new Map<string, unknown>();
+
+const decodeBase64 = (data: string): string => {
+  // URL-safe な base64 にも対応する
+  const normalized = data.replace(/-/g, "+").replace(/_/g, "/");
+  const padded = normalized + "=".repeat((4 - (normalized.length % 4)) % 4);
+  const bytes = Uint8Array.from(atob(padded), (c) => c.charCodeAt(0));
+  return new TextDecoder().decode(bytes);
+};
+
+const fetchArtifact = async (
+  sessionEndpoint: string,
+  ref: ArtifactRef,
+  sessionToken: string | null
+): Promise<unknown> => {
+  const cached = artifactCache.get(ref.sha256);
+  if (cached !== undefined) return cached;
+
+  const query = ref.version !== undefined ? `?version=${ref.version}` : "";
+  const response = await fetch(
+    `${sessionEndpoint}/artifacts/${encodeURIComponent(ref.artifact)}${query}`,
+    {
+      method: "GET",
+      headers: {
+        "Content-Type": "application/json",
+        Authorization: `Bearer ${sessionToken}`,
+      },
+    }
+  );
+  if (!response.ok) {
+    throw new Error(`Failed to fetch artifact ${ref.artifact}: ${response.status}`);
+  }
+  const part = await response.json();
+  const inlineData = part?.inlineData ?? part?.inline_data;
+  const text = inlineData?.data ? decodeBase64(inlineData.data) : part?.text;
+  const value = JSON.parse(text);
+  artifactCache.set(ref.sha256, value);
+  return value;
+};
+
+export const resolveStateArtifacts = async (
+  state: any,
+  sessionEndpoint: string,
+  sessionToken: string | null
+): Promise<any> => {
+  if (!state) return state;
+  const resolved = { ...state };
+  await Promise.all(
+    ARTIFACT_STATE_KEYS.map(async (key) => {
+      const ref: ArtifactRef | undefined = state[`${key}_ref`];
+      if (!ref) return;
+      try {
+        resolved[key] = await fetchArtifact(sessionEndpoint, ref, sessionToken);
+      } catch (error) {
+        console.error(`Error resolving ${key} from artifacts:`, error);
+      }
+    })
+  );
+  return resolved;
+};
@@ -1,12 +1,21 @@
+import asyncio
+import json
 import os
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request, Response, Body, Depends
 from firebase_admin import auth, credentials, initialize_app
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from google.adk.cli.fast_api import get_fast_api_app
 from google.auth.exceptions import GoogleAuthError
 from dotenv import load_dotenv
 from typing import Dict, Any
+from session_cache import session_cookie_cache
+from movie_maker_agent.agent import resume_render_jobs, instruction_cache, fast_router, blocking_executor
+from movie_maker_agent.render_jobs import render_job_store
+from movie_maker_agent import render_events
+from movie_maker_agent.model_cache import model_response_cache
 
 # .envファイルから環境変数をロード
 load_dotenv()
@@ -44,6 +53,18 @@ app: FastAPI = get_fast_api_app(
     artifact_service_uri=ARTIFACTS_GCS
 )
 
+# --- 起動時に未完了の動画生成ジョブを再開 ---
+_adk_lifespan = app.router.lifespan_context
+
+
+@asynccontextmanager
+async def lifespan(app_: FastAPI):
+    async with _adk_lifespan(app_) as state:
+        await resume_render_jobs()
+        yield state
+
+app.router.lifespan_context = lifespan
+
 # --- CORSミドルウェアの追加 ---
 app.add_middleware(
     CORSMiddleware,
@@ -76,8 +97,8 @@ async def verify_token_middleware(request: Request, call_next):
 
     if token:
         try:
-            decoded_token = auth.verify_session_cookie(token, check_revoked=True)
-            print(f"Decoded token: {decoded_token}")
+            # 検証済みクッキーはキャッシュから返し、失効チェックはバックグラウンドで行う
+            decoded_token = await session_cookie_cache.verify(token)
             request.state.user = decoded_token
             user_id = decoded_token['user_id']
             request.state.user_id = user_id
@@ -106,6 +127,86 @@ async def verify_token_middleware(request: Request, call_next):
     raise HTTPException(status_code=401, detail="Unauthorized: No session cookie provided")
 
 
+@app.get("/auth/cache-stats")
+async def auth_cache_stats() -> Dict[str, Any]:
+    """セッションクッキーキャッシュのヒット/ミス数を返します。"""
+    return session_cookie_cache.stats()
+
+
+@app.get("/agent/model-cache-stats")
+async def agent_model_cache_stats() -> Dict[str, Any]:
+    """エージェントのモデル応答キャッシュのヒット率をエージェントごとに返します。"""
+    return model_response_cache.stats()
+
+
+@app.get("/agent/context-cache-stats")
+async def agent_context_cache_stats() -> Dict[str, Any]:
+    """Gemini のコンテキストキャッシュの作成・延長・利用回数を返します。"""
+    return instruction_cache.stats()
+
+
+@app.get("/agent/router-stats")
+async def agent_router_stats() -> Dict[str, Any]:
+    """supervisor のモデルを呼ばずに振り分けたメッセージの数と割合を返します。"""
+    return fast_router.stats()
+
+
+@app.get("/apps/{app_name}/users/{user_id}/sessions/{session_id}/render_jobs")
+async def list_render_jobs(app_name: str, user_id: str, session_id: str) -> Dict[str, Any]:
+    """
+    セッションの動画生成ジョブの状態を返します。エージェントを実行せずに進捗を確認するために使います。
+    (user_id の検証は verify_token_middleware で行われます)
+    """
+    jobs = await asyncio.get_running_loop().run_in_executor(
+        blocking_executor, render_job_store.list_for_session, app_name, user_id, session_id
+    )
+    return {
+        "jobs": [
+            {
+                "job_id": job["job_id"],
+                "scene_name": job["scene_name"],
+                "status": job["status"],
+                "gcs_url": job["gcs_url"],
+                "error": job["error"],
+                "created_at": job["created_at"],
+                "updated_at": job["updated_at"],
+            }
+            for job in jobs
+        ]
+    }
+
+
+# SSE 接続を維持するためのコメント送信間隔 (秒)
+RENDER_EVENTS_HEARTBEAT_SECONDS = 15
+
+
+@app.get("/apps/{app_name}/users/{user_id}/sessions/{session_id}/render_events")
+async def stream_render_events(app_name: str, user_id: str, session_id: str) -> StreamingResponse:
+    """
+    シーンごとの動画生成完了イベントを SSE で配信します。
+    完了したシーンから順に受け取れるため、フロントエンドは動画を逐次表示できます。
+    認証に Authorization ヘッダーが必要なため、フロントエンドは EventSource ではなく fetch で読み込みます
+    (frontend/src/renderEvents.ts)。
+    イベントはプロセス内でのみ配信されるため、エージェントを実行しているインスタンスに接続した場合にのみ届きます
+    (Cloud Run ではセッションアフィニティを有効にしてください)。届かなかった場合も、
+    最終的な movie_urls は応答完了後のセッション state から取得できます。
+    """
+    async def event_stream():
+        queue = render_events.subscribe(user_id, session_id)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=RENDER_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            render_events.unsubscribe(user_id, session_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 if __name__ == "__main__":
     # Use the PORT environment variable provided by Cloud Run, defaulting to 8080
     uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file
@@ -5,26 +5,38 @@ from google.adk.tools import ToolContext,agent_tool
 from google.adk.models import LlmResponse, LlmRequest
 from google.adk.agents.callback_context import CallbackContext
 from google.adk.agents.invocation_context import InvocationContext
-from google.adk.events import Event
+from google.adk.events import Event, EventActions
 from typing import AsyncGenerator, Optional
 from google.adk.agents import BaseAgent
 from google import genai
 from google.genai import types
 from google.genai.types import GenerateVideosConfig, Image
 import asyncio
-from google.auth.transport.requests import Request
-from google.oauth2 import id_token
-import requests
+import hashlib
 import os
 from dotenv import load_dotenv
 from typing_extensions import override
-from PIL import Image as PILImage
-from io import BytesIO
-from google.cloud import storage
 import re
 import logging
+import mimetypes
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import json
+from .gcs import generate_signed_url
+from shared.storage_pool import get_storage_client
+from shared import user_manifest
+from .veo_poller import VeoOperationPoller
+from .veo_scheduler import VeoScheduler
+from .render_jobs import render_job_store
+from . import render_cache
+from . import render_events
+from . import image_prep
+from .location_images import get_location_images
+from . import session_artifacts
+from . import model_cache
+from .context_cache import ContextCacheManager
+from .fast_router import FastPathRouter
 # .envファイルから環境変数をロード
 load_dotenv()
 
@@ -35,253 +47,203 @@ logger = logging.getLogger(__name__)
 MODEL_GEMINI_2_5_FLASH = "gemini-2.5-flash"
 MODEL_GENAI_IMAGE = "gemini-2.5-flash-image-preview"
 VEO_MODEL = "veo-3.0-fast-generate-preview"
+VEO_ASPECT_RATIO = "16:9"
 
 
 genai_client = genai.Client()
 image_genai_client = genai.Client(location="global")
+
+# genai の呼び出しは非同期クライアント (client.aio) を使う。
+# それ以外のブロッキング処理 (GCS など) は、デフォルトのスレッドプールを圧迫しないよう専用の executor で実行する
+AGENT_BLOCKING_WORKERS = int(os.environ.get("AGENT_BLOCKING_WORKERS", "16"))
+blocking_executor = ThreadPoolExecutor(max_workers=AGENT_BLOCKING_WORKERS, thread_name_prefix="agent-blocking")
+# エージェントのシステム指示とツール定義を Gemini のコンテキストキャッシュで共有する
+instruction_cache = ContextCacheManager(genai_client)
 output_gcs_uri= "gs://ai-agent-hackathon-dist-akira2025/video_output"
 
-input1_gcs_uri = "gs://ai-agent-hackathon-dist-akira2025/fortest/input1.jpg"
-input2_gcs_uri = "gs://ai-agent-hackathon-dist-akira2025/fortest/input2.png"
 GCS_BUCKET_NAME = "ai-agent-hackathon-dist-akira2025"
 GCS_IMAGE_FOLDER = "fortest"
-
-SIGNED_URL_FUNCTIONS_URL = "https://asia-northeast1-aiagenthackathon-469114.cloudfunctions.net/create_signed_url"
+# merge_images で1回に生成できる候補の最大数
+MERGE_IMAGES_MAX_VARIANTS = int(os.environ.get("MERGE_IMAGES_MAX_VARIANTS", "4"))
 
 # --- ツール関数 (変更なし) ---
-def generate_signed_url(bucket_name, file_name, expiration_time=3600):
-    """
-    GCSオブジェクトの認証済みURLを生成します。
-
-    Args:
-        bucket_name: GCSバケット名
-        blob_name: GCS内のオブジェクトのパス
-        expiration_time: URLの有効期限（秒）。デフォルトは1時間。
-
-    Returns:
-        認証済みURL
-    """
-    # IDトークンの生成
-    auth_req = Request()
-    token = id_token.fetch_id_token(auth_req, SIGNED_URL_FUNCTIONS_URL)
-
-    # リクエストヘッダーにAuthorizationヘッダーを追加
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {token}'
-    }
-
-    # リクエストボディ
-    data = {
-        'bucketName': bucket_name,
-        'fileName': file_name
-    }
-
-    try:
-        response = requests.post(SIGNED_URL_FUNCTIONS_URL, headers=headers, json=data)
-        print(response)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling Cloud Function: {e}")
-        return None
-
-def upload_blob(bucket_name, source_file_name, destination_blob_name):
-    """バケットにファイルをアップロードします。"""
-    storage_client = storage.Client()
+def upload_blob(bucket_name, data: bytes, destination_blob_name, content_type="image/png"):
+    """バケットにバイト列をそのままアップロードします。"""
+    storage_client = get_storage_client()
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
-    blob.upload_from_file(source_file_name, content_type="image/png")
+    blob.upload_from_string(data, content_type=content_type)
     print(f"File uploaded to gs://{bucket_name}/{destination_blob_name}.")
     return f"gs://{bucket_name}/{destination_blob_name}"
 
-# def merge_images(text_input: str, first_image_base64: str, second_image_base64: str):
-def merge_images(text_input: str):
-    """
-    2枚の画像をユーザーの指示に基づいてマージし、結果の画像を保存して表示します。
 
-    Args:
-        text_input: 画像マージに関するユーザーの具体的な指示（日本語）。
+def _upload_and_sign(data: bytes, mime_type: str, destination_path: str) -> str:
+    """生成された画像をアップロードし、署名付きURLを返します。(executor で呼び出してください)"""
+    gcs_uri = upload_blob(GCS_BUCKET_NAME, data, destination_path, content_type=mime_type)
+    print(gcs_uri)
+    return generate_signed_url(GCS_BUCKET_NAME, destination_path)
 
-    Returns:
-        なし (画像をファイルに保存し、表示します)
-    """
-    print("merge_imagesツールが呼び出されました。")
-    # Base64文字列をデコードして画像バイナリデータに戻す
-    try:
-        print(f"1枚目の画像URI: {input1_gcs_uri}")
-        print(f"2枚目の画像URI: {input2_gcs_uri}")
 
-        # genai.types.Partに変換
-        first_image_part = types.Part.from_uri(file_uri=input1_gcs_uri)
-        second_image_part = types.Part.from_uri(file_uri=input2_gcs_uri)
+def _merge_image_uris(tool_context: ToolContext) -> list[str]:
+    """マージする入力画像の gs:// URI のリストを state から取得します。未設定の場合は空のリストを返します。"""
+    image_uris = tool_context.state.get("merge_image_uris") or []
+    if isinstance(image_uris, str):
+        image_uris = [image_uris]
+    return [uri for uri in image_uris if isinstance(uri, str) and uri.startswith("gs://")]
 
-        print(f"1枚目の画像Part: {first_image_part}")
-        print(f"2枚目の画像Part: {second_image_part}")
 
-    except Exception as e:
-        print(f"画像データのデコードに失敗しました: {e}")
-        return "エラー: 画像データの形式が正しくありません。"
+async def set_merge_images(tool_context: ToolContext, image_uris: list[str]) -> dict:
+    """
+    マージに使う入力画像の gs:// URI を state に保存します。
 
+    Args:
+        image_uris: 入力画像の gs:// URI のリスト
+    """
+    image_uris = [uri for uri in image_uris if isinstance(uri, str) and uri.startswith("gs://")]
+    if not image_uris:
+        return {"status": "error", "error_message": "gs:// で始まる画像URIを指定してください。"}
+    tool_context.state["merge_image_uris"] = image_uris
+    print(f"[SAVE MERGE IMAGES] Updated merge_image_uris in state: {image_uris}")
+    return {"status": "success", "image_uris": image_uris}
+
+
+async def _generate_merged_image(image_parts: list, text_input: str, variant: int, timestamp: str) -> str:
+    """画像を1枚生成してアップロードし、署名付きURLを返します。"""
     generate_content_config = types.GenerateContentConfig(
         temperature = 1,
         top_p = 0.95,
         max_output_tokens = 32768,
         response_modalities = ["TEXT", "IMAGE"]
     )
+    # 非同期クライアントで生成し、生成中も他のセッションの処理を止めない
+    response = await image_genai_client.aio.models.generate_content(
+        model=MODEL_GENAI_IMAGE, # 画像処理に特化したモデルを使用
+        contents = [
+            types.Content(
+            role="user",
+            parts=[*image_parts, types.Part.from_text(text=text_input)]
+            )
+        ],
+        config = generate_content_config
+    )
 
-    try:
-    # ここではバイトデータとして渡すことを想定します。
-        # print("before banana")
-        response = image_genai_client.models.generate_content(
-            model="gemini-2.5-flash-image-preview", # 画像処理に特化したモデルを使用
-            # contents=[text_input,first_image_data, second_image_data],
-            contents = [
-                types.Content(
-                role="user",
-                parts=[
-                    first_image_part,
-                    second_image_part,
-                    types.Part.from_text(text=text_input)
-                ]
-                )
-            ],
-            config = generate_content_config
-        )
-        # print("after banana", response)
-
-        for part in response.candidates[0].content.parts:
-            if part.text is not None:
-                print(part.text)
-            elif part.inline_data is not None:
-                image = PILImage.open(BytesIO(part.inline_data.data))
-                # image.save("generated_image.png")
-                timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-                destination_path = f"{GCS_IMAGE_FOLDER}/merged_{timestamp}.png"
-                image_bytes_io = BytesIO()
-                image.save(image_bytes_io, format='PNG')
-                image_bytes_io.seek(0)
-                gcs_uri = upload_blob(GCS_BUCKET_NAME, image_bytes_io, destination_path)
-                print(gcs_uri)
-                signed_url = generate_signed_url(GCS_BUCKET_NAME, destination_path)
-                print(signed_url)
-
-                return signed_url
-
-        print("===========")
-        # print(response)
-    except Exception as e:
-            print(f"呼び出しに失敗しました: {e}")
-            return "エラー: 生成された画像の処理中に問題が発生しました。"
-
+    for part in response.candidates[0].content.parts:
+        if part.text is not None:
+            print(part.text)
+        elif part.inline_data is not None:
+            # 返されたバイト列をデコード・再エンコードせず、そのままの形式でアップロードする
+            mime_type = part.inline_data.mime_type or "image/png"
+            extension = mimetypes.guess_extension(mime_type) or ".png"
+            destination_path = f"{GCS_IMAGE_FOLDER}/merged_{timestamp}_{variant}{extension}"
+            return await asyncio.get_running_loop().run_in_executor(
+                blocking_executor, _upload_and_sign, part.inline_data.data, mime_type, destination_path
+            )
+    raise RuntimeError("No image was returned by the model.")
 
 
-def get_location_images(query: str) -> dict:
+async def merge_images(tool_context: ToolContext, text_input: str, variants: int = 1) -> dict:
     """
-    Collects multiple images for a given location (address or place name) using Google Maps APIs.
-    Returns a dictionary with 'status' and a list of image URLs or an error message.
+    state の merge_image_uris にある画像をユーザーの指示に基づいてマージし、
+    variants 枚の候補を並列で生成して保存します。
+
+    Args:
+        text_input: 画像マージに関するユーザーの具体的な指示（日本語）。
+        variants: 生成する候補の枚数。
+
+    Returns:
+        生成された全候補の署名付きURLのリスト
     """
-    print(f"--- Tool: get_location_images called with query: {query} ---\n")
-    google_maps_api_key = os.environ.get("GOOGLE_MAPS_API_KEY")
-    if not google_maps_api_key:
+    print("merge_imagesツールが呼び出されました。")
+    image_uris = _merge_image_uris(tool_context)
+    if not image_uris:
         return {
             "status": "error",
-            "error_message": "GOOGLE_MAPS_API_KEY environment variable not set.",
+            "error_message": "エラー: マージする画像が指定されていません。マージしたい画像をアップロードし、その gs:// URI を指定してください。",
         }
+    try:
+        variants = max(1, min(int(variants), MERGE_IMAGES_MAX_VARIANTS))
+    except (TypeError, ValueError):
+        variants = 1
+    print(f"入力画像URI: {image_uris} / 候補数: {variants}")
 
-    image_urls = []
-    
-    # 1. Places API - Find Place to get place_id and lat/lng
-    find_place_url = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
-    find_place_params = {
-        "input": query,
-        "inputtype": "textquery",
-        "fields": "place_id,geometry",
-        "key": google_maps_api_key,
-    }
     try:
-        find_place_response = requests.get(find_place_url, params=find_place_params)
-        find_place_response.raise_for_status()
-        find_place_data = find_place_response.json()
-
-        if find_place_data["status"] == "OK" and find_place_data["candidates"]:
-            place_id = find_place_data["candidates"][0]["place_id"]
-            location = find_place_data["candidates"][0]["geometry"]["location"]
-            lat = location["lat"]
-            lng = location["lng"]
-            print(f"Found place_id: {place_id}, Lat: {lat}, Lng: {lng}\n")
-        else:
-            return {
-                "status": "error",
-                "error_message": f"Could not find place for query: {query}. Status: {find_place_data.get('status', 'Unknown')}",
-            }
-    except requests.exceptions.RequestException as e:
-        return {
-            "status": "error",
-            "error_message": f"Error calling Places API (Find Place): {e}",
-        }
+        # genai.types.Partに変換
+        image_parts = [
+            types.Part.from_uri(file_uri=uri, mime_type=mimetypes.guess_type(uri)[0] or "image/png")
+            for uri in image_uris
+        ]
+    except Exception as e:
+        print(f"画像データのデコードに失敗しました: {e}")
+        return {"status": "error", "error_message": "エラー: 画像データの形式が正しくありません。"}
 
-    # 2. Places API - Place Details to get photo_references
-    place_details_url = "https://maps.googleapis.com/maps/api/place/details/json"
-    place_details_params = {
-        "place_id": place_id,
-        "fields": "photos",
-        "key": google_maps_api_key,
-    }
+    # 候補ごとの生成とアップロードを並列で実行する
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    results = await asyncio.gather(
+        *(_generate_merged_image(image_parts, text_input, variant, timestamp) for variant in range(1, variants + 1)),
+        return_exceptions=True,
+    )
+    signed_urls = [result for result in results if isinstance(result, str)]
+    errors = [str(result) for result in results if isinstance(result, Exception)]
+    for error in errors:
+        print(f"呼び出しに失敗しました: {error}")
+
+    if not signed_urls:
+        return {"status": "error", "error_message": "エラー: 生成された画像の処理中に問題が発生しました。"}
+    return {"status": "success", "signed_urls": signed_urls, "failed": len(errors)}
+
+
+
+async def _fetch_operation(operation):
+    """オペレーションの最新状態を取得します。"""
+    return await genai_client.aio.operations.get(operation)
+
+
+# 実行中のVeoオペレーションをプロセス全体でまとめてポーリングする
+veo_poller = VeoOperationPoller(_fetch_operation)
+# Veoの同時実行数・送信レートを制限し、クォータエラーを再試行する
+veo_scheduler = VeoScheduler()
+# このプロセスで send_to_veo3_api が実行中のジョブID (ツール自身が state を更新する)
+_active_render_jobs = set()
+# 起動時に再開したジョブのタスク (イベントループはタスクを弱参照でしか保持しない)
+_resume_tasks = set()
+# DirectorAgent が実際のセッションの情報を保存する state のキー
+# (send_to_veo3_api は AgentTool の一時的なセッションで実行されるため、ジョブの記録にはこの値を使う)
+RENDER_JOB_SESSION_KEY = "render_job_session"
+
+
+def _record_generated_video(gcs_uri: str, user_id: str) -> None:
+    """生成された動画をユーザーのファイル一覧 (マニフェスト) に追加します。"""
+    bucket_name, blob_name = gcs_uri.replace("gs://", "").split("/", 1)
+    output_folder = output_gcs_uri.replace("gs://", "").split("/", 1)[1]
     try:
-        place_details_response = requests.get(place_details_url, params=place_details_params)
-        place_details_response.raise_for_status()
-        place_details_data = place_details_response.json()
-
-        if place_details_data["status"] == "OK" and "photos" in place_details_data["result"]:
-            photos = place_details_data["result"]["photos"]
-            for photo in photos[:5]:
-                photo_reference = photo["photo_reference"]
-                photo_url = (
-                    f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=400"
-                    f"&photoreference={photo_reference}&key={google_maps_api_key}"
-                )
-                image_urls.append(photo_url)
-            print(f"Collected {len(image_urls)} Place Photos.\n")
-        else:
-            print(f"No Place Photos found for {query}.\n")
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling Places API (Place Details): {e}\n")
-    
-    # 3. Street View Static API
-    street_view_url = "https://maps.googleapis.com/maps/api/streetview"
-    headings = [0, 90, 180, 270]
-    for heading in headings:
-        street_view_params = {
-            "size": "600x300",
-            "location": f"{lat},{lng}",
-            "heading": heading,
-            "pitch": 0,
-            "key": google_maps_api_key,
-        }
-        try:
-            street_view_image_url = f"{street_view_url}?{requests.compat.urlencode(street_view_params)}"
-            image_urls.append(street_view_image_url)
-            print(f"Added Street View image for heading {heading}.\n")
-        except Exception as e:
-            print(f"Error constructing Street View URL: {e}\n")
+        bucket = get_storage_client().bucket(bucket_name)
+        blob = bucket.get_blob(blob_name)
+        if blob is None:
+            print(f"Generated video {gcs_uri} not found; skipping manifest update.")
+            return
+        user_manifest.record_objects(bucket, output_folder, user_id, {blob_name: user_manifest.entry_from_blob(blob)})
+    except Exception as e:
+        print(f"Failed to record {gcs_uri} in manifest: {e}")
 
-    if image_urls:
-        return {
-            "status": "success",
-            "image_urls": image_urls,
-        }
-    else:
-        return {
-            "status": "error",
-            "error_message": "No images could be retrieved for the specified location.",
-        }
 
+def _operation_outcome(operation) -> tuple:
+    """完了したオペレーションから (GCS URI, エラー) を取り出します。"""
+    if operation.error:
+        return None, str(operation.error)
+    if operation.response and operation.response.generated_videos:
+        gcs_uri = operation.response.generated_videos[0].video.uri
+        # GCS URIの形式を検証
+        if not gcs_uri or not gcs_uri.startswith("gs://"):
+            return None, f"Invalid GCS URI format: {gcs_uri}"
+        return gcs_uri, None
+    return None, "No video generated"
 
-async def _generate_video_for_scene(scene_name: str, prompt: str, user_id: str) -> Optional[dict]:
+
+async def _generate_video_for_scene(scene_name: str, prompt: str, user_id: str, job: Optional[dict] = None) -> Optional[dict]:
     """
     1つのシーンの動画を生成します。
     この関数は send_to_veo3_api から並列で呼び出されます。
+    job (job_id, app_name, session_id) が指定された場合、オペレーションを送信直後に永続化します。
     """
     loop = asyncio.get_running_loop()
     print(f"--- Starting video generation for scene: {scene_name} ---")
@@ -303,67 +265,157 @@ async def _generate_video_for_scene(scene_name: str, prompt: str, user_id: str)
         "model": VEO_MODEL,
         "prompt": prompt,
         "config": GenerateVideosConfig(
-            aspect_ratio="16:9",
+            aspect_ratio=VEO_ASPECT_RATIO,
             output_gcs_uri=final_output_gcs_uri,
         ),
     }
 
     if image_url and image_url.startswith("gs://"):
         print(f"Found imageUrl for scene '{scene_name}': {image_url}")
+        # Veo の解像度・アスペクト比に合わせた画像に変換してから渡す (変換結果は内容ハッシュでキャッシュされる)
+        try:
+            image_url, mime_type = await loop.run_in_executor(
+                blocking_executor, image_prep.prepare_veo_image, image_url, VEO_ASPECT_RATIO
+            )
+        except Exception as e:
+            print(f"Could not preprocess imageUrl for scene '{scene_name}': {e}. Using it as is.")
+            mime_type = mimetypes.guess_type(image_url)[0] or "image/png"
         generate_videos_args["image"] = Image(
             gcs_uri=image_url,
-            mime_type="image/png",  # ユーザーの指示通り "image/png" に固定
+            mime_type=mime_type,
         )
 
+    # このシーンのジョブ (共有した生成に参加した場合も、オペレーション名と共に記録する)
+    waiter = dict(job, user_id=user_id, scene_name=scene_name) if job else None
 
-    try:
-        # generate_videosは同期的I/Oバウンドな操作なので、executorで実行します
-        operation = await loop.run_in_executor(
-            None,  # デフォルトのThreadPoolExecutorを使用
-            lambda: genai_client.models.generate_videos(**generate_videos_args)
-        )
-
-        # operation完了を待つ (ポーリング)
-        while not operation.done:
-            print(f"Waiting for video generation for scene '{scene_name}'...")
-            await asyncio.sleep(15)  # 非同期sleep
-            # getも同期的I/Oバウンド
-            operation = await loop.run_in_executor(
-                None,
-                lambda: genai_client.operations.get(operation)
+    async def record_submitted(waiters, operation_name):
+        for w in waiters:
+            await loop.run_in_executor(
+                blocking_executor, render_job_store.record_submitted,
+                w["job_id"], w["app_name"], w["user_id"], w["session_id"], w["scene_name"], operation_name,
             )
 
-        print(f"Operation finished for scene '{scene_name}'")
-
-        if operation.error:
-            print(f"Error generating video for scene '{scene_name}': {operation.error}")
-            return {"scene_name": scene_name, "gcs_url": None, "error": str(operation.error)}
-
-        if operation.response and operation.response.generated_videos:
-            video_info = operation.response.generated_videos[0].video
-            gcs_uri = video_info.uri
-            print(f"Generated video for scene '{scene_name}': {gcs_uri}")
-
-            # GCS URIからバケット名とオブジェクト名を解析
-            if not gcs_uri.startswith("gs://"):
-                raise ValueError(f"Invalid GCS URI format: {gcs_uri}")
-            path_parts = gcs_uri.replace("gs://", "").split("/", 1)
-            bucket_name = path_parts[0]
-            blob_name = path_parts[1]
+    try:
+        async def render(shared):
+            async def submit():
+                operation = await genai_client.aio.models.generate_videos(**generate_videos_args)
+                # インスタンスが再起動しても再開できるよう、送信直後にオペレーション名を記録する
+                # (以降に参加した呼び出し元は on_join で自分のジョブを記録する)
+                shared.operation_name = operation.name
+                await record_submitted(list(shared.waiters), operation.name)
+                return operation
+
+            async def wait(operation):
+                operation = await veo_poller.wait(operation)
+                # このオペレーションを待つすべてのジョブの結果を記録する
+                await loop.run_in_executor(
+                    blocking_executor, render_job_store.record_finished, operation.name, *_operation_outcome(operation)
+                )
+                return operation
 
+            # 送信と完了待ちはスケジューラー経由で行い、クォータ超過時は待って再試行する
+            # (ポーリングは veo_poller がまとめて行う)
+            print(f"Waiting for video generation for scene '{scene_name}'...")
+            operation = await veo_scheduler.run(submit, wait, label=scene_name)
+            print(f"Operation finished for scene '{scene_name}'")
+            outcome = _operation_outcome(operation)
+            if outcome[0]:
+                await loop.run_in_executor(blocking_executor, render_cache.render_index.store, key, outcome[0])
+            return outcome
+
+        joined = None
+
+        async def on_join(shared):
+            nonlocal joined
+            joined = shared
+            if waiter and shared.operation_name:
+                await record_submitted([waiter], shared.operation_name)
+
+        # 同じ内容の動画が生成済みであれば再利用し、生成中であればその結果を共有する
+        input_image_uri = image_url if "image" in generate_videos_args else None
+        key = await loop.run_in_executor(
+            blocking_executor, render_cache.render_key, VEO_MODEL, prompt, input_image_uri, VEO_ASPECT_RATIO
+        )
+        if not user_id:
+            # コピー先のユーザーフォルダがないため、他のユーザーの動画を渡さないようキャッシュも共有も使わない
+            shared = render_cache.SharedRender()
+            if waiter:
+                shared.waiters.append(waiter)
+            gcs_uri, error = await render(shared)
+        else:
+            gcs_uri = await loop.run_in_executor(blocking_executor, render_cache.render_index.lookup, key)
             if gcs_uri:
-                return {"scene_name": scene_name, "gcs_url": gcs_uri}
+                print(f"Render cache hit for scene '{scene_name}': {gcs_uri}")
+                error = None
             else:
-                print(f"Failed to get signed URL for {gcs_uri}")
-                return {"scene_name": scene_name, "gcs_url": None, "error": "Failed to get signed URL"}
-        else:
-            return {"scene_name": scene_name, "gcs_url": None, "error": "No video generated"}
+                gcs_uri, error = await render_cache.run_shared(key, render, waiter=waiter, on_join=on_join)
+
+        if error:
+            print(f"Error generating video for scene '{scene_name}': {error}")
+            return {"scene_name": scene_name, "gcs_url": None, "error": error}
+
+        if user_id:
+            # 他のユーザーの生成結果を再利用した場合は、このユーザーの出力フォルダにコピーする
+            copied_uri = await loop.run_in_executor(
+                blocking_executor, render_cache.copy_to_folder, gcs_uri, final_output_gcs_uri, key
+            )
+            if waiter and joined and joined.operation_name and copied_uri != gcs_uri:
+                await loop.run_in_executor(
+                    blocking_executor, render_job_store.record_finished,
+                    joined.operation_name, copied_uri, None, waiter["job_id"],
+                )
+            gcs_uri = copied_uri
+        print(f"Generated video for scene '{scene_name}': {gcs_uri}")
+        if user_id:
+            await loop.run_in_executor(blocking_executor, _record_generated_video, gcs_uri, user_id)
+        return {"scene_name": scene_name, "gcs_url": gcs_uri}
 
     except Exception as e:
         print(f"An unexpected error occurred in _generate_video_for_scene for '{scene_name}': {e}")
         return {"scene_name": scene_name, "gcs_url": None, "error": str(e)}
 
 
+async def _resume_render_job(job: dict) -> None:
+    """永続化された未完了オペレーションの完了を待ち、結果を記録します。"""
+    operation = types.GenerateVideosOperation(name=job["operation_name"])
+    try:
+        operation = await veo_poller.wait(operation)
+        gcs_uri, error = _operation_outcome(operation)
+    except Exception as e:
+        gcs_uri, error = None, str(e)
+    loop = asyncio.get_running_loop()
+    if gcs_uri and job["user_id"]:
+        # 共有した生成に参加したジョブの場合、動画は最初のユーザーのフォルダにあるため、このユーザーのフォルダにコピーする
+        try:
+            copy_key = hashlib.sha256(job["operation_name"].encode("utf-8")).hexdigest()
+            gcs_uri = await loop.run_in_executor(
+                blocking_executor, render_cache.copy_to_folder, gcs_uri, f"{output_gcs_uri}/{job['user_id']}", copy_key
+            )
+        except Exception as e:
+            gcs_uri, error = None, f"Could not copy the video to the user's folder: {e}"
+    await loop.run_in_executor(
+        blocking_executor, render_job_store.record_finished, job["operation_name"], gcs_uri, error, job["job_id"]
+    )
+    print(f"Resumed render job {job['job_id']} scene '{job['scene_name']}': {gcs_uri or error}")
+    if gcs_uri and job["user_id"]:
+        await loop.run_in_executor(blocking_executor, _record_generated_video, gcs_uri, job["user_id"])
+
+
+async def resume_render_jobs() -> int:
+    """
+    起動時に呼び出し、前のインスタンスで未完了だったオペレーションのポーリングを再開します。
+    完了した動画は次に DirectorAgent が実行されたときにセッションの movie_urls に反映されます。
+    """
+    loop = asyncio.get_running_loop()
+    jobs = await loop.run_in_executor(blocking_executor, render_job_store.list_unfinished)
+    for job in jobs:
+        task = loop.create_task(_resume_render_job(job))
+        _resume_tasks.add(task)
+        task.add_done_callback(_resume_tasks.discard)
+    if jobs:
+        print(f"Resuming {len(jobs)} unfinished render operations.")
+    return len(jobs)
+
 
 async def send_to_veo3_api(tool_context: ToolContext,scene_prompts: dict) -> dict:
     """
@@ -373,9 +425,15 @@ async def send_to_veo3_api(tool_context: ToolContext,scene_prompts: dict) -> dic
     prompts_dict = scene_prompts
     print(prompts_dict)
 
-    # tool_context.stateからmovie_urlsを取得。なければ初期化。
+    # アーティファクト (以前のセッションでは state) からmovie_urlsを取得。なければ初期化。
     # 以前の実行でリストが保存されている可能性があるため、型をチェックして辞書であることを保証します。
-    movies = tool_context.state.get("movie_urls")
+    try:
+        movies = await session_artifacts.load(tool_context, "movie_urls")
+    except Exception as e:
+        # アーティファクトサービスのエラー (見つからない場合は load が state の値を返す)。
+        # 読み込めないまま保存すると、これまでの動画URLが上書きされてしまう
+        print(f"Could not load movie_urls: {e}")
+        return {"status": "error", "message": f"Failed to load the current movie_urls: {e}"}
     print(movies)
     if not isinstance(movies, dict):
         movies = {}
@@ -387,29 +445,53 @@ async def send_to_veo3_api(tool_context: ToolContext,scene_prompts: dict) -> dic
 
     user_id = tool_context.state.get("user_id", "")
 
+    # ジョブ情報 (送信したオペレーションを永続化し、再起動後に再開・状態照会できるようにする)
+    session = tool_context.state.get(RENDER_JOB_SESSION_KEY) or {}
+    job = {"job_id": uuid.uuid4().hex, "app_name": session.get("app_name"), "session_id": session.get("session_id")}
 
     # 各シーンの動画生成タスクを作成
-    tasks = [_generate_video_for_scene(scene_name, prompt,user_id) for scene_name, prompt in prompts_dict.items()]
-
-    # タスクを並列実行
-    results = await asyncio.gather(*tasks)
+    tasks = [_generate_video_for_scene(scene_name, prompt,user_id, job) for scene_name, prompt in prompts_dict.items()]
 
+    # タスクを並列実行し、完了したシーンから順に state の更新と進捗イベントの送信を行う
     success_count = 0
     error_messages = []
-    # 結果を処理
-    for result in results:
-        if result and result.get("gcs_url"):
-            scene_name = result["scene_name"]
-            gcs_url = result["gcs_url"]
-            movies[scene_name].append(gcs_url)
-            success_count += 1
-        elif result and result.get("error"):
-            scene_name = result.get("scene_name", "Unknown Scene")
-            error_messages.append(f"Scene '{scene_name}': {result['error']}")
-
-    tool_context.state["movie_urls"] = movies
+    _active_render_jobs.add(job["job_id"])
+    try:
+        for completed, next_result in enumerate(asyncio.as_completed(tasks), start=1):
+            result = await next_result
+            if result and result.get("gcs_url"):
+                scene_name = result["scene_name"]
+                gcs_url = result["gcs_url"]
+                movies[scene_name].append(gcs_url)
+                success_count += 1
+            elif result and result.get("error"):
+                scene_name = result.get("scene_name", "Unknown Scene")
+                error_messages.append(f"Scene '{scene_name}': {result['error']}")
+            render_events.publish(session.get("user_id"), job["session_id"], {
+                "type": "scene_completed",
+                "job_id": job["job_id"],
+                "scene_name": result.get("scene_name") if result else None,
+                "gcs_url": result.get("gcs_url") if result else None,
+                "error": result.get("error") if result else None,
+                "completed": completed,
+                "total": len(tasks),
+            })
+    finally:
+        _active_render_jobs.discard(job["job_id"])
+
+    # movie_urls はアーティファクトに保存し、state には参照だけを置く (古い動画URLは件数を制限して削除)
+    await session_artifacts.save(tool_context, "movie_urls", movies)
+    movies = session_artifacts.trim_movie_urls(movies)
+    await asyncio.get_running_loop().run_in_executor(blocking_executor, render_job_store.mark_job_applied, job["job_id"])
     print(f"Updated movie_urls in state: {movies}")
     print(f"Error messages: {error_messages}")
+    render_events.publish(session.get("user_id"), job["session_id"], {
+        "type": "job_completed",
+        "job_id": job["job_id"],
+        "succeeded": success_count,
+        "total": len(tasks),
+        "movie_urls": movies,
+    })
 
     if success_count > 0:
         success_message = f"Successfully generated videos for {success_count}/{len(tasks)} scenes."
@@ -419,7 +501,8 @@ async def send_to_veo3_api(tool_context: ToolContext,scene_prompts: dict) -> dic
         return {
             "status": "success",
             "message": success_message,
-            "movie_urls": movies
+            "movie_urls": movies,
+            "job_id": job["job_id"]
         }
     else:
         return {
@@ -427,7 +510,8 @@ async def send_to_veo3_api(tool_context: ToolContext,scene_prompts: dict) -> dic
             "message": f"Failed to generate any videos. Details: {'; '.join(error_messages)}"
             if error_messages
             else "Failed to generate any videos with no specific error details.",
-            "movie_urls": movies
+            "movie_urls": movies,
+            "job_id": job["job_id"]
         }
 
 def save_request_title_callback(
@@ -509,6 +593,43 @@ class DirectorAgent(BaseAgent):
             if user_id:
                 ctx.session.state["user_id"] = user_id
 
+        # 動画生成ジョブの記録に使うセッションの情報
+        ctx.session.state[RENDER_JOB_SESSION_KEY] = {
+            "app_name": ctx.session.app_name,
+            "user_id": ctx.session.user_id,
+            "session_id": ctx.session.id,
+        }
+
+        # 以前のインスタンスで完了した動画をセッションの movie_urls に反映する
+        finished_jobs = await asyncio.get_running_loop().run_in_executor(
+            blocking_executor, render_job_store.take_unapplied, ctx.session.id, set(_active_render_jobs)
+        )
+        if finished_jobs:
+            # state / アーティファクトの変更はこの EventActions に記録され、イベントとして保存される
+            actions = EventActions()
+            callback_context = CallbackContext(ctx, event_actions=actions)
+            try:
+                movies = await session_artifacts.load(callback_context, "movie_urls")
+            except Exception as e:
+                # 読み込めないまま保存すると既存の movie_urls を上書きするため、次回の実行で反映する
+                logger.warning(f"[{self.name}] Could not load movie_urls; deferring resumed render results: {e}")
+                await asyncio.get_running_loop().run_in_executor(
+                    blocking_executor, render_job_store.release, finished_jobs
+                )
+                finished_jobs = []
+        if finished_jobs:
+            if not isinstance(movies, dict):
+                movies = {}
+            for finished in finished_jobs:
+                movies.setdefault(finished["scene_name"], []).append(finished["gcs_url"])
+            logger.info(f"[{self.name}] Applying {len(finished_jobs)} resumed render results.")
+            await session_artifacts.save(callback_context, "movie_urls", movies)
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                actions=actions,
+            )
+
         # renderer
         logger.info(f"[{self.name}] Running Director...")
         async for event in self.director.run_async(parent_context=ctx):
@@ -530,7 +651,7 @@ class DirectorAgent(BaseAgent):
 
 # stateに保存
 async def save_theme_list(tool_context: ToolContext, theme_dict: dict)->dict:
-    tool_context.state["theme_list"] = theme_dict
+    await session_artifacts.save(tool_context, "theme_list", theme_dict)
     print(f"[SAVE THEME] Updated theme_list in state: {theme_dict}")
     return theme_dict
 
@@ -567,7 +688,14 @@ scene_agent = Agent(
     """,
     description="Creates a proposal for the video's scene breakdown.",
     tools=[save_theme_list],
-    before_model_callback=save_request_title_callback
+    # 同じリクエストにはキャッシュした応答を返す (タイトルの保存は先に行う)
+    # 応答キャッシュのキーはシステム指示を含むため、コンテキストキャッシュへの置き換えは最後に行う
+    before_model_callback=[
+        save_request_title_callback,
+        model_cache.before_model_callback,
+        instruction_cache.before_model_callback,
+    ],
+    after_model_callback=model_cache.after_model_callback,
 )
 
 
@@ -597,6 +725,7 @@ renderer_agent = Agent(
                 """,
     description="Translates the video configuration JSON to English and sends it to the Veo3 API for rendering.",
     tools=[send_to_veo3_api],
+    before_model_callback=instruction_cache.before_model_callback,
 )
 
 
@@ -607,11 +736,14 @@ image_generate_agent = Agent(
     name="imagen_agent",
     instruction="""
 あなたは画像を生成、編集、またはマージする専門家です。
-ユーザーが2枚の画像をマージしてほしいと指示している場合、`merge_images`ツールを使用することを検討してください。作成された画像のsigned_urlを返してください。
+ユーザーが画像をマージしてほしいと指示している場合、`merge_images`ツールを使用することを検討してください。作成された画像のsigned_urlをすべて返してください。
+ユーザーがマージする画像の gs:// URI を指定した場合は、先に`set_merge_images`ツールでそれらを保存してください。
+マージする画像が指定されていない場合は、ツールを呼ぶ前にユーザーに画像のアップロードを依頼してください。
 ユーザーからの指示には、マージ方法や最終的な画像に関する詳細な説明が含まれる場合があります。それらの情報を`text_input`引数に含めてください。
+ユーザーが複数の候補を求めた場合は、その枚数を`variants`引数に指定してください。
 """,
     description="Translates the video configuration JSON to English and sends it to the Veo3 API for rendering.",
-    tools=[merge_images],
+    tools=[set_merge_images, merge_images],
 )
 
 # state に保存するツール
@@ -637,9 +769,14 @@ async def save_prompt_list(tool_context: ToolContext,scene_number:str, prompt_di
             print(f"Warning: Could not properly normalize scene_number '{scene_number}'. Using it as is.")
             final_scene_number = scene_number
 
-    prompts = tool_context.state.get("scene_config",{})
+    try:
+        prompts = await session_artifacts.load(tool_context, "scene_config", {})
+    except Exception as e:
+        # アーティファクトサービスのエラー。読み込めないまま保存すると、他のシーンの設定が上書きされてしまう
+        print(f"Could not load scene_config: {e}")
+        return {"status": "error", "message": f"Failed to load the current scene_config: {e}"}
     prompts[final_scene_number] = prompt_dict
-    tool_context.state["scene_config"] = prompts
+    await session_artifacts.save(tool_context, "scene_config", prompts)
     print(f"Scene: {final_scene_number} (Original: '{scene_number}')")
     print(f"Updated prompt_list in state: {prompt_dict}")
     return prompt_dict
@@ -662,6 +799,7 @@ veo_prompt_agent = Agent(
     -  If a user's request to modify a prompt seems like it won't fit within 8 seconds, point it out and offer a suggestion. **IMPORTANT: Make this judgment by focusing on the `description` field, which outlines the core visual action of the scene.**
     -  When the JSON prompt is complete, call the `save_prompt_list` tool. Pass the generated JSON as the `prompt_dict` argument. For the `scene_number` argument, use a string that combines 'scene' with the scene number (e.g., 'scene1' for the first scene, 'scene2' for the second).
     -  After the tool completes execution, output a response including the JSON in the same format below.
+    -  If a scene takes place at a real location (an address, landmark, or place name) and the user has not set an `imageUrl`, you may call the `get_location_images` tool with `mirror_to_gcs` set to true. Use one of the returned `gcs_uris` as the scene's `imageUrl`. Only gs:// URIs may be used as `imageUrl`; never use the `image_urls` values there.
 
     JSON prompts must follow this structure. Unless otherwise specified, create the JSON value in Japane.
     ```json
@@ -690,7 +828,9 @@ veo_prompt_agent = Agent(
     You are not a general-purpose assistant. You are a Google Veo 3 JSON blueprint generator.
     """,
     description="Generates a structured video production plan for Veo3.",
-    tools=[save_prompt_list],
+    tools=[save_prompt_list, get_location_images],
+    before_model_callback=[model_cache.before_model_callback, instruction_cache.before_model_callback],
+    after_model_callback=model_cache.after_model_callback,
 )
 
 
@@ -723,7 +863,7 @@ director_agent = Agent(
     """,
     description="Generates a structured video production plan for Veo3.",
     tools=[agent_tool.AgentTool(agent=scene_agent),agent_tool.AgentTool(agent=veo_prompt_agent),agent_tool.AgentTool(agent=renderer_agent)],
-    
+    before_model_callback=instruction_cache.before_model_callback,
 )
 
 director_workflow_agent =DirectorAgent(
@@ -733,6 +873,18 @@ director_workflow_agent =DirectorAgent(
 
 
 
+# 振り分け先が明らかなメッセージは supervisor のモデルを呼ばずに転送する
+fast_router = FastPathRouter(
+    keywords={
+        director_workflow_agent.name: r"動画|ビデオ|映像|シーン|プロンプト|レンダリング|\bvideos?\b|\bmovies?\b|\bscenes?\b|\bprompts?\b|\bveo\b",
+        image_generate_agent.name: r"マージ|合成|画像を?(生成|作|編集)|\bmerge\b|\bcombine\b|\b(generate|edit) (an? )?images?\b",
+    },
+    state_keys={
+        director_workflow_agent.name: ("scene_config_ref", "theme_list_ref", "movie_urls_ref", "scene_config", "theme_list"),
+        image_generate_agent.name: ("merge_image_uris",),
+    },
+)
+
 # Supervisor Agent (振り分け)
 root_agent = Agent(
     name="supervisor_agent",
@@ -748,5 +900,6 @@ root_agent = Agent(
                 2. 'image_generate_agent': Generate and merge image.
                 Delegate to the appropriate agent. If a task doesn't fit any specialist, respond appropriately.""",
     sub_agents=[director_workflow_agent,image_generate_agent],
-    before_model_callback=show_userid_callback
+    before_model_callback=[show_userid_callback, fast_router.before_model_callback],
+    after_model_callback=fast_router.after_model_callback,
 )
@@ -0,0 +1,184 @@
+"""
+Gemini の明示的コンテキストキャッシュでエージェントの固定部分を共有する。
+
+director_agent などはターンごとに数KBのシステム指示とツールのスキーマを送っている。
+1回のユーザー操作で supervisor → director → サブエージェントと何度も呼ばれるため、
+同じ接頭辞の入力トークンを何度も支払うことになる。
+ここではシステム指示とツール定義をキャッシュ (CachedContent) として1度だけ登録し、
+以降のリクエストでは cached_content で参照する。キャッシュは TTL が切れる前にバックグラウンドで延長する。
+
+キャッシュの作成に失敗した場合 (トークン数が最小値に満たない場合など) は、
+しばらく通常どおり指示とツールを送る。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from google import genai
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+GEMINI_CONTEXT_CACHE_ENABLED = os.environ.get("GEMINI_CONTEXT_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# 有効期限がこの秒数を切ったら TTL を延長する
+GEMINI_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = int(os.environ.get("GEMINI_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS", "600"))
+# キャッシュの作成に失敗した後、再試行するまでの秒数
+GEMINI_CONTEXT_CACHE_RETRY_SECONDS = int(os.environ.get("GEMINI_CONTEXT_CACHE_RETRY_SECONDS", "600"))
+# プロセス内で追跡するキャッシュの最大数
+GEMINI_CONTEXT_CACHE_MAX_ENTRIES = int(os.environ.get("GEMINI_CONTEXT_CACHE_MAX_ENTRIES", "32"))
+
+
+class _CacheEntry:
+    __slots__ = ("name", "expires_at", "retry_at", "lock", "refreshing")
+
+    def __init__(self):
+        self.name: Optional[str] = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+        self.lock = asyncio.Lock()
+        self.refreshing = False
+
+
+def _dump(value: Any) -> Any:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return [_dump(v) for v in value]
+    return value.model_dump(mode="json", exclude_none=True)
+
+
+class ContextCacheManager:
+    """
+    (モデル, システム指示, ツール定義) ごとに CachedContent を作成・延長し、リクエストに設定する。
+
+    Args:
+        client: キャッシュの作成に使う genai.Client (エージェントのモデルと同じプロジェクト・リージョン)
+    """
+
+    def __init__(
+        self,
+        client: genai.Client,
+        ttl: int = GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+        refresh_margin: int = GEMINI_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS,
+        retry_after: int = GEMINI_CONTEXT_CACHE_RETRY_SECONDS,
+        max_entries: int = GEMINI_CONTEXT_CACHE_MAX_ENTRIES,
+    ):
+        self._client = client
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        # イベントループはタスクを弱参照でしか保持しないため、実行中の延長処理の参照を持っておく
+        self._tasks: set = set()
+        self.hits = 0
+        self.created = 0
+        self.refreshed = 0
+        self.failures = 0
+
+    @staticmethod
+    def _prefix_key(model: str, config: types.GenerateContentConfig) -> str:
+        payload = {
+            "model": model,
+            "system_instruction": _dump(config.system_instruction),
+            "tools": _dump(config.tools),
+            "tool_config": _dump(config.tool_config),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _entry(self, key: str) -> _CacheEntry:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _CacheEntry()
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                # 追跡をやめたキャッシュは TTL で自然に削除される
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(key)
+        return entry
+
+    async def _create(self, entry: _CacheEntry, model: str, config: types.GenerateContentConfig, label: str) -> None:
+        try:
+            cached = await self._client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"{label}-instruction",
+                    system_instruction=config.system_instruction,
+                    tools=config.tools,
+                    tool_config=config.tool_config,
+                    ttl=f"{self.ttl}s",
+                ),
+            )
+        except Exception as e:
+            self.failures += 1
+            entry.retry_at = time.time() + self.retry_after
+            print(f"[ContextCache] Could not create context cache for {label}: {e}")
+            return
+        entry.name = cached.name
+        entry.expires_at = time.time() + self.ttl
+        self.created += 1
+        print(f"[ContextCache] Created {cached.name} for {label}.")
+
+    async def _refresh(self, entry: _CacheEntry, label: str) -> None:
+        try:
+            await self._client.aio.caches.update(
+                name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+            )
+            entry.expires_at = time.time() + self.ttl
+            self.refreshed += 1
+        except Exception as e:
+            print(f"[ContextCache] Could not refresh {entry.name} for {label}: {e}")
+        finally:
+            entry.refreshing = False
+
+    async def _cache_name(self, model: str, config: types.GenerateContentConfig, label: str) -> Optional[str]:
+        entry = self._entry(self._prefix_key(model, config))
+        now = time.time()
+        if entry.name is None or entry.expires_at <= now:
+            if entry.retry_at > now:
+                return None
+            async with entry.lock:
+                if entry.name is None or entry.expires_at <= time.time():
+                    entry.name = None
+                    await self._create(entry, model, config, label)
+            return entry.name
+        if entry.expires_at - now <= self.refresh_margin and not entry.refreshing:
+            # 現在のキャッシュはまだ有効なので、延長はリクエストを待たせずに行う
+            entry.refreshing = True
+            task = asyncio.get_running_loop().create_task(self._refresh(entry, label))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return entry.name
+
+    async def before_model_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> Optional[LlmResponse]:
+        """システム指示とツール定義をコンテキストキャッシュの参照に置き換えます。"""
+        config = llm_request.config
+        if not GEMINI_CONTEXT_CACHE_ENABLED or config is None or config.cached_content or not config.system_instruction:
+            return None
+        name = await self._cache_name(llm_request.model, config, callback_context.agent_name)
+        if name is None:
+            return None
+        # キャッシュに含めた指示・ツールはリクエストに含めることができない
+        config.cached_content = name
+        config.system_instruction = None
+        config.tools = None
+        config.tool_config = None
+        self.hits += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": GEMINI_CONTEXT_CACHE_ENABLED,
+            "caches": sum(1 for entry in self._entries.values() if entry.name),
+            "hits": self.hits,
+            "created": self.created,
+            "refreshed": self.refreshed,
+            "failures": self.failures,
+        }
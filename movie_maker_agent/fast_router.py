@@ -0,0 +1,161 @@
+"""
+supervisor_agent の前段で、振り分け先が明らかなメッセージをモデルを呼ばずに転送するルーター。
+
+supervisor_agent のモデル呼び出しは、ほとんどの場合サブエージェントを選ぶだけに使われている。
+次のルールで振り分け先が1つに決まる場合は、transfer_to_agent の関数呼び出しを
+before_model_callback から直接返して、モデルの往復を1回省略する。
+
+1. メッセージがどちらか一方のエージェントのキーワードだけに一致する場合、そのエージェント
+2. キーワードに一致しない場合、state からフローが進行中と分かるエージェントが1つだけならそのエージェント
+3. 進行中のフローが複数ある場合、その中で直前に振り分けたエージェント (進行中のフローへの返答)
+
+両方のキーワードに一致する場合や、進行中のフローがない場合 (雑談など) はモデルに任せる。
+ルーターが動くのはユーザーの新しいメッセージに対してのみで、サブエージェントから制御が戻ったとき
+(ADK が "For context:" で始まるユーザー発言に変換した他エージェントのイベント) はモデルに任せる。
+制御を戻したエージェントには、キーワードに一致しない限り再度振り分けない。
+"""
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+FAST_ROUTER_ENABLED = os.environ.get("FAST_ROUTER_ENABLED", "true").lower() not in ("0", "false", "no")
+
+# 直前に振り分けたエージェント名を保存する state のキー
+LAST_ROUTED_AGENT_KEY = "last_routed_agent"
+# 制御を戻したサブエージェント名を保存する state のキー
+RETURNED_FROM_AGENT_KEY = "fast_router_returned_from"
+# ADK がサブエージェントへの転送に使う関数
+_TRANSFER_FUNCTION = "transfer_to_agent"
+# ADK が他のエージェントのイベントをユーザー発言に変換するときの接頭辞と、発言者の表記
+_FOREIGN_EVENT_PREFIX = "For context:"
+_FOREIGN_AUTHOR_RE = re.compile(r"^\[([^\]]+)\]")
+
+
+def _text(content: Optional[types.Content]) -> str:
+    if not content or not content.parts:
+        return ""
+    return "".join(part.text for part in content.parts if part.text)
+
+
+def _foreign_author(content: types.Content) -> Optional[str]:
+    """他のエージェントのイベントを変換したユーザー発言であれば、そのエージェント名を返します。"""
+    if content.role != "user" or not content.parts or not content.parts[0].text:
+        return None
+    if not content.parts[0].text.startswith(_FOREIGN_EVENT_PREFIX):
+        return None
+    for part in content.parts[1:]:
+        match = _FOREIGN_AUTHOR_RE.match(part.text or "")
+        if match:
+            return match.group(1)
+    return ""
+
+
+def _user_text(llm_request: LlmRequest, user_content: Optional[types.Content]) -> Optional[str]:
+    """リクエストがユーザーの新しいメッセージ (user_content) で終わっている場合、そのテキストを返します。"""
+    if not llm_request.contents:
+        return None
+    last = llm_request.contents[-1]
+    if last.role != "user" or not last.parts:
+        return None
+    if any(part.function_response for part in last.parts):
+        return None
+    if _foreign_author(last) is not None:
+        return None
+    text = _text(last)
+    if not text or text != _text(user_content):
+        return None
+    return text
+
+
+def _transfer_response(agent_name: str) -> LlmResponse:
+    return LlmResponse(
+        content=types.Content(
+            role="model",
+            parts=[types.Part(function_call=types.FunctionCall(name=_TRANSFER_FUNCTION, args={"agent_name": agent_name}))],
+        )
+    )
+
+
+class FastPathRouter:
+    """
+    キーワードと state からサブエージェントを決める。
+
+    Args:
+        keywords: エージェント名 -> メッセージに一致させる正規表現
+        state_keys: エージェント名 -> そのエージェントのフローが進行中であることを示す state のキー
+    """
+
+    def __init__(self, keywords: Dict[str, str], state_keys: Dict[str, Iterable[str]]):
+        self._keywords = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in keywords.items()}
+        self._state_keys = {name: tuple(keys) for name, keys in state_keys.items()}
+        self.routed: Dict[str, int] = {}
+        self.fallbacks = 0
+
+    def route(self, text: str, state) -> Optional[str]:
+        """振り分け先のエージェント名を返します。判断できない場合は None を返します。"""
+        matched = [name for name, pattern in self._keywords.items() if pattern.search(text)]
+        if len(matched) == 1:
+            return matched[0]
+        if matched:
+            return None
+
+        returned_from = state.get(RETURNED_FROM_AGENT_KEY)
+        active = [
+            name for name, keys in self._state_keys.items()
+            if name != returned_from and any(state.get(key) for key in keys)
+        ]
+        if len(active) == 1:
+            return active[0]
+        last_routed = state.get(LAST_ROUTED_AGENT_KEY)
+        if last_routed in active:
+            return last_routed
+        return None
+
+    def before_model_callback(self, callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+        """振り分け先が明らかな場合、モデルを呼ばずに転送の関数呼び出しを返します。"""
+        if not FAST_ROUTER_ENABLED:
+            return None
+        returned_from = _foreign_author(llm_request.contents[-1]) if llm_request.contents else None
+        if returned_from is not None:
+            # サブエージェントから制御が戻った。次のメッセージをそのエージェントに戻さない
+            callback_context.state[LAST_ROUTED_AGENT_KEY] = None
+            callback_context.state[RETURNED_FROM_AGENT_KEY] = returned_from or None
+            return None
+        text = _user_text(llm_request, callback_context.user_content)
+        if text is None:
+            return None
+        agent_name = self.route(text, callback_context.state)
+        if agent_name is None:
+            self.fallbacks += 1
+            print("[FastPathRouter] Ambiguous message; asking the supervisor model.")
+            return None
+        self.routed[agent_name] = self.routed.get(agent_name, 0) + 1
+        callback_context.state[LAST_ROUTED_AGENT_KEY] = agent_name
+        callback_context.state[RETURNED_FROM_AGENT_KEY] = None
+        print(f"[FastPathRouter] Routing directly to {agent_name}.")
+        return _transfer_response(agent_name)
+
+    def after_model_callback(self, callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+        """モデルが選んだ転送先を記録し、次のメッセージの振り分けに使います。"""
+        if not llm_response.content or not llm_response.content.parts:
+            return None
+        for part in llm_response.content.parts:
+            call = part.function_call
+            if call and call.name == _TRANSFER_FUNCTION and (call.args or {}).get("agent_name") in self._keywords:
+                callback_context.state[LAST_ROUTED_AGENT_KEY] = call.args["agent_name"]
+                callback_context.state[RETURNED_FROM_AGENT_KEY] = None
+        return None
+
+    def stats(self):
+        routed = sum(self.routed.values())
+        total = routed + self.fallbacks
+        return {
+            "enabled": FAST_ROUTER_ENABLED,
+            "routed": dict(self.routed),
+            "fallbacks": self.fallbacks,
+            "fast_path_ratio": routed / total if total else 0.0,
+        }
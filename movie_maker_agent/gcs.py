@@ -0,0 +1,99 @@
+"""
+GCS 関連のヘルパー。
+
+署名付き URL はこのプロセスの認証情報で V4 署名する。
+Cloud Function (create_signed_url) 経由の署名は SIGNED_URL_MODE=remote の場合と、
+ローカル署名に失敗した場合のフォールバックとしてのみ使用する。
+"""
+import datetime
+import logging
+import os
+from typing import Optional
+
+import requests
+from google.auth.transport.requests import Request
+from google.oauth2 import id_token
+from google.oauth2 import service_account
+
+from shared.storage_pool import get_credentials, get_storage_client
+
+logger = logging.getLogger(__name__)
+
+SIGNED_URL_FUNCTIONS_URL = os.environ.get(
+    "SIGNED_URL_FUNCTIONS_URL",
+    "https://asia-northeast1-aiagenthackathon-469114.cloudfunctions.net/create_signed_url",
+)
+# "local": プロセス内で署名 / "remote": Cloud Function を呼び出す
+SIGNED_URL_MODE = os.environ.get("SIGNED_URL_MODE", "local")
+
+
+def _sign_locally(bucket_name: str, file_name: str, expiration_time: int, response_disposition: Optional[str]) -> str:
+    credentials = get_credentials()
+    blob = get_storage_client().bucket(bucket_name).blob(file_name)
+    signing_args = {
+        "version": "v4",
+        "expiration": datetime.timedelta(seconds=expiration_time),
+        "method": "GET",
+        "credentials": credentials,
+        "response_disposition": response_disposition,
+    }
+    if not isinstance(credentials, service_account.Credentials):
+        # 秘密鍵を持たない認証情報 (Cloud Run のメタデータサーバー等) は IAM signBlob で署名する
+        signing_args["service_account_email"] = credentials.service_account_email
+        signing_args["access_token"] = credentials.token
+    return blob.generate_signed_url(**signing_args)
+
+
+def _sign_remotely(bucket_name: str, file_name: str, expiration_time: int, download: bool) -> Optional[dict]:
+    # IDトークンの生成
+    auth_req = Request()
+    token = id_token.fetch_id_token(auth_req, SIGNED_URL_FUNCTIONS_URL)
+
+    # リクエストヘッダーにAuthorizationヘッダーを追加
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {token}'
+    }
+
+    # リクエストボディ
+    data = {
+        'bucketName': bucket_name,
+        'fileName': file_name,
+        'download': bool(download),
+        'expirationTime': expiration_time,
+    }
+
+    try:
+        response = requests.post(SIGNED_URL_FUNCTIONS_URL, headers=headers, json=data)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"Error calling Cloud Function: {e}")
+        return None
+
+
+def generate_signed_url(bucket_name, file_name, expiration_time=3600, download=False):
+    """
+    GCSオブジェクトの認証済みURLを生成します。
+
+    Args:
+        bucket_name: GCSバケット名
+        file_name: GCS内のオブジェクトのパス
+        expiration_time: URLの有効期限（秒）。デフォルトは1時間。
+        download: Trueの場合、Content-Disposition: attachment を付与します。
+
+    Returns:
+        {"signedUrl": 認証済みURL}。失敗した場合は None。
+    """
+    if SIGNED_URL_MODE == "remote":
+        return _sign_remotely(bucket_name, file_name, expiration_time, download)
+
+    response_disposition = None
+    if download:
+        response_disposition = f"attachment; filename*=UTF-8''{os.path.basename(file_name)}"
+    try:
+        url = _sign_locally(bucket_name, file_name, expiration_time, response_disposition)
+        return {"signedUrl": url}
+    except Exception as e:
+        logger.warning(f"Local URL signing failed, falling back to Cloud Function: {e}")
+        return _sign_remotely(bucket_name, file_name, expiration_time, download)
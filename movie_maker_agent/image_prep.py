@@ -0,0 +1,130 @@
+"""
+Veo に渡す入力画像の前処理。
+
+ユーザーがアップロードした画像は数MBの JPEG やアスペクト比の異なる画像であることが多く、
+そのまま渡すと Veo のオペレーションが失敗したり転送に時間がかかったりする。
+ここでは実際の MIME タイプを判定し、Veo の解像度を超える画像だけを
+設定したアスペクト比に合わせてクロップ (またはパディング) して縮小し、GCS に保存する。
+解像度に収まる画像は拡大せず、EXIF の回転と形式の変換だけを行う。
+変換結果は元画像の内容ハッシュをキーに保存し、同じ画像を2度処理しない。
+"""
+import hashlib
+import os
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from shared.storage_pool import get_storage_client
+
+# Veo の出力解像度 (16:9 の場合 1280x720)。入力画像はこのサイズに収める
+VEO_INPUT_LONG_EDGE = int(os.environ.get("VEO_INPUT_LONG_EDGE", "1280"))
+# アスペクト比が異なる場合の処理: "crop" (中央をクロップ) または "pad" (余白を追加)
+VEO_INPUT_FIT = os.environ.get("VEO_INPUT_FIT", "crop")
+VEO_INPUT_JPEG_QUALITY = int(os.environ.get("VEO_INPUT_JPEG_QUALITY", "90"))
+# 変換した画像を保存するフォルダ (入力画像と同じバケット内)
+VEO_INPUT_CACHE_FOLDER = os.environ.get("VEO_INPUT_CACHE_FOLDER", "_veo_inputs")
+
+# Veo が受け付ける入力画像の形式
+_SUPPORTED_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png"}
+# 変換処理を変えたときにキャッシュを無効にするためのバージョン
+_PIPELINE_VERSION = "3"
+# EXIF の Orientation タグ
+_EXIF_ORIENTATION = 0x0112
+
+
+def _split_gcs_uri(gcs_uri: str):
+    bucket_name, blob_name = gcs_uri.replace("gs://", "", 1).split("/", 1)
+    return bucket_name, blob_name
+
+
+def target_size(aspect_ratio: str, long_edge: int = VEO_INPUT_LONG_EDGE) -> Tuple[int, int]:
+    """アスペクト比 ("16:9" など) から出力サイズ (幅, 高さ) を返します。"""
+    width_ratio, height_ratio = (int(v) for v in aspect_ratio.split(":"))
+    if width_ratio >= height_ratio:
+        return long_edge, round(long_edge * height_ratio / width_ratio)
+    return round(long_edge * width_ratio / height_ratio), long_edge
+
+
+def normalize_image(data: bytes, size: Tuple[int, int], fit: str = VEO_INPUT_FIT) -> Tuple[bytes, str]:
+    """
+    size を超える画像を、size のアスペクト比に合わせてクロップ (またはパディング) して縮小します。
+    画像は拡大しません。size に収まる画像は EXIF の回転と JPEG への変換 (未対応の形式の場合) だけを行い、
+    変換が不要な場合は元のバイト列をそのまま返します。
+
+    Returns:
+        (画像のバイト列, MIME タイプ)
+    """
+    with Image.open(BytesIO(data)) as image:
+        mime_type = _SUPPORTED_MIME_TYPES.get(image.format)
+        # EXIF の回転情報がある場合は、size に収まっていても回転を適用して再エンコードする
+        rotated = image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+        image = ImageOps.exif_transpose(image)
+        fits = image.width <= size[0] and image.height <= size[1]
+        if mime_type and not rotated and fits:
+            return data, mime_type
+        image = image.convert("RGB")
+
+        if fits:
+            # 拡大はしないため、回転と形式の変換だけを行う
+            pass
+        elif fit == "pad":
+            image.thumbnail(size, Image.Resampling.LANCZOS)
+            canvas = Image.new("RGB", size, (0, 0, 0))
+            canvas.paste(image, ((size[0] - image.width) // 2, (size[1] - image.height) // 2))
+            image = canvas
+        else:
+            # 中央を size のアスペクト比でクロップし、size を超える場合だけ縮小する
+            if image.width * size[1] > image.height * size[0]:
+                width = max(1, round(image.height * size[0] / size[1]))
+                left = (image.width - width) // 2
+                image = image.crop((left, 0, left + width, image.height))
+            else:
+                height = max(1, round(image.width * size[1] / size[0]))
+                top = (image.height - height) // 2
+                image = image.crop((0, top, image.width, top + height))
+            if image.width > size[0] or image.height > size[1]:
+                image = image.resize(size, Image.Resampling.LANCZOS)
+
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=VEO_INPUT_JPEG_QUALITY, optimize=True)
+        return output.getvalue(), "image/jpeg"
+
+
+def prepare_veo_image(gcs_uri: str, aspect_ratio: str) -> Tuple[str, str]:
+    """
+    入力画像を Veo 向けに変換して GCS に保存し、(GCS URI, MIME タイプ) を返します。
+    同じ内容の画像が変換済みであれば、変換せずにその URI を返します。
+    (GCS への I/O と画像処理が発生するため、executor で呼び出してください)
+    """
+    bucket_name, blob_name = _split_gcs_uri(gcs_uri)
+    bucket = get_storage_client().bucket(bucket_name)
+    size = target_size(aspect_ratio)
+
+    source = bucket.get_blob(blob_name)
+    if source is None:
+        raise FileNotFoundError(f"Input image not found: {gcs_uri}")
+
+    # GCS のメタデータにある MD5 を内容ハッシュとして使い、ダウンロード前にキャッシュを確認する
+    content_hash: Optional[str] = source.md5_hash
+    data = None
+    if not content_hash:
+        data = source.download_as_bytes()
+        content_hash = hashlib.md5(data).hexdigest()
+    cache_key = hashlib.sha256(
+        f"{_PIPELINE_VERSION}:{content_hash}:{size[0]}x{size[1]}:{VEO_INPUT_FIT}".encode("utf-8")
+    ).hexdigest()[:32]
+
+    for extension, mime_type in ((".jpg", "image/jpeg"), (".png", "image/png")):
+        cached_name = f"{VEO_INPUT_CACHE_FOLDER}/{cache_key}{extension}"
+        if bucket.blob(cached_name).exists():
+            return f"gs://{bucket_name}/{cached_name}", mime_type
+
+    if data is None:
+        data = source.download_as_bytes()
+    normalized, mime_type = normalize_image(data, size)
+    extension = ".png" if mime_type == "image/png" else ".jpg"
+    cached_name = f"{VEO_INPUT_CACHE_FOLDER}/{cache_key}{extension}"
+    bucket.blob(cached_name).upload_from_string(normalized, content_type=mime_type)
+    print(f"Prepared Veo input {gcs_uri} -> gs://{bucket_name}/{cached_name} ({len(data)} -> {len(normalized)} bytes)")
+    return f"gs://{bucket_name}/{cached_name}", mime_type
@@ -0,0 +1,351 @@
+"""
+場所 (住所や地名) の画像URLを Google Maps API で収集するツール。
+
+同じランドマークの検索はセッションをまたいで何度も繰り返されるため、
+正規化したクエリをキーに Find Place / Place Details の結果を TTL 付きでキャッシュする。
+キャッシュはメモリ上の LRU と、LOCATION_CACHE_DB を指定した場合は SQLite の2段構成。
+API キーを含む URL は保存せず、photo_reference と座標だけを保存して返すときに URL を組み立てる。
+
+mirror_to_gcs を指定すると、写真をユーザーの GCS フォルダにコピーし、
+シーンの imageUrl にそのまま使える gs:// URI を返す。
+"""
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlencode
+
+import httpx
+from google.adk.tools import ToolContext
+
+from shared import user_manifest
+from shared.storage_pool import get_storage_client
+
+# キャッシュの有効期間 (秒)
+LOCATION_CACHE_TTL_SECONDS = int(os.environ.get("LOCATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LOCATION_CACHE_MAX_ENTRIES = int(os.environ.get("LOCATION_CACHE_MAX_ENTRIES", "1024"))
+# 指定した場合、SQLite にもキャッシュを保存してインスタンスの再起動後も再利用する
+LOCATION_CACHE_DB = os.environ.get("LOCATION_CACHE_DB")
+# Maps API への HTTP リクエストのタイムアウト (秒) と同時接続数
+LOCATION_HTTP_TIMEOUT_SECONDS = float(os.environ.get("LOCATION_HTTP_TIMEOUT_SECONDS", "10"))
+LOCATION_HTTP_MAX_CONNECTIONS = int(os.environ.get("LOCATION_HTTP_MAX_CONNECTIONS", "20"))
+
+# mirror_to_gcs の保存先。upload_file / list_files 関数と同じ BUCKET_NAME / FOLDER_NAME を設定する
+# (未設定の場合はコピーしない。ずれているとファイル一覧に表示されないため、既定値は持たない)
+LOCATION_MIRROR_BUCKET = os.environ.get("BUCKET_NAME")
+LOCATION_MIRROR_FOLDER = os.environ.get("FOLDER_NAME")
+# 写真を同時にダウンロード・アップロードする数
+LOCATION_MIRROR_CONCURRENCY = int(os.environ.get("LOCATION_MIRROR_CONCURRENCY", "4"))
+# コピーする写真の最大幅 (Veo の入力に使うため、表示用より大きいサイズを取得する)
+LOCATION_MIRROR_PHOTO_MAX_WIDTH = int(os.environ.get("LOCATION_MIRROR_PHOTO_MAX_WIDTH", "1600"))
+
+FIND_PLACE_URL = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
+PLACE_DETAILS_URL = "https://maps.googleapis.com/maps/api/place/details/json"
+PLACE_PHOTO_URL = "https://maps.googleapis.com/maps/api/place/photo"
+STREET_VIEW_URL = "https://maps.googleapis.com/maps/api/streetview"
+STREET_VIEW_HEADINGS = [0, 90, 180, 270]
+MAX_PLACE_PHOTOS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS location_cache (
+    query TEXT PRIMARY KEY,
+    place TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """全角/半角・大文字/小文字・空白の違いを揃えたキャッシュキーを返します。"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", query)).strip().lower()
+
+
+class PlaceCache:
+    """正規化したクエリ -> 場所の情報 (place_id, 座標, photo_reference) の LRU + TTL キャッシュ。"""
+
+    def __init__(
+        self,
+        max_entries: int = LOCATION_CACHE_MAX_ENTRIES,
+        ttl: int = LOCATION_CACHE_TTL_SECONDS,
+        path: Optional[str] = LOCATION_CACHE_DB,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db_initialized = False
+        self.hits = 0
+        self.misses = 0
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._db_lock:
+            conn = sqlite3.connect(self.path, timeout=10)
+            try:
+                if not self._db_initialized:
+                    conn.executescript(_SCHEMA)
+                    self._db_initialized = True
+                with conn:
+                    return conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+
+    def _remember(self, key: str, place: dict, created_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (place, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] + self.ttl > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(key, None)
+
+        if self.path:
+            try:
+                rows = await asyncio.to_thread(
+                    self._execute,
+                    "SELECT place, created_at FROM location_cache WHERE query = ? AND created_at >= ?",
+                    (key, now - self.ttl),
+                )
+            except sqlite3.Error as e:
+                print(f"Location cache read failed: {e}")
+                rows = []
+            if rows:
+                place = json.loads(rows[0][0])
+                self._remember(key, place, rows[0][1])
+                self.hits += 1
+                return place
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, place: dict) -> None:
+        now = time.time()
+        self._remember(key, place, now)
+        if self.path:
+            try:
+                await asyncio.to_thread(
+                    self._execute,
+                    "INSERT OR REPLACE INTO location_cache (query, place, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(place, ensure_ascii=False), now),
+                )
+            except sqlite3.Error as e:
+                print(f"Location cache write failed: {e}")
+
+
+place_cache = PlaceCache()
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """コネクションプール付きの HTTP クライアントを返します。初回のみ作成します。"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LOCATION_HTTP_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=LOCATION_HTTP_MAX_CONNECTIONS),
+        )
+    return _http_client
+
+
+async def _get_json(url: str, params: dict) -> dict:
+    response = await _get_http_client().get(url, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+async def _fetch_photo_references(place_id: str, api_key: str) -> Optional[list]:
+    """Place Details から photo_reference のリストを取得します。失敗した場合は None を返します。"""
+    try:
+        place_details_data = await _get_json(
+            PLACE_DETAILS_URL, {"place_id": place_id, "fields": "photos", "key": api_key}
+        )
+    except httpx.HTTPError as e:
+        print(f"Error calling Places API (Place Details): {e}\n")
+        return None
+    if place_details_data.get("status") == "OK":
+        photos = place_details_data.get("result", {}).get("photos", [])
+        return [photo["photo_reference"] for photo in photos[:MAX_PLACE_PHOTOS]]
+    if place_details_data.get("status") == "ZERO_RESULTS":
+        return []
+    print(f"Places API (Place Details) returned status {place_details_data.get('status')}.\n")
+    return None
+
+
+def _photo_urls(photo_references: list, api_key: str, max_width: int = 400) -> list:
+    return [
+        f"{PLACE_PHOTO_URL}?{urlencode({'maxwidth': max_width, 'photoreference': reference, 'key': api_key})}"
+        for reference in photo_references
+    ]
+
+
+def _street_view_urls(lat: float, lng: float, api_key: str, size: str = "600x300") -> list:
+    return [
+        f"{STREET_VIEW_URL}?{urlencode({'size': size, 'location': f'{lat},{lng}', 'heading': heading, 'pitch': 0, 'key': api_key})}"
+        for heading in STREET_VIEW_HEADINGS
+    ]
+
+
+def _store_image(data: bytes, content_type: str, user_id: str) -> str:
+    """
+    画像をユーザーのフォルダに内容ハッシュの名前で保存し、gs:// URI を返します。
+    同じ内容の画像が保存済みであればアップロードしません。(GCS への I/O のため、スレッドで呼び出してください)
+    """
+    if not user_id:
+        raise ValueError("user_id is required to store location images.")
+    extension = mimetypes.guess_extension(content_type) or ".jpg"
+    blob_name = f"{user_manifest.user_prefix(LOCATION_MIRROR_FOLDER, user_id)}locations/{hashlib.sha256(data).hexdigest()[:32]}{extension}"
+    bucket = get_storage_client().bucket(LOCATION_MIRROR_BUCKET)
+    blob = bucket.blob(blob_name)
+    if not blob.exists():
+        blob.upload_from_string(data, content_type=content_type)
+        blob.reload()
+        try:
+            user_manifest.record_objects(bucket, LOCATION_MIRROR_FOLDER, user_id, {blob_name: user_manifest.entry_from_blob(blob)})
+        except Exception as e:
+            print(f"Failed to record gs://{LOCATION_MIRROR_BUCKET}/{blob_name} in manifest: {e}")
+    return f"gs://{LOCATION_MIRROR_BUCKET}/{blob_name}"
+
+
+async def _mirror_images(image_urls: list, user_id: str) -> list:
+    """画像を並列数を制限してダウンロードし、GCS にコピーします。失敗した画像は None になります。"""
+    semaphore = asyncio.Semaphore(LOCATION_MIRROR_CONCURRENCY)
+
+    async def mirror(url: str) -> Optional[str]:
+        async with semaphore:
+            try:
+                response = await _get_http_client().get(url, follow_redirects=True)
+                response.raise_for_status()
+                content_type = response.headers.get("content-type", "image/jpeg").split(";")[0].strip()
+                if not content_type.startswith("image/"):
+                    print(f"Skipping non-image response ({content_type}) for location photo.")
+                    return None
+                return await asyncio.to_thread(_store_image, response.content, content_type, user_id)
+            except Exception as e:
+                # URL には API キーが含まれるため、ログには出さない
+                print(f"Failed to mirror location photo: {type(e).__name__}")
+                return None
+
+    return await asyncio.gather(*(mirror(url) for url in image_urls))
+
+
+async def _find_place(query: str, api_key: str) -> dict:
+    """Find Place で place_id と座標を取得します。見つからない場合やエラーの場合は {"error": ...} を返します。"""
+    try:
+        find_place_data = await _get_json(
+            FIND_PLACE_URL,
+            {"input": query, "inputtype": "textquery", "fields": "place_id,geometry", "key": api_key},
+        )
+    except httpx.HTTPError as e:
+        return {"error": f"Error calling Places API (Find Place): {e}"}
+    if find_place_data.get("status") != "OK" or not find_place_data.get("candidates"):
+        return {
+            "error": f"Could not find place for query: {query}. Status: {find_place_data.get('status', 'Unknown')}"
+        }
+    candidate = find_place_data["candidates"][0]
+    location = candidate["geometry"]["location"]
+    print(f"Found place_id: {candidate['place_id']}, Lat: {location['lat']}, Lng: {location['lng']}\n")
+    return {"place_id": candidate["place_id"], "lat": location["lat"], "lng": location["lng"]}
+
+
+async def get_location_images(query: str, tool_context: ToolContext, mirror_to_gcs: bool = False) -> dict:
+    """
+    Collects multiple images for a given location (address or place name) using Google Maps APIs.
+    Returns a dictionary with 'status' and a list of image URLs or an error message.
+    If mirror_to_gcs is true, the images are copied into the user's GCS folder and their gs:// URIs
+    are returned in 'gcs_uris'; these can be used directly as a scene's imageUrl.
+    """
+    print(f"--- Tool: get_location_images called with query: {query} ---\n")
+    google_maps_api_key = os.environ.get("GOOGLE_MAPS_API_KEY")
+    if not google_maps_api_key:
+        return {
+            "status": "error",
+            "error_message": "GOOGLE_MAPS_API_KEY environment variable not set.",
+        }
+
+    key = normalize_query(query)
+    place = await place_cache.get(key)
+    if place is not None:
+        print(f"Location cache hit for query: {query}\n")
+        street_view_urls = _street_view_urls(place["lat"], place["lng"], google_maps_api_key)
+    else:
+        # 1. Places API - Find Place to get place_id and lat/lng
+        place = await _find_place(query, google_maps_api_key)
+        if "error" in place:
+            return {"status": "error", "error_message": place["error"]}
+        # 2. Places API - Place Details to get photo_references
+        # 3. Street View Static API (Place Details の応答を待つ間に URL を組み立てる)
+        details = asyncio.ensure_future(_fetch_photo_references(place["place_id"], google_maps_api_key))
+        street_view_urls = _street_view_urls(place["lat"], place["lng"], google_maps_api_key)
+        photo_references = await details
+        place["photo_references"] = photo_references or []
+        # Place Details が失敗した場合は、次回の検索で取り直せるようキャッシュしない
+        if photo_references is not None:
+            await place_cache.put(key, place)
+
+    image_urls = _photo_urls(place["photo_references"], google_maps_api_key)
+    print(f"Collected {len(image_urls)} Place Photos.\n")
+    image_urls += street_view_urls
+
+    if image_urls and mirror_to_gcs:
+        user_id = tool_context.state.get("user_id", "")
+        if not LOCATION_MIRROR_BUCKET or not LOCATION_MIRROR_FOLDER:
+            return {
+                "status": "error",
+                "error_message": "BUCKET_NAME and FOLDER_NAME must be set to copy location images to Cloud Storage.",
+                "image_urls": image_urls,
+            }
+        if not user_id:
+            # user_id がないとユーザーのフォルダを決められない (共有の場所に保存してしまう)
+            return {
+                "status": "error",
+                "error_message": "Cannot copy location images without a user ID.",
+                "image_urls": image_urls,
+            }
+        mirror_urls = _photo_urls(
+            place["photo_references"], google_maps_api_key, max_width=LOCATION_MIRROR_PHOTO_MAX_WIDTH
+        ) + _street_view_urls(place["lat"], place["lng"], google_maps_api_key, size="640x360")
+        gcs_uris = await _mirror_images(mirror_urls, user_id)
+        mirrored = [uri for uri in gcs_uris if uri]
+        print(f"Mirrored {len(mirrored)}/{len(mirror_urls)} location photos to GCS.\n")
+        if not mirrored:
+            return {
+                "status": "error",
+                "error_message": "Could not copy the location images to Cloud Storage.",
+                "image_urls": image_urls,
+            }
+        # 重複した画像 (同じ内容) は1つにまとめる
+        return {
+            "status": "success",
+            "image_urls": image_urls,
+            "gcs_uris": list(dict.fromkeys(mirrored)),
+        }
+
+    if image_urls:
+        return {
+            "status": "success",
+            "image_urls": image_urls,
+        }
+    return {
+        "status": "error",
+        "error_message": "No images could be retrieved for the specified location.",
+    }
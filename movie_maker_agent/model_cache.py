@@ -0,0 +1,159 @@
+"""
+エージェントのモデル応答キャッシュ。
+
+ページの再読み込みや同じ依頼の繰り返しで、scene_agent / veo_prompt_agent には
+まったく同じリクエストが何度も届く。before_model_callback でリクエストのハッシュを計算し、
+キャッシュがあれば LlmResponse を返してモデル呼び出しを省略する。
+応答は after_model_callback で保存する。
+
+キーは (エージェント名, モデル, システム指示のハッシュ, 正規化したリクエスト内容)。
+関数呼び出しの ID など、実行ごとに変わる値はキーから除く。
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+
+MODEL_CACHE_ENABLED = os.environ.get("MODEL_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+MODEL_CACHE_MAX_ENTRIES = int(os.environ.get("MODEL_CACHE_MAX_ENTRIES", "512"))
+MODEL_CACHE_TTL_SECONDS = int(os.environ.get("MODEL_CACHE_TTL_SECONDS", "3600"))
+# キャッシュを使わないエージェント名 (カンマ区切り)
+MODEL_CACHE_DISABLED_AGENTS = {
+    name.strip() for name in os.environ.get("MODEL_CACHE_DISABLED_AGENTS", "").split(",") if name.strip()
+}
+
+# キーから除く、実行ごとに値が変わるフィールド
+_VOLATILE_FIELDS = {"id", "thought_signature"}
+_WHITESPACE_RE = re.compile(r"\s+")
+# before_model_callback で計算したキーを after_model_callback に渡すための state のキー
+_STATE_KEY = "temp:model_cache_key"
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return _WHITESPACE_RE.sub(" ", value).strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k not in _VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def request_key(agent_name: str, llm_request: LlmRequest) -> str:
+    """リクエストのキャッシュキーを計算します。"""
+    config = llm_request.config
+    instruction = config.system_instruction if config else None
+    if instruction is not None and not isinstance(instruction, str):
+        instruction = json.dumps(_normalize(instruction.model_dump(mode="json", exclude_none=True)), sort_keys=True)
+    payload = {
+        "agent": agent_name,
+        "model": llm_request.model,
+        "instruction": hashlib.sha256(_normalize(instruction or "").encode("utf-8")).hexdigest(),
+        "tools": sorted(llm_request.tools_dict),
+        "contents": [_normalize(content.model_dump(mode="json", exclude_none=True)) for content in llm_request.contents],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ModelResponseCache:
+    """リクエストのハッシュ -> LlmResponse の LRU + TTL キャッシュ。"""
+
+    def __init__(
+        self,
+        max_entries: int = MODEL_CACHE_MAX_ENTRIES,
+        ttl: int = MODEL_CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.evictions = 0
+
+    def get(self, agent_name: str, key: str) -> Optional[LlmResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits[agent_name] = self.hits.get(agent_name, 0) + 1
+                # 呼び出し側 (ADK) が応答を書き換えるため、コピーを返す
+                return copy.deepcopy(entry[0])
+            if entry:
+                del self._entries[key]
+            self.misses[agent_name] = self.misses.get(agent_name, 0) + 1
+            return None
+
+    def put(self, key: str, response: LlmResponse) -> None:
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(response), self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        agents = {}
+        for agent_name in sorted(set(self.hits) | set(self.misses)):
+            hits = self.hits.get(agent_name, 0)
+            misses = self.misses.get(agent_name, 0)
+            agents[agent_name] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            }
+        hits = sum(self.hits.values())
+        total = hits + sum(self.misses.values())
+        return {
+            "enabled": MODEL_CACHE_ENABLED,
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": total - hits,
+            "hit_ratio": hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "agents": agents,
+        }
+
+
+model_response_cache = ModelResponseCache()
+
+
+def _enabled_for(agent_name: str) -> bool:
+    return MODEL_CACHE_ENABLED and agent_name not in MODEL_CACHE_DISABLED_AGENTS
+
+
+def before_model_callback(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """キャッシュされた応答があれば返し、モデル呼び出しを省略します。"""
+    agent_name = callback_context.agent_name
+    if not _enabled_for(agent_name):
+        return None
+    key = request_key(agent_name, llm_request)
+    callback_context.state[_STATE_KEY] = key
+    response = model_response_cache.get(agent_name, key)
+    if response is not None:
+        print(f"[ModelCache] Hit for {agent_name} ({key[:12]}). Skipping model call.")
+        callback_context.state[_STATE_KEY] = None
+    return response
+
+
+def after_model_callback(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """完了したモデル応答をキャッシュに保存します。途中の (ストリーミング) 応答やエラーは保存しません。"""
+    key = callback_context.state.get(_STATE_KEY)
+    if not key or llm_response.partial or llm_response.error_code or not llm_response.content:
+        return None
+    model_response_cache.put(key, llm_response)
+    callback_context.state[_STATE_KEY] = None
+    return None
@@ -0,0 +1,198 @@
+"""
+Veo の生成結果をリクエスト内容のハッシュで再利用するキャッシュ。
+
+(モデル, 正規化したプロンプトJSON, 入力画像のURIと世代番号, アスペクト比) のハッシュをキーに、
+生成済み動画の GCS URI をインデックスに保存する。
+同じキーのリクエストが同時に来た場合は、1つの Veo オペレーションの結果を共有する。
+インデックスは render_jobs と同じ SQLite ファイルに保存する (RENDER_JOBS_DB が未設定の場合は一時ディレクトリ)。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .render_jobs import RENDER_JOBS_DB
+from shared.storage_pool import get_storage_client
+
+# キャッシュは消えても再生成で済むため、インスタンスのローカルディスクでもよい
+RENDER_CACHE_DB = os.environ.get(
+    "RENDER_CACHE_DB", RENDER_JOBS_DB or os.path.join(tempfile.gettempdir(), "render_cache.sqlite3")
+)
+# キャッシュを再利用する期間 (秒)
+RENDER_CACHE_TTL_SECONDS = int(os.environ.get("RENDER_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS render_cache (
+    render_key TEXT PRIMARY KEY,
+    gcs_url TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _split_gcs_uri(gcs_uri: str):
+    bucket_name, blob_name = gcs_uri.replace("gs://", "", 1).split("/", 1)
+    return bucket_name, blob_name
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return _WHITESPACE_RE.sub(" ", value).strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def normalize_prompt(prompt: str) -> str:
+    """プロンプトJSONをキー順・空白を揃えた文字列にします。JSONでない場合は空白のみ揃えます。"""
+    try:
+        data = json.loads(prompt)
+    except (json.JSONDecodeError, TypeError):
+        return _normalize(str(prompt))
+    return json.dumps(_normalize(data), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def render_key(model: str, prompt: str, image_uri: Optional[str], aspect_ratio: str) -> str:
+    """
+    キャッシュキーを計算します。入力画像がある場合は世代番号を含め、上書きされた画像を区別します。
+    (世代番号の取得に GCS へのリクエストが発生するため、executor で呼び出してください)
+    """
+    image = None
+    if image_uri:
+        generation = None
+        try:
+            bucket_name, blob_name = _split_gcs_uri(image_uri)
+            blob = get_storage_client().bucket(bucket_name).get_blob(blob_name)
+            generation = blob.generation if blob else None
+        except Exception as e:
+            print(f"Could not read generation of {image_uri}: {e}")
+        image = {"uri": image_uri, "generation": generation}
+    payload = {
+        "model": model,
+        "prompt": normalize_prompt(prompt),
+        "image": image,
+        "aspect_ratio": aspect_ratio,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class RenderIndex:
+    """render_key -> 生成済み動画の GCS URI"""
+
+    def __init__(self, path: str = RENDER_CACHE_DB, ttl: int = RENDER_CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._initialized = False
+        self.hits = 0
+        self.misses = 0
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            conn = sqlite3.connect(self.path, timeout=10)
+            try:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+                with conn:
+                    return conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        キャッシュ済みの GCS URI を返します。動画が削除されている場合はエントリを消して None を返します。
+        """
+        rows = self._execute(
+            "SELECT gcs_url FROM render_cache WHERE render_key = ? AND created_at >= ?",
+            (key, time.time() - self.ttl),
+        )
+        if not rows:
+            self.misses += 1
+            return None
+        gcs_url = rows[0][0]
+        bucket_name, blob_name = _split_gcs_uri(gcs_url)
+        if not get_storage_client().bucket(bucket_name).blob(blob_name).exists():
+            self._execute("DELETE FROM render_cache WHERE render_key = ?", (key,))
+            self.misses += 1
+            return None
+        self.hits += 1
+        return gcs_url
+
+    def store(self, key: str, gcs_url: str) -> None:
+        self._execute(
+            "INSERT OR REPLACE INTO render_cache (render_key, gcs_url, created_at) VALUES (?, ?, ?)",
+            (key, gcs_url, time.time()),
+        )
+
+
+render_index = RenderIndex()
+
+class SharedRender:
+    """実行中の生成。送信した Veo オペレーション名と、結果を待っている呼び出し元 (waiter) を持つ。"""
+
+    def __init__(self):
+        self.operation_name: Optional[str] = None
+        self.waiters: List[Any] = []
+
+
+# 実行中の生成 (render_key -> (Task, SharedRender))。同じキーのリクエストは結果を共有する
+_inflight: Dict[str, Tuple[asyncio.Task, SharedRender]] = {}
+
+
+async def run_shared(
+    key: str,
+    render: Callable[[SharedRender], Awaitable[Any]],
+    waiter: Any = None,
+    on_join: Optional[Callable[[SharedRender], Awaitable[None]]] = None,
+) -> Any:
+    """
+    同じキーの生成が実行中であればその結果を待ち、なければ render(shared) を実行します。
+    waiter (呼び出し元のジョブ情報など) は shared.waiters に追加されます。
+    実行中の生成に参加した場合は on_join(shared) を呼び出します (送信済みのオペレーションを記録するため)。
+    """
+    entry = _inflight.get(key)
+    if entry is None:
+        shared = SharedRender()
+        if waiter is not None:
+            shared.waiters.append(waiter)
+        task = asyncio.get_running_loop().create_task(render(shared))
+        _inflight[key] = (task, shared)
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        task, shared = entry
+        print(f"Joining in-flight render {key[:12]}.")
+        if waiter is not None:
+            shared.waiters.append(waiter)
+        if on_join is not None:
+            await on_join(shared)
+    # 1つの呼び出し元がキャンセルされても、共有している生成は止めない
+    return await asyncio.shield(task)
+
+
+def copy_to_folder(gcs_uri: str, folder_gcs_uri: str, key: str) -> str:
+    """
+    キャッシュされた動画が folder_gcs_uri の外にある場合、フォルダ内にコピーしてその URI を返します。
+    (他のユーザーのフォルダにある動画を、リクエストしたユーザーのフォルダに置くため)
+    folder_gcs_uri にはリクエストしたユーザー自身のフォルダを指定してください。
+    出力先のルートを指定すると、他のユーザーの動画がコピーされずにそのまま返されます。
+    """
+    if gcs_uri.startswith(folder_gcs_uri.rstrip("/") + "/"):
+        return gcs_uri
+    source_bucket_name, source_blob_name = _split_gcs_uri(gcs_uri)
+    dest_bucket_name, dest_folder = _split_gcs_uri(folder_gcs_uri.rstrip("/") + "/")
+    client = get_storage_client()
+    source_bucket = client.bucket(source_bucket_name)
+    dest_blob_name = f"{dest_folder}cached/{key[:32]}.mp4"
+    source_bucket.copy_blob(source_bucket.blob(source_blob_name), client.bucket(dest_bucket_name), dest_blob_name)
+    return f"gs://{dest_bucket_name}/{dest_blob_name}"
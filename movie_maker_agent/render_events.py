@@ -0,0 +1,39 @@
+"""
+動画生成の進捗イベントをセッションごとに配信するプロセス内の Pub/Sub。
+
+send_to_veo3_api はシーンが完了するたびにイベントを発行し、
+main.py の SSE エンドポイントが購読しているクライアントへそのまま送る。
+配信は同じプロセス内の購読者に限られ、インスタンスをまたいでは届かない。
+"""
+import asyncio
+from collections import defaultdict
+from typing import Dict, Set, Tuple
+
+# 購読者ごとのキューの上限。遅いクライアントのためにメモリが増え続けないようにする
+RENDER_EVENTS_QUEUE_SIZE = 100
+
+# (user_id, session_id) -> 購読者のキュー
+_subscribers: Dict[Tuple[str, str], Set[asyncio.Queue]] = defaultdict(set)
+
+
+def publish(user_id: str, session_id: str, event: dict) -> None:
+    """セッションの購読者全員にイベントを送ります。購読者がいなければ何もしません。"""
+    for queue in list(_subscribers.get((user_id, session_id), ())):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            print(f"Dropping render event for slow subscriber of session {session_id}.")
+
+
+def subscribe(user_id: str, session_id: str) -> asyncio.Queue:
+    """セッションのイベントを受け取るキューを登録して返します。使い終わったら unsubscribe してください。"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=RENDER_EVENTS_QUEUE_SIZE)
+    _subscribers[(user_id, session_id)].add(queue)
+    return queue
+
+
+def unsubscribe(user_id: str, session_id: str, queue: asyncio.Queue) -> None:
+    key = (user_id, session_id)
+    _subscribers[key].discard(queue)
+    if not _subscribers[key]:
+        _subscribers.pop(key, None)
@@ -0,0 +1,171 @@
+"""
+動画生成ジョブの永続化。
+
+Veo のオペレーション名は送信直後に記録し、インスタンスが再起動しても
+起動時に未完了のオペレーションを再開できるようにする。
+ここでは SQLite をストアとして使う (RENDER_JOBS_DB でパスを指定)。
+Cloud Run のローカルディスクはメモリ上にありインスタンスと共に消えるため、
+RENDER_JOBS_DB にはインスタンスの再起動後も残るボリューム (Filestore などのマウント) 上のパスを指定する。
+未設定の場合はジョブを記録せず、再起動時の再開も行わない。
+SQLite の呼び出しはブロッキングするため、イベントループからは executor 経由で呼び出すこと。
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+RENDER_JOBS_DB = os.environ.get("RENDER_JOBS_DB") or None
+
+STATUS_SUBMITTED = "submitted"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS render_jobs (
+    operation_name TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    app_name TEXT,
+    user_id TEXT,
+    session_id TEXT,
+    scene_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    gcs_url TEXT,
+    error TEXT,
+    applied INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    -- 同じ内容の生成を共有した場合、1つのオペレーションを複数のジョブが待つ
+    PRIMARY KEY (operation_name, job_id)
+);
+CREATE INDEX IF NOT EXISTS render_jobs_session ON render_jobs (app_name, user_id, session_id);
+CREATE INDEX IF NOT EXISTS render_jobs_status ON render_jobs (status);
+"""
+
+_COLUMNS = (
+    "operation_name, job_id, app_name, user_id, session_id, scene_name, "
+    "status, gcs_url, error, applied, created_at, updated_at"
+)
+
+
+class RenderJobStore:
+    """動画生成ジョブ (シーンごとの Veo オペレーション) の状態を保存する。"""
+
+    def __init__(self, path: Optional[str] = RENDER_JOBS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+        if not path:
+            print("RENDER_JOBS_DB is not set; render jobs will not be persisted or resumed after a restart.")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.executescript(_SCHEMA)
+            self._initialized = True
+        return conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[dict]:
+        if not self.enabled:
+            return []
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    rows = conn.execute(sql, params).fetchall()
+                return [dict(row) for row in rows]
+            finally:
+                conn.close()
+
+    def record_submitted(
+        self,
+        job_id: str,
+        app_name: Optional[str],
+        user_id: Optional[str],
+        session_id: Optional[str],
+        scene_name: str,
+        operation_name: str,
+    ) -> None:
+        now = time.time()
+        self._execute(
+            f"INSERT OR REPLACE INTO render_jobs ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL, 0, ?, ?)",
+            (operation_name, job_id, app_name, user_id, session_id, scene_name, STATUS_SUBMITTED, now, now),
+        )
+
+    def record_finished(
+        self, operation_name: str, gcs_url: Optional[str], error: Optional[str], job_id: Optional[str] = None
+    ) -> None:
+        """オペレーションの結果を記録します。job_id を指定しない場合は、そのオペレーションを待つ全ジョブを更新します。"""
+        status = STATUS_SUCCEEDED if gcs_url else STATUS_FAILED
+        sql = "UPDATE render_jobs SET status = ?, gcs_url = ?, error = ?, updated_at = ? WHERE operation_name = ?"
+        params = (status, gcs_url, error, time.time(), operation_name)
+        if job_id is not None:
+            sql += " AND job_id = ?"
+            params += (job_id,)
+        self._execute(sql, params)
+
+    def list_unfinished(self) -> List[dict]:
+        return self._execute(
+            f"SELECT {_COLUMNS} FROM render_jobs WHERE status = ? ORDER BY created_at", (STATUS_SUBMITTED,)
+        )
+
+    def list_for_session(self, app_name: str, user_id: str, session_id: str) -> List[dict]:
+        return self._execute(
+            f"SELECT {_COLUMNS} FROM render_jobs WHERE app_name = ? AND user_id = ? AND session_id = ? "
+            "ORDER BY created_at",
+            (app_name, user_id, session_id),
+        )
+
+    def take_unapplied(self, session_id: str, exclude_job_ids=()) -> List[dict]:
+        """
+        セッションの state にまだ反映していない成功済みジョブを返し、反映済みにします。
+        exclude_job_ids には、このプロセスで実行中 (ツール自身が state を更新する) のジョブを指定します。
+        """
+        if not self.enabled:
+            return []
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    rows = [
+                        dict(row)
+                        for row in conn.execute(
+                            f"SELECT {_COLUMNS} FROM render_jobs WHERE session_id = ? AND status = ? AND applied = 0 "
+                            "ORDER BY created_at",
+                            (session_id, STATUS_SUCCEEDED),
+                        ).fetchall()
+                        if row["job_id"] not in exclude_job_ids
+                    ]
+                    conn.executemany(
+                        "UPDATE render_jobs SET applied = 1 WHERE operation_name = ? AND job_id = ?",
+                        [(row["operation_name"], row["job_id"]) for row in rows],
+                    )
+                return rows
+            finally:
+                conn.close()
+
+    def release(self, jobs: List[dict]) -> None:
+        """take_unapplied で取り出したものの反映できなかったジョブを、未反映に戻します。"""
+        if not self.enabled or not jobs:
+            return
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "UPDATE render_jobs SET applied = 0 WHERE operation_name = ? AND job_id = ?",
+                        [(job["operation_name"], job["job_id"]) for job in jobs],
+                    )
+            finally:
+                conn.close()
+
+    def mark_job_applied(self, job_id: str) -> None:
+        self._execute("UPDATE render_jobs SET applied = 1 WHERE job_id = ?", (job_id,))
+
+
+render_job_store = RenderJobStore()
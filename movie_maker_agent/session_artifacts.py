@@ -0,0 +1,136 @@
+"""
+大きなセッション state をアーティファクトとして保存するヘルパー。
+
+scene_config / theme_list / movie_urls は会話が進むほど大きくなり、
+state に置くとイベントごとの state delta でセッションサービスへ送られ続ける。
+これらはバージョン付きのアーティファクト (ARTIFACTS_GCS) に JSON で保存し、
+state には "<key>_ref" として {artifact, version, sha256} の参照だけを置く。
+フロントエンドは参照を見て ADK のアーティファクト API から本体を取得する。
+
+ARTIFACTS_GCS が未設定の場合、ADK はメモリ上のアーティファクトサービスを使うため、
+再起動すると参照先が失われる。その場合は従来どおり state に直接保存する。
+参照先のアーティファクトが見つからない場合は state の値 (または既定値) を使い、次の保存で参照を作り直す。
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.genai import types
+
+# アーティファクトに移す state のキー -> アーティファクトのファイル名
+ARTIFACT_KEYS = {
+    "scene_config": "scene_config.json",
+    "theme_list": "theme_list.json",
+    "movie_urls": "movie_urls.json",
+}
+# movie_urls にシーンごとに残す動画URLの数 (古いものから削除する)
+MOVIE_URLS_MAX_PER_SCENE = int(os.environ.get("MOVIE_URLS_MAX_PER_SCENE", "5"))
+# 読み込んだアーティファクトをメモリに保持する数 (sha256 -> 値)
+STATE_ARTIFACT_CACHE_MAX_ENTRIES = int(os.environ.get("STATE_ARTIFACT_CACHE_MAX_ENTRIES", "256"))
+
+_MIME_TYPE = "application/json"
+
+_cache: "OrderedDict[str, Any]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def ref_key(key: str) -> str:
+    return f"{key}_ref"
+
+
+def artifacts_enabled() -> bool:
+    """アーティファクトが永続化される (ARTIFACTS_GCS が設定されている) 場合に True を返します。"""
+    return bool(os.environ.get("ARTIFACTS_GCS"))
+
+
+def _remember(digest: str, value: Any) -> None:
+    with _cache_lock:
+        _cache[digest] = value
+        _cache.move_to_end(digest)
+        while len(_cache) > STATE_ARTIFACT_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _cached(digest: str) -> Optional[Any]:
+    with _cache_lock:
+        if digest not in _cache:
+            return None
+        _cache.move_to_end(digest)
+        return _cache[digest]
+
+
+def trim_movie_urls(movies: dict, max_per_scene: int = MOVIE_URLS_MAX_PER_SCENE) -> dict:
+    """シーンごとに新しい max_per_scene 件だけを残します。"""
+    return {scene: urls[-max_per_scene:] if isinstance(urls, list) else urls for scene, urls in movies.items()}
+
+
+async def load(context: CallbackContext, key: str, default: Any = None) -> Any:
+    """
+    state の参照からアーティファクトを読み込んで返します。
+    参照がない場合は state に直接保存されている値 (以前のセッション) を返します。
+    返す値はコピーなので、変更してから save に渡してください。
+    参照先のアーティファクトが見つからない場合 (メモリ上のサービスで保存され、再起動で失われた場合など) は、
+    警告を出して参照を削除し、state の値または default を返します。
+    アーティファクトサービスのエラーなど、それ以外の読み込みの失敗は例外として送出します。
+    その場合に default を保存すると既存の内容を上書きしてしまうため、save を呼ばないでください。
+    """
+    ref = context.state.get(ref_key(key))
+    if ref:
+        value = _cached(ref["sha256"])
+        if value is not None:
+            return copy.deepcopy(value)
+        part = await context.load_artifact(ref["artifact"], version=ref.get("version"))
+        if part is not None and part.inline_data is not None:
+            value = json.loads(part.inline_data.data.decode("utf-8"))
+            _remember(ref["sha256"], value)
+            return copy.deepcopy(value)
+        print(f"Warning: state artifact {ref['artifact']} v{ref.get('version')} not found; falling back to state.")
+        # 次の save で参照を作り直す
+        context.state[ref_key(key)] = None
+
+    value = context.state.get(key)
+    return copy.deepcopy(value) if value is not None else default
+
+
+async def save(context: CallbackContext, key: str, value: Any) -> Optional[dict]:
+    """
+    値をアーティファクトの新しいバージョンとして保存し、state に参照を置きます。
+    内容が前のバージョンと同じ場合は保存しません。保存した参照を返します。
+    アーティファクトが永続化されない場合は state に直接保存し、None を返します。
+    """
+    if key == "movie_urls" and isinstance(value, dict):
+        value = trim_movie_urls(value)
+    if not artifacts_enabled():
+        context.state[key] = value
+        if context.state.get(ref_key(key)):
+            context.state[ref_key(key)] = None
+        return None
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+
+    ref = context.state.get(ref_key(key))
+    if ref and ref.get("sha256") == digest:
+        return ref
+
+    try:
+        version = await context.save_artifact(ARTIFACT_KEYS[key], types.Part.from_bytes(data=data, mime_type=_MIME_TYPE))
+    except ValueError as e:
+        # アーティファクトサービスが設定されていない場合は state に直接保存する
+        print(f"Artifact service unavailable ({e}); keeping {key} in state.")
+        context.state[key] = value
+        if context.state.get(ref_key(key)):
+            context.state[ref_key(key)] = None
+        return None
+
+    ref = {"artifact": ARTIFACT_KEYS[key], "version": version, "sha256": digest}
+    context.state[ref_key(key)] = ref
+    # 以前のセッションで state に直接保存されていた値は削除する
+    if context.state.get(key) is not None:
+        context.state[key] = None
+    _remember(digest, json.loads(data))
+    return ref
@@ -0,0 +1,158 @@
+"""
+Veo の長時間実行オペレーションをまとめてポーリングするサービス。
+
+シーンごとにスリープ/ポーリングのループを持つ代わりに、プロセス内で1つのタスクが
+実行中のオペレーションをすべて追跡し、期限の来たものをまとめて問い合わせる。
+ポーリング間隔は短い間隔から始めて、Veo の想定生成時間に応じた上限まで伸ばしていく。
+完了したオペレーションは、待っている呼び出し元の Future に結果を返す。
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 最初のポーリングまでの間隔 (秒)
+VEO_POLL_INITIAL_INTERVAL_SECONDS = float(os.environ.get("VEO_POLL_INITIAL_INTERVAL_SECONDS", "3"))
+# Veo の想定生成時間 (秒)。ポーリング間隔の上限はこの値から決める
+VEO_EXPECTED_DURATION_SECONDS = float(os.environ.get("VEO_EXPECTED_DURATION_SECONDS", "60"))
+VEO_POLL_MAX_INTERVAL_SECONDS = float(
+    os.environ.get("VEO_POLL_MAX_INTERVAL_SECONDS", str(max(VEO_POLL_INITIAL_INTERVAL_SECONDS, VEO_EXPECTED_DURATION_SECONDS / 4)))
+)
+VEO_POLL_BACKOFF = float(os.environ.get("VEO_POLL_BACKOFF", "1.5"))
+# 1回のポーリングで問い合わせる最大オペレーション数
+VEO_POLL_BATCH_SIZE = int(os.environ.get("VEO_POLL_BATCH_SIZE", "20"))
+# 連続してこの回数ポーリングに失敗したら呼び出し元にエラーを返す
+VEO_POLL_MAX_ERRORS = int(os.environ.get("VEO_POLL_MAX_ERRORS", "5"))
+
+
+class _TrackedOperation:
+    __slots__ = ("operation", "futures", "polls", "errors", "next_poll_at")
+
+    def __init__(self, operation: Any, next_poll_at: float):
+        self.operation = operation
+        self.futures: List[asyncio.Future] = []
+        self.polls = 0
+        self.errors = 0
+        self.next_poll_at = next_poll_at
+
+
+class VeoOperationPoller:
+    """
+    実行中のオペレーションを名前で追跡し、1つのバックグラウンドタスクでポーリングする。
+
+    Args:
+        fetch: オペレーションを受け取り、最新状態のオペレーションを返すコルーチン関数
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[Any], Awaitable[Any]],
+        initial_interval: float = VEO_POLL_INITIAL_INTERVAL_SECONDS,
+        max_interval: float = VEO_POLL_MAX_INTERVAL_SECONDS,
+        backoff: float = VEO_POLL_BACKOFF,
+        batch_size: int = VEO_POLL_BATCH_SIZE,
+        max_errors: int = VEO_POLL_MAX_ERRORS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._fetch = fetch
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self._clock = clock
+        self._tracked: Dict[str, _TrackedOperation] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tracked)
+
+    async def wait(self, operation: Any) -> Any:
+        """オペレーションが完了するまで待ち、完了したオペレーションを返します。"""
+        if operation.done:
+            return operation
+
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        tracked = self._tracked.get(operation.name)
+        if tracked is None:
+            tracked = _TrackedOperation(operation, self._clock() + self.initial_interval)
+            self._tracked[operation.name] = tracked
+        tracked.futures.append(future)
+        self._wakeup.set()
+        return await future
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _interval(self, tracked: _TrackedOperation) -> float:
+        return min(self.max_interval, self.initial_interval * self.backoff ** tracked.polls)
+
+    def _finish(self, name: str, result: Any = None, error: Optional[BaseException] = None) -> None:
+        tracked = self._tracked.pop(name, None)
+        if tracked is None:
+            return
+        for future in tracked.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _run(self) -> None:
+        try:
+            await self._poll_loop()
+        except BaseException as e:
+            # ポーリングタスク自体が失敗した場合は、待っている呼び出し元すべてにエラーを返す
+            for name in list(self._tracked):
+                self._finish(name, error=e if isinstance(e, Exception) else RuntimeError(str(e)))
+            raise
+
+    async def _poll_loop(self) -> None:
+        while self._tracked:
+            # 待っている呼び出し元がすべてキャンセルされたオペレーションは追跡をやめる
+            for name in [n for n, t in self._tracked.items() if all(f.done() for f in t.futures)]:
+                del self._tracked[name]
+            if not self._tracked:
+                break
+
+            now = self._clock()
+            due = sorted(
+                (t for t in self._tracked.values() if t.next_poll_at <= now),
+                key=lambda t: t.next_poll_at,
+            )[: self.batch_size]
+            if not due:
+                delay = min(t.next_poll_at for t in self._tracked.values()) - now
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.info(f"[VeoOperationPoller] Polling {len(due)}/{len(self._tracked)} operations.")
+            results = await asyncio.gather(*(self._fetch(t.operation) for t in due), return_exceptions=True)
+            for tracked, result in zip(due, results):
+                name = tracked.operation.name
+                tracked.polls += 1
+                if isinstance(result, BaseException):
+                    tracked.errors += 1
+                    logger.warning(f"[VeoOperationPoller] Polling {name} failed ({tracked.errors}): {result}")
+                    if tracked.errors >= self.max_errors:
+                        self._finish(name, error=result if isinstance(result, Exception) else RuntimeError(str(result)))
+                        continue
+                elif result.done:
+                    self._finish(name, result=result)
+                    continue
+                else:
+                    tracked.operation = result
+                    tracked.errors = 0
+                tracked.next_poll_at = self._clock() + self._interval(tracked)
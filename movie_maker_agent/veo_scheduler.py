@@ -0,0 +1,146 @@
+"""
+Veo へのリクエストをプロセス全体で制御するスケジューラー。
+
+- 同時に実行中のオペレーション数の上限 (セマフォ)
+- 1分あたりの送信数の上限 (トークンバケット)
+- クォータエラー (429 / RESOURCE_EXHAUSTED) 時のジッター付き指数バックオフでの再試行
+
+複数ユーザーが同時に動画を生成しても、リクエストは失敗せずに順番待ちになる。
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 同時に実行できる Veo オペレーション数
+VEO_MAX_CONCURRENT_OPERATIONS = int(os.environ.get("VEO_MAX_CONCURRENT_OPERATIONS", "10"))
+# 1分あたりに送信できる generate_videos リクエスト数
+VEO_SUBMISSIONS_PER_MINUTE = float(os.environ.get("VEO_SUBMISSIONS_PER_MINUTE", "10"))
+VEO_SUBMISSION_BURST = int(os.environ.get("VEO_SUBMISSION_BURST", "5"))
+# クォータエラー時の再試行回数とバックオフ (秒)
+VEO_QUOTA_MAX_RETRIES = int(os.environ.get("VEO_QUOTA_MAX_RETRIES", "6"))
+VEO_QUOTA_BACKOFF_BASE_SECONDS = float(os.environ.get("VEO_QUOTA_BACKOFF_BASE_SECONDS", "5"))
+VEO_QUOTA_BACKOFF_MAX_SECONDS = float(os.environ.get("VEO_QUOTA_BACKOFF_MAX_SECONDS", "120"))
+
+# google.rpc.Code.RESOURCE_EXHAUSTED
+_RPC_RESOURCE_EXHAUSTED = 8
+
+
+def is_quota_error(error: Any) -> bool:
+    """例外またはオペレーションのエラーがクォータ超過によるものかを判定します。"""
+    if error is None:
+        return False
+    if isinstance(error, dict):
+        code = error.get("code")
+        message = str(error.get("message", ""))
+    else:
+        code = getattr(error, "code", None)
+        message = str(getattr(error, "status", "") or "") + " " + str(error)
+    return code in (429, _RPC_RESOURCE_EXHAUSTED) or "RESOURCE_EXHAUSTED" in message
+
+
+class AsyncTokenBucket:
+    """1分あたり rate_per_minute 個のトークンを補充するトークンバケット。"""
+
+    def __init__(self, rate_per_minute: float, capacity: int, clock: Callable[[], float] = time.monotonic):
+        if rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute must be greater than 0 (VEO_SUBMISSIONS_PER_MINUTE): {rate_per_minute}")
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1 (VEO_SUBMISSION_BURST): {capacity}")
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._clock = clock
+        self._updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate_per_second)
+
+
+class VeoScheduler:
+    """同時実行数・送信レートを制限し、クォータエラーを再試行する。"""
+
+    def __init__(
+        self,
+        max_concurrent: int = VEO_MAX_CONCURRENT_OPERATIONS,
+        submissions_per_minute: float = VEO_SUBMISSIONS_PER_MINUTE,
+        burst: int = VEO_SUBMISSION_BURST,
+        max_retries: int = VEO_QUOTA_MAX_RETRIES,
+        backoff_base: float = VEO_QUOTA_BACKOFF_BASE_SECONDS,
+        backoff_max: float = VEO_QUOTA_BACKOFF_MAX_SECONDS,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._bucket = AsyncTokenBucket(submissions_per_minute, burst)
+        self.running = 0
+        self.waiting = 0
+
+    def _backoff(self, attempt: int) -> float:
+        # フルジッター: 0 〜 min(上限, base * 2^attempt) の一様乱数
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def run(
+        self,
+        submit: Callable[[], Awaitable[Any]],
+        wait: Callable[[Any], Awaitable[Any]],
+        label: Optional[str] = None,
+    ) -> Any:
+        """
+        オペレーションを送信し、完了するまで待って返します。
+
+        Args:
+            submit: オペレーションを開始して返すコルーチン関数
+            wait: オペレーションの完了を待つコルーチン関数
+            label: ログ用の名前
+        """
+        attempt = 0
+        while True:
+            self.waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+            self.running += 1
+            try:
+                await self._bucket.acquire()
+                try:
+                    operation = await wait(await submit())
+                except Exception as e:
+                    if not is_quota_error(e) or attempt >= self.max_retries:
+                        raise
+                    reason = e
+                else:
+                    if not is_quota_error(operation.error) or attempt >= self.max_retries:
+                        return operation
+                    reason = operation.error
+            finally:
+                self.running -= 1
+                self._semaphore.release()
+
+            # セマフォを解放してからバックオフする
+            delay = self._backoff(attempt)
+            attempt += 1
+            logger.warning(
+                f"[VeoScheduler] Quota exhausted for {label or 'operation'} "
+                f"(attempt {attempt}/{self.max_retries}); retrying in {delay:.1f}s: {reason}"
+            )
+            await asyncio.sleep(delay)
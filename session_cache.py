@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from firebase_admin import auth
+
+
+# キャッシュの最大エントリ数
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "1024"))
+# 失効チェックなしでキャッシュを信頼する最大秒数 (失効の検知遅延の上限)
+SESSION_REVOCATION_WINDOW_SECONDS = int(os.environ.get("SESSION_REVOCATION_WINDOW_SECONDS", "300"))
+# クッキーの exp より何秒前にエントリを失効させるか
+SESSION_EXPIRY_MARGIN_SECONDS = int(os.environ.get("SESSION_EXPIRY_MARGIN_SECONDS", "30"))
+
+
+def _cookie_key(token: str) -> str:
+    # クッキー本体をメモリに保持しないよう、ハッシュをキーにする
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("claims", "expires_at", "recheck_at")
+
+    def __init__(self, claims: Dict[str, Any], expires_at: float, recheck_at: float):
+        self.claims = claims
+        self.expires_at = expires_at
+        self.recheck_at = recheck_at
+
+
+class SessionCookieCache:
+    """
+    検証済みセッションクッキーのデコード結果を保持する LRU + TTL キャッシュ。
+
+    エントリはクッキーの exp と失効ウィンドウのどちらか早い方で期限切れになる。
+    失効チェックはヒット時にバックグラウンドで再実行し、リクエストの経路では行わない。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+        revocation_window: int = SESSION_REVOCATION_WINDOW_SECONDS,
+        expiry_margin: int = SESSION_EXPIRY_MARGIN_SECONDS,
+        verifier: Optional[Callable[[str], Dict[str, Any]]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_entries = max_entries
+        self.revocation_window = revocation_window
+        self.expiry_margin = expiry_margin
+        self._verifier = verifier or (lambda token: auth.verify_session_cookie(token, check_revoked=True))
+        self._clock = clock
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._rechecking: set = set()
+        # イベントループはタスクを弱参照でしか保持しないため、実行中の再チェックの参照を持っておく
+        self._tasks: set = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revoked = 0
+
+    def _store(self, key: str, claims: Dict[str, Any]) -> None:
+        now = self._clock()
+        expires_at = now + self.revocation_window
+        exp = claims.get("exp")
+        if exp is not None:
+            expires_at = min(expires_at, float(exp) - self.expiry_margin)
+        if expires_at <= now:
+            return
+        # 失効ウィンドウの半分が過ぎたらバックグラウンドで再チェックする
+        recheck_at = now + self.revocation_window / 2
+        with self._lock:
+            self._entries[key] = _Entry(claims, expires_at, recheck_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _lookup(self, key: str) -> Optional[_Entry]:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._entries.pop(_cookie_key(token), None)
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """
+        セッションクッキーを検証し、デコード済みクレームを返す。
+        無効なクッキーの場合は auth.InvalidSessionCookieError を送出する。
+        """
+        key = _cookie_key(token)
+        entry = self._lookup(key)
+        if entry is not None:
+            if entry.recheck_at <= self._clock():
+                self._schedule_recheck(key, token)
+            return entry.claims
+
+        claims = await asyncio.to_thread(self._verifier, token)
+        self._store(key, claims)
+        return claims
+
+    def _schedule_recheck(self, key: str, token: str) -> None:
+        with self._lock:
+            if key in self._rechecking:
+                return
+            self._rechecking.add(key)
+        task = asyncio.get_running_loop().create_task(self._recheck(key, token))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _recheck(self, key: str, token: str) -> None:
+        try:
+            claims = await asyncio.to_thread(self._verifier, token)
+        except auth.InvalidSessionCookieError as e:
+            print(f"Session cookie revoked or expired on background recheck: {e}")
+            with self._lock:
+                self._entries.pop(key, None)
+                self.revoked += 1
+        except Exception as e:
+            # 一時的なエラーの場合はエントリを残し、次のヒットで再試行する
+            print(f"Background session cookie recheck failed: {e}")
+        else:
+            self._store(key, claims)
+        finally:
+            with self._lock:
+                self._rechecking.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "revoked": self.revoked,
+        }
+
+
+session_cookie_cache = SessionCookieCache()
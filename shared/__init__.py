@@ -0,0 +1,9 @@
+"""
+エージェント (Cloud Run) と Cloud Functions で共有するモジュール。
+
+エージェントは `shared.<module>` としてインポートする。
+各 Cloud Function のディレクトリには、このパッケージ内のファイルのコピーを置いている
+(関数は --source のディレクトリだけがデプロイされるため、シンボリックリンクの先は含まれない。
+関数ではトップレベルのモジュールとしてインポートする)。
+ファイルを変更したら、各関数のディレクトリにもコピーすること (tests/test_vendored_modules.py で一致を確認する)。
+"""
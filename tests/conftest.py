@@ -0,0 +1,54 @@
+import importlib.util
+import os
+import sys
+
+import firebase_admin
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# movie_maker_agent は読み込み時に genai.Client を作成するため、Vertex AI の設定を与えておく
+os.environ.setdefault("GOOGLE_GENAI_USE_VERTEXAI", "true")
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "test-project")
+os.environ.setdefault("GOOGLE_CLOUD_LOCATION", "us-central1")
+
+
+_loaded = {}
+
+
+def load_cloud_function(name):
+    """
+    Cloud Function の main.py を、関数ディレクトリをパスに追加して別名のモジュールとして読み込みます。
+    (main.py は読み込み時に Firebase を初期化するため、1度だけ読み込み、
+    別の関数を読み込む前には既存のデフォルトアプリを削除します)
+    """
+    if name in _loaded:
+        return _loaded[name]
+    if firebase_admin._DEFAULT_APP_NAME in firebase_admin._apps:
+        firebase_admin.delete_app(firebase_admin.get_app())
+    function_dir = os.path.join(ROOT, "cloud_functions", name)
+    if function_dir not in sys.path:
+        sys.path.insert(0, function_dir)
+    spec = importlib.util.spec_from_file_location(f"cloud_function_{name}", os.path.join(function_dir, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _loaded[name] = module
+    return module
+
+
+class FakeClock:
+    """clock 引数 (time.monotonic や time.time の代わり) に渡す時計。now を書き換えて時間を進めます。"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
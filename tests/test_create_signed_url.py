@@ -0,0 +1,81 @@
+import pytest
+
+from conftest import load_cloud_function
+
+
+@pytest.fixture
+def signed_url(monkeypatch):
+    module = load_cloud_function("create_signed_url")
+    calls = []
+
+    def fake_get_signed_url(bucket_name, file_name, is_download, ttl_seconds=module.SIGNED_URL_TTL_SECONDS):
+        calls.append((bucket_name, file_name, bool(is_download)))
+        module.ttls.append(ttl_seconds)
+        if file_name == "broken.mp4":
+            raise RuntimeError("signing failed")
+        return f"https://signed/{bucket_name}/{file_name}?download={bool(is_download)}"
+
+    monkeypatch.setattr(module, "_get_signed_url", fake_get_signed_url)
+    module.calls = calls
+    module.ttls = []
+    return module
+
+
+def test_sign_batch_returns_results_in_request_order(signed_url):
+    results = signed_url._sign_batch("bucket", ["b.mp4", "a.mp4"], False)
+
+    assert [r["fileName"] for r in results] == ["b.mp4", "a.mp4"]
+    assert results[0]["signedUrl"] == "https://signed/bucket/b.mp4?download=False"
+
+
+def test_sign_batch_keeps_same_file_with_different_download_flags(signed_url):
+    results = signed_url._sign_batch(
+        "bucket",
+        [{"fileName": "a.mp4", "download": True}, {"fileName": "a.mp4", "download": False}],
+        False,
+    )
+
+    assert [r["signedUrl"] for r in results] == [
+        "https://signed/bucket/a.mp4?download=True",
+        "https://signed/bucket/a.mp4?download=False",
+    ]
+
+
+def test_sign_batch_uses_default_download_flag_for_strings(signed_url):
+    signed_url._sign_batch("bucket", ["a.mp4", {"fileName": "b.mp4"}], True)
+
+    assert sorted(signed_url.calls) == [("bucket", "a.mp4", True), ("bucket", "b.mp4", True)]
+
+
+@pytest.mark.parametrize("item", [{"fileName": ["x"]}, {"fileName": 1}, {"download": True}, "", None, 3])
+def test_sign_batch_reports_invalid_items_without_raising(signed_url, item):
+    results = signed_url._sign_batch("bucket", [item, "a.mp4"], False)
+
+    assert results[0] == {"fileName": None, "error": "Missing or invalid fileName."}
+    assert results[1]["signedUrl"] == "https://signed/bucket/a.mp4?download=False"
+    assert signed_url.calls == [("bucket", "a.mp4", False)]
+
+
+def test_sign_batch_reports_signing_errors_per_item(signed_url):
+    results = signed_url._sign_batch("bucket", ["broken.mp4", "a.mp4"], False)
+
+    assert results[0] == {"fileName": "broken.mp4", "download": False, "error": "signing failed"}
+    assert "signedUrl" in results[1]
+
+
+def test_sign_batch_passes_expiration_to_each_item(signed_url):
+    signed_url._sign_batch("bucket", ["a.mp4", "b.mp4"], False, 3600)
+
+    assert signed_url.ttls == [3600, 3600]
+
+
+@pytest.mark.parametrize("value, expected", [(None, "default"), (3600, 3600), (604800, 604800)])
+def test_parse_expiration_accepts_missing_or_valid_seconds(signed_url, value, expected):
+    if expected == "default":
+        expected = signed_url.SIGNED_URL_TTL_SECONDS
+    assert signed_url._parse_expiration(value) == expected
+
+
+@pytest.mark.parametrize("value", [0, -1, 604801, "3600", 1.5, True])
+def test_parse_expiration_rejects_invalid_values(signed_url, value):
+    assert signed_url._parse_expiration(value) is None
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import pytest
+from google.adk.models import LlmRequest
+from google.genai import types
+
+from movie_maker_agent.fast_router import LAST_ROUTED_AGENT_KEY, RETURNED_FROM_AGENT_KEY, FastPathRouter
+
+DIRECTOR = "director_workflow_agent"
+IMAGE = "image_generate_agent"
+
+
+@pytest.fixture
+def router():
+    return FastPathRouter(
+        keywords={DIRECTOR: r"動画|\bvideo\b", IMAGE: r"マージ|\bmerge\b"},
+        state_keys={DIRECTOR: ("scene_config_ref",), IMAGE: ("merge_image_uris",)},
+    )
+
+
+def _user(text):
+    return types.Content(role="user", parts=[types.Part(text=text)])
+
+
+def _context(state, user_text):
+    return SimpleNamespace(state=state, user_content=_user(user_text))
+
+
+def _returned_from(agent_name):
+    # ADK がサブエージェントの transfer_to_agent を supervisor 向けに変換した内容
+    return types.Content(
+        role="user",
+        parts=[
+            types.Part(text="For context:"),
+            types.Part(text=f"[{agent_name}] called tool `transfer_to_agent` with parameters: {{'agent_name': 'supervisor_agent'}}"),
+        ],
+    )
+
+
+def _transfer_target(response):
+    return response.content.parts[0].function_call.args["agent_name"]
+
+
+def test_route_by_single_keyword(router):
+    assert router.route("動画を作って", {}) == DIRECTOR
+    assert router.route("please merge these", {}) == IMAGE
+
+
+def test_route_leaves_both_keywords_to_model(router):
+    assert router.route("動画と画像をマージ", {}) is None
+
+
+def test_route_leaves_off_topic_messages_to_model(router):
+    assert router.route("こんにちは", {LAST_ROUTED_AGENT_KEY: IMAGE}) is None
+
+
+def test_route_continues_single_active_flow(router):
+    assert router.route("はい", {"merge_image_uris": ["gs://b/a.png"]}) == IMAGE
+
+
+def test_route_prefers_last_routed_among_active_flows(router):
+    state = {"merge_image_uris": ["gs://b/a.png"], "scene_config_ref": {"artifact": "x"}, LAST_ROUTED_AGENT_KEY: DIRECTOR}
+    assert router.route("はい", state) == DIRECTOR
+
+
+def test_route_skips_agent_that_returned_control(router):
+    state = {"merge_image_uris": ["gs://b/a.png"], RETURNED_FROM_AGENT_KEY: IMAGE}
+    assert router.route("はい", state) is None
+    assert router.route("マージして", state) == IMAGE
+
+
+def test_callback_routes_new_user_message(router):
+    context = _context({}, "動画を作って")
+    response = router.before_model_callback(context, LlmRequest(contents=[_user("動画を作って")]))
+
+    assert _transfer_target(response) == DIRECTOR
+    assert context.state[LAST_ROUTED_AGENT_KEY] == DIRECTOR
+
+
+def test_callback_does_not_route_back_after_sub_agent_returns(router):
+    state = {"merge_image_uris": ["gs://b/a.png"], LAST_ROUTED_AGENT_KEY: IMAGE}
+    request = LlmRequest(contents=[_user("マージして"), _returned_from(IMAGE)])
+
+    assert router.before_model_callback(_context(state, "マージして"), request) is None
+    assert state[LAST_ROUTED_AGENT_KEY] is None
+    assert state[RETURNED_FROM_AGENT_KEY] == IMAGE
+
+    # 次のユーザーメッセージも、キーワードがなければ supervisor のモデルに任せる
+    request = LlmRequest(contents=[_user("ありがとう")])
+    assert router.before_model_callback(_context(state, "ありがとう"), request) is None
+
+
+def test_callback_ignores_contents_that_are_not_the_new_user_message(router):
+    request = LlmRequest(contents=[_user("動画を作って")])
+
+    assert router.before_model_callback(_context({}, "別のメッセージ"), request) is None
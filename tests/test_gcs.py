@@ -0,0 +1,42 @@
+import pytest
+
+from movie_maker_agent import gcs
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    bodies = []
+
+    class FakeResponse:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"signedUrl": "https://signed"}
+
+    def fake_post(url, headers, json):
+        bodies.append(json)
+        return FakeResponse()
+
+    monkeypatch.setattr(gcs.id_token, "fetch_id_token", lambda request, audience: "token")
+    monkeypatch.setattr(gcs.requests, "post", fake_post)
+    return bodies
+
+
+def test_remote_mode_sends_download_and_expiration(monkeypatch, posted):
+    monkeypatch.setattr(gcs, "SIGNED_URL_MODE", "remote")
+
+    assert gcs.generate_signed_url("bucket", "a.mp4", expiration_time=120, download=True) == {"signedUrl": "https://signed"}
+    assert posted == [{"bucketName": "bucket", "fileName": "a.mp4", "download": True, "expirationTime": 120}]
+
+
+def test_fallback_after_local_failure_keeps_download_and_expiration(monkeypatch, posted):
+    def fail_locally(*args):
+        raise RuntimeError("no signer")
+
+    monkeypatch.setattr(gcs, "SIGNED_URL_MODE", "local")
+    monkeypatch.setattr(gcs, "_sign_locally", fail_locally)
+
+    gcs.generate_signed_url("bucket", "a.mp4", expiration_time=7200, download=True)
+
+    assert posted == [{"bucketName": "bucket", "fileName": "a.mp4", "download": True, "expirationTime": 7200}]
@@ -0,0 +1,95 @@
+from io import BytesIO
+
+from PIL import Image
+
+from movie_maker_agent.image_prep import normalize_image, target_size
+
+
+def _encode(image, format, orientation=None):
+    output = BytesIO()
+    if orientation is None:
+        image.save(output, format=format)
+    else:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(output, format=format, exif=exif)
+    return output.getvalue()
+
+
+def _decode(data):
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        return image
+
+
+def test_target_size():
+    assert target_size("16:9", 1280) == (1280, 720)
+    assert target_size("9:16", 1280) == (720, 1280)
+
+
+def test_normalize_returns_original_when_size_matches():
+    data = _encode(Image.new("RGB", (16, 9), (255, 0, 0)), "PNG")
+
+    assert normalize_image(data, (16, 9)) == (data, "image/png")
+
+
+def test_normalize_applies_exif_rotation_even_when_size_matches():
+    # 9x16 で保存され、表示時に 90 度回転 (Orientation=6) すると 16x9 になる画像
+    image = Image.new("RGB", (9, 16), (0, 0, 0))
+    image.paste((255, 255, 255), (0, 0, 9, 8))
+    data = _encode(image, "JPEG", orientation=6)
+
+    normalized, mime_type = normalize_image(data, (16, 9))
+    result = _decode(normalized)
+
+    assert mime_type == "image/jpeg"
+    assert normalized != data
+    assert result.size == (16, 9)
+    assert result.getexif().get(0x0112, 1) == 1
+    # 上半分 (白) は回転後に右側になる
+    assert result.getpixel((14, 4))[0] > 200
+    assert result.getpixel((1, 4))[0] < 50
+
+
+def test_normalize_crops_to_target_size():
+    data = _encode(Image.new("RGB", (40, 40), (0, 255, 0)), "PNG")
+
+    normalized, mime_type = normalize_image(data, (16, 9), fit="crop")
+
+    assert mime_type == "image/jpeg"
+    assert _decode(normalized).size == (16, 9)
+
+
+def test_normalize_pads_to_target_size():
+    data = _encode(Image.new("RGB", (40, 40), (0, 255, 0)), "PNG")
+
+    normalized, _ = normalize_image(data, (16, 9), fit="pad")
+    result = _decode(normalized)
+
+    assert result.size == (16, 9)
+    assert result.getpixel((0, 4))[1] < 50
+
+
+def test_normalize_returns_small_images_unchanged():
+    data = _encode(Image.new("RGB", (8, 8), (0, 255, 0)), "PNG")
+
+    assert normalize_image(data, (16, 9), fit="crop") == (data, "image/png")
+    assert normalize_image(data, (16, 9), fit="pad") == (data, "image/png")
+
+
+def test_normalize_converts_unsupported_small_images_without_resizing():
+    data = _encode(Image.new("RGB", (8, 6), (0, 255, 0)), "BMP")
+
+    normalized, mime_type = normalize_image(data, (16, 9))
+
+    assert mime_type == "image/jpeg"
+    assert _decode(normalized).size == (8, 6)
+
+
+def test_normalize_crop_does_not_enlarge_the_cropped_region():
+    # 幅だけが上限を超える画像は、16:9 にクロップした後も高さ 8 のまま (拡大しない)
+    data = _encode(Image.new("RGB", (64, 8), (0, 255, 0)), "PNG")
+
+    normalized, _ = normalize_image(data, (16, 9), fit="crop")
+
+    assert _decode(normalized).size == (14, 8)
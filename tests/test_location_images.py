@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from movie_maker_agent import location_images
+
+
+@pytest.fixture
+def cached_place(monkeypatch):
+    monkeypatch.setenv("GOOGLE_MAPS_API_KEY", "test-key")
+    monkeypatch.setattr(location_images, "LOCATION_MIRROR_BUCKET", "bucket")
+    monkeypatch.setattr(location_images, "LOCATION_MIRROR_FOLDER", "uploads")
+    place = {"place_id": "p1", "lat": 35.0, "lng": 139.0, "photo_references": ["ref1"]}
+
+    async def fake_get(key):
+        return dict(place)
+
+    async def fail_mirror(image_urls, user_id):
+        raise AssertionError("images must not be mirrored")
+
+    monkeypatch.setattr(location_images.place_cache, "get", fake_get)
+    monkeypatch.setattr(location_images, "_mirror_images", fail_mirror)
+
+
+def test_mirror_requires_user_id(cached_place):
+    result = asyncio.run(
+        location_images.get_location_images("東京タワー", SimpleNamespace(state={}), mirror_to_gcs=True)
+    )
+
+    assert result["status"] == "error"
+    assert result["image_urls"]
+
+
+def test_mirror_requires_shared_folder_configuration(cached_place, monkeypatch):
+    monkeypatch.setattr(location_images, "LOCATION_MIRROR_FOLDER", None)
+
+    result = asyncio.run(
+        location_images.get_location_images("東京タワー", SimpleNamespace(state={"user_id": "u1"}), mirror_to_gcs=True)
+    )
+
+    assert result["status"] == "error"
+    assert "FOLDER_NAME" in result["error_message"]
+
+
+def test_store_image_rejects_empty_user_id():
+    with pytest.raises(ValueError):
+        location_images._store_image(b"data", "image/jpeg", "")
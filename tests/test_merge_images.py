@@ -0,0 +1,20 @@
+import asyncio
+from types import SimpleNamespace
+
+from movie_maker_agent import agent
+
+
+def test_merge_images_asks_for_images_when_none_are_set():
+    result = asyncio.run(agent.merge_images(SimpleNamespace(state={}), "合成して"))
+
+    assert result["status"] == "error"
+    assert "gs://" in result["error_message"]
+
+
+def test_set_merge_images_keeps_only_gcs_uris():
+    context = SimpleNamespace(state={})
+
+    result = asyncio.run(agent.set_merge_images(context, ["gs://bucket/a.png", "https://example.com/b.png"]))
+
+    assert result == {"status": "success", "image_uris": ["gs://bucket/a.png"]}
+    assert context.state["merge_image_uris"] == ["gs://bucket/a.png"]
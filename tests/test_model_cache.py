@@ -0,0 +1,39 @@
+from google.adk.models import LlmResponse
+from google.genai import types
+
+from movie_maker_agent.model_cache import ModelResponseCache
+
+
+def _response(text):
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+
+
+def test_cache_returns_copies(clock):
+    cache = ModelResponseCache(max_entries=2, ttl=60, clock=clock)
+    cache.put("k", _response("a"))
+
+    first = cache.get("agent", "k")
+    first.content.parts[0].text = "changed"
+
+    assert cache.get("agent", "k").content.parts[0].text == "a"
+
+
+def test_cache_evicts_least_recently_used(clock):
+    cache = ModelResponseCache(max_entries=2, ttl=60, clock=clock)
+    cache.put("a", _response("a"))
+    cache.put("b", _response("b"))
+    cache.get("agent", "a")
+    cache.put("c", _response("c"))
+
+    assert cache.get("agent", "b") is None
+    assert cache.get("agent", "a") is not None
+    assert cache.evictions == 1
+
+
+def test_cache_expires_entries(clock):
+    cache = ModelResponseCache(max_entries=2, ttl=60, clock=clock)
+    cache.put("k", _response("a"))
+
+    clock.now = 61
+    assert cache.get("agent", "k") is None
+    assert cache.stats()["size"] == 0
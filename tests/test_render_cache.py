@@ -0,0 +1,36 @@
+import asyncio
+
+from movie_maker_agent import render_cache
+
+
+def test_run_shared_renders_once_and_lets_joiners_see_the_operation():
+    calls = []
+    joined = []
+
+    async def scenario():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def render(shared):
+            calls.append(list(shared.waiters))
+            shared.operation_name = "operations/1"
+            started.set()
+            await release.wait()
+            return "gs://bucket/video.mp4", None
+
+        async def on_join(shared):
+            joined.append((shared.operation_name, list(shared.waiters)))
+
+        first = asyncio.ensure_future(render_cache.run_shared("key", render, waiter="job1"))
+        await started.wait()
+        second = asyncio.ensure_future(render_cache.run_shared("key", render, waiter="job2", on_join=on_join))
+        await asyncio.sleep(0)
+        release.set()
+        return await first, await second
+
+    results = asyncio.run(scenario())
+
+    assert results == (("gs://bucket/video.mp4", None), ("gs://bucket/video.mp4", None))
+    assert calls == [["job1"]]
+    assert joined == [("operations/1", ["job1", "job2"])]
+    assert render_cache._inflight == {}
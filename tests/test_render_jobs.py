@@ -0,0 +1,47 @@
+from movie_maker_agent.render_jobs import STATUS_SUCCEEDED, RenderJobStore
+
+
+def test_store_without_path_records_nothing():
+    store = RenderJobStore(None)
+
+    store.record_submitted("job", "app", "user", "session", "scene1", "operations/1")
+
+    assert not store.enabled
+    assert store.list_unfinished() == []
+    assert store.take_unapplied("session") == []
+
+
+def test_take_unapplied_returns_finished_jobs_once(tmp_path):
+    store = RenderJobStore(str(tmp_path / "render_jobs.sqlite3"))
+    store.record_submitted("job1", "app", "user", "session", "scene1", "operations/1")
+    store.record_submitted("job2", "app", "user", "session", "scene2", "operations/2")
+    store.record_finished("operations/1", "gs://bucket/1.mp4", None)
+    store.record_finished("operations/2", "gs://bucket/2.mp4", None)
+
+    rows = store.take_unapplied("session", exclude_job_ids={"job2"})
+
+    assert [(row["scene_name"], row["status"]) for row in rows] == [("scene1", STATUS_SUCCEEDED)]
+    assert store.take_unapplied("session", exclude_job_ids={"job2"}) == []
+    assert [row["job_id"] for row in store.take_unapplied("session")] == ["job2"]
+
+
+def test_release_returns_jobs_to_unapplied(tmp_path):
+    store = RenderJobStore(str(tmp_path / "render_jobs.sqlite3"))
+    store.record_submitted("job1", "app", "user", "session", "scene1", "operations/1")
+    store.record_finished("operations/1", "gs://bucket/1.mp4", None)
+
+    rows = store.take_unapplied("session")
+    store.release(rows)
+
+    assert [row["job_id"] for row in store.take_unapplied("session")] == ["job1"]
+
+
+def test_jobs_sharing_an_operation_are_recorded_separately(tmp_path):
+    store = RenderJobStore(str(tmp_path / "render_jobs.sqlite3"))
+    store.record_submitted("job1", "app", "user1", "session1", "scene1", "operations/1")
+    store.record_submitted("job2", "app", "user2", "session2", "scene3", "operations/1")
+    store.record_finished("operations/1", "gs://bucket/user1/1.mp4", None)
+    store.record_finished("operations/1", "gs://bucket/user2/cached/1.mp4", None, job_id="job2")
+
+    assert [row["gcs_url"] for row in store.take_unapplied("session1")] == ["gs://bucket/user1/1.mp4"]
+    assert [row["gcs_url"] for row in store.take_unapplied("session2")] == ["gs://bucket/user2/cached/1.mp4"]
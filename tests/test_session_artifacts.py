@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from movie_maker_agent import session_artifacts
+
+
+class FakeContext:
+    def __init__(self, state=None):
+        self.state = dict(state or {})
+        self.artifacts = {}
+
+    async def load_artifact(self, filename, version=None):
+        versions = self.artifacts.get(filename, [])
+        if version is None:
+            return versions[-1] if versions else None
+        return versions[version] if version < len(versions) else None
+
+    async def save_artifact(self, filename, artifact):
+        self.artifacts.setdefault(filename, []).append(artifact)
+        return len(self.artifacts[filename]) - 1
+
+
+@pytest.fixture
+def artifacts_gcs(monkeypatch):
+    monkeypatch.setenv("ARTIFACTS_GCS", "gs://artifacts")
+
+
+def test_save_and_load_round_trip(artifacts_gcs):
+    context = FakeContext()
+
+    ref = asyncio.run(session_artifacts.save(context, "theme_list", {"scene1": "夜景"}))
+
+    assert context.state["theme_list_ref"] == ref
+    assert asyncio.run(session_artifacts.load(context, "theme_list")) == {"scene1": "夜景"}
+
+
+def test_load_returns_default_without_reference():
+    assert asyncio.run(session_artifacts.load(FakeContext(), "scene_config", {})) == {}
+
+
+def test_save_keeps_value_in_state_without_persistent_artifacts(monkeypatch):
+    monkeypatch.delenv("ARTIFACTS_GCS", raising=False)
+    context = FakeContext({"theme_list_ref": {"artifact": "theme_list.json", "version": 0, "sha256": "old"}})
+
+    assert asyncio.run(session_artifacts.save(context, "theme_list", {"scene1": "夜景"})) is None
+    assert context.state["theme_list"] == {"scene1": "夜景"}
+    assert context.state["theme_list_ref"] is None
+    assert context.artifacts == {}
+
+
+def test_load_falls_back_when_referenced_artifact_is_missing(artifacts_gcs):
+    context = FakeContext({
+        "movie_urls_ref": {"artifact": "movie_urls.json", "version": 3, "sha256": "missing"},
+        "movie_urls": {"scene1": ["gs://bucket/old.mp4"]},
+    })
+
+    assert asyncio.run(session_artifacts.load(context, "movie_urls", {})) == {"scene1": ["gs://bucket/old.mp4"]}
+    assert context.state["movie_urls_ref"] is None
+
+    # 次の保存で参照を作り直す
+    ref = asyncio.run(session_artifacts.save(context, "movie_urls", {"scene1": ["gs://bucket/new.mp4"]}))
+    assert context.state["movie_urls_ref"] == ref
+    assert asyncio.run(session_artifacts.load(context, "movie_urls")) == {"scene1": ["gs://bucket/new.mp4"]}
+
+
+def test_load_returns_default_when_artifact_and_state_are_missing(artifacts_gcs):
+    context = FakeContext({"scene_config_ref": {"artifact": "scene_config.json", "version": 0, "sha256": "gone"}})
+
+    assert asyncio.run(session_artifacts.load(context, "scene_config", {})) == {}
+
+
+def test_trim_movie_urls_keeps_newest():
+    assert session_artifacts.trim_movie_urls({"scene1": ["a", "b", "c"]}, max_per_scene=2) == {"scene1": ["b", "c"]}
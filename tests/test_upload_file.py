@@ -0,0 +1,63 @@
+import io
+
+import pytest
+from google.resumable_media import _upload
+
+from conftest import load_cloud_function
+
+
+@pytest.fixture
+def upload_file():
+    return load_cloud_function("upload_file")
+
+
+def _stream(module, data, piece=3):
+    return module._ChunkStream(iter([data[i:i + piece] for i in range(0, len(data), piece)]))
+
+
+def test_chunk_stream_reads_in_requested_sizes(upload_file):
+    stream = _stream(upload_file, b"0123456789")
+
+    assert stream.read(4) == b"0123"
+    assert stream.tell() == 4
+    assert stream.read(4) == b"4567"
+    assert stream.read() == b"89"
+    assert stream.read(4) == b""
+    assert stream.tell() == 10
+
+
+def test_chunk_stream_seeks_back_within_last_chunk(upload_file):
+    stream = _stream(upload_file, b"0123456789")
+    stream.read(4)
+    stream.read(4)
+
+    assert stream.seek(5) == 5
+    assert stream.read(4) == b"5678"
+    assert stream.seek(-2, io.SEEK_CUR) == 7
+    assert stream.read() == b"789"
+
+
+def test_chunk_stream_refuses_to_seek_before_last_chunk(upload_file):
+    stream = _stream(upload_file, b"0123456789")
+    stream.read(4)
+    stream.read(4)
+
+    with pytest.raises(io.UnsupportedOperation):
+        stream.seek(3)
+    with pytest.raises(io.UnsupportedOperation):
+        stream.seek(0, io.SEEK_END)
+    assert stream.tell() == 8
+
+
+def test_chunk_stream_supports_resumable_upload_recovery(upload_file):
+    stream = _stream(upload_file, b"abcdefghij")
+
+    start, payload, _ = _upload.get_next_chunk(stream, 4, None)
+    assert (start, payload) == (0, b"abcd")
+    start, payload, _ = _upload.get_next_chunk(stream, 4, None)
+    assert (start, payload) == (4, b"efgh")
+
+    # 2つ目のチャンクの送信中に失敗し、サーバーには 6 バイトまで保存されていた場合
+    stream.seek(6)
+    start, payload, _ = _upload.get_next_chunk(stream, 4, None)
+    assert (start, payload) == (6, b"ghij")
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from conftest import ROOT
+
+# Cloud Functions は関数のディレクトリだけがデプロイされるため、共有モジュールはコピーを置いている
+VENDORED = {
+    "cloud_functions/shared/function_auth.py": ["create_signed_url", "list_files", "upload_file"],
+    "shared/storage_pool.py": ["create_signed_url", "list_files", "upload_file"],
+    "shared/user_manifest.py": ["list_files", "upload_file"],
+}
+
+
+@pytest.mark.parametrize(
+    "source, function",
+    [(source, function) for source, functions in VENDORED.items() for function in functions],
+)
+def test_vendored_copy_matches_shared_module(source, function):
+    copy = os.path.join(ROOT, "cloud_functions", function, os.path.basename(source))
+
+    assert not os.path.islink(copy), f"{copy} must be a real file so that it is deployed with the function"
+    with open(os.path.join(ROOT, source), "rb") as expected, open(copy, "rb") as actual:
+        assert actual.read() == expected.read(), f"Copy {source} to cloud_functions/{function}/"
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from movie_maker_agent.veo_scheduler import AsyncTokenBucket, is_quota_error
+
+
+@pytest.mark.parametrize("rate, capacity", [(0, 5), (-1, 5), (10, 0)])
+def test_token_bucket_rejects_invalid_settings(rate, capacity):
+    with pytest.raises(ValueError):
+        AsyncTokenBucket(rate, capacity)
+
+
+def test_token_bucket_allows_burst_then_refills(clock):
+    bucket = AsyncTokenBucket(60, 2, clock=clock)
+
+    async def take(count):
+        for _ in range(count):
+            await bucket.acquire()
+
+    asyncio.run(take(2))
+    assert bucket._tokens == 0
+
+    # 60回/分 = 1秒に1トークン。容量を超えては溜まらない
+    clock.now = 10.0
+    bucket._refill()
+    assert bucket._tokens == 2
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        ({"code": 8, "message": "quota"}, True),
+        ({"code": 3, "message": "RESOURCE_EXHAUSTED"}, True),
+        ({"code": 3, "message": "invalid argument"}, False),
+        (None, False),
+    ],
+)
+def test_is_quota_error(error, expected):
+    assert is_quota_error(error) is expected